@@ -7,25 +7,45 @@
 
 
 class AST(object):
+    """ children names the attributes holding the nodes below this one(or
+        lists of them), in the order they run. See visitor.py.
+    """
+    children = ()
 
     def __init__(self):
         pass
 
 
 class Program(AST):
+    """ imports names the modules the program links against """
+    children = ('command',)
 
-    def __init__(self, command):
+    def __init__(self, command, imports=None):
         self.command = command
+        self.imports = imports or []
 
     def __str__(self):
         return 'Program(%s)' % (str(self.command))
 
 
+class Module(AST):
+    """ A separately compiled module: imports, then the functions it exports """
+    children = ('declaration',)
+
+    def __init__(self, imports, declaration):
+        self.imports = imports
+        self.declaration = declaration
+
+    def __str__(self):
+        return 'Module(%s,%s)' % (str(self.imports), str(self.declaration))
+
+
 class Command(AST):
     pass
 
 
 class AssignCommand(Command):
+    children = ('variable', 'expression')
 
     def __init__(self, variable, expression):
         self.variable = variable
@@ -37,6 +57,8 @@ class AssignCommand(Command):
 
 class CallCommand(Command):
     """ Holds a list of expressions """
+    children = ('expr_list',)
+
     def __init__(self, identifier, expr_list):
         self.identifier = identifier
         self.expr_list = expr_list
@@ -46,6 +68,7 @@ class CallCommand(Command):
 
 
 class SequentialCommand(Command):
+    children = ('command1', 'command2')
 
     def __init__(self, command1, command2):
         self.command1 = command1
@@ -56,6 +79,7 @@ class SequentialCommand(Command):
 
 
 class IfCommand(Command):
+    children = ('expression', 'command1', 'command2')
 
     def __init__(self, expression, command1, command2):
         self.expression = expression
@@ -67,6 +91,11 @@ class IfCommand(Command):
 
 
 class WhileCommand(Command):
+    """ counter is set by optimize.RangeLoops on a loop stepping a variable
+        by a constant: (variable, step, the command stepping it)
+    """
+    children = ('expression', 'command')
+    counter = None
 
     def __init__(self, expression, command):
         self.expression = expression
@@ -77,6 +106,7 @@ class WhileCommand(Command):
 
 
 class LetCommand(Command):
+    children = ('declaration', 'command')
 
     def __init__(self, declaration, command):
         self.declaration = declaration
@@ -87,6 +117,8 @@ class LetCommand(Command):
 
 
 class ReturnCommand(Command):
+    children = ('expression',)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -108,6 +140,7 @@ class IntegerExpression(Expression):
 
 
 class VnameExpression(Expression):
+    children = ('variable',)
 
     def __init__(self, variable):
         self.variable = variable
@@ -117,6 +150,7 @@ class VnameExpression(Expression):
 
 
 class CallExpression(Expression):
+    children = ('expression',)
 
     def __init__(self, identifier, expression):
         self.identifier = identifier
@@ -127,6 +161,7 @@ class CallExpression(Expression):
 
 
 class UnaryExpression(Expression):
+    children = ('expression',)
 
     def __init__(self, operator, expression):
         self.operator = operator
@@ -137,6 +172,7 @@ class UnaryExpression(Expression):
 
 
 class BinaryExpression(Expression):
+    children = ('expr1', 'expr2')
 
     def __init__(self, expr1, oper, expr2):
         self.expr1 = expr1
@@ -161,6 +197,7 @@ class Declaration(AST):
 
 
 class ConstDeclaration(Declaration):
+    children = ('expression',)
 
     def __init__(self, identifier, expression):
         self.identifier = identifier
@@ -171,6 +208,7 @@ class ConstDeclaration(Declaration):
 
 
 class VarDeclaration(Declaration):
+    children = ('type_denoter',)
 
     def __init__(self, identifier, type_denoter):
         self.identifier = identifier
@@ -181,6 +219,7 @@ class VarDeclaration(Declaration):
 
 
 class FunctionDeclaration(Declaration):
+    children = ('command',)
 
     def __init__(self, name, arg_list, return_type_denoter, command):
         self.name = name
@@ -197,6 +236,7 @@ class FunctionDeclaration(Declaration):
 
 
 class SequentialDeclaration(Declaration):
+    children = ('decl1', 'decl2')
 
     def __init__(self, decl1, decl2):
         self.decl1 = decl1
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+# Microbenchmarks for the Mini Triangle optimizer
+#
+# Each benchmark times the code a rewrite removes against the code it
+# produces, on whichever Python runs this file. Run it with the Python a
+# backend targets(2 for byteplay) to see which rewrites pay off there; the
+# results are recorded in optimize.PROFITABLE_REWRITES.
+#
+# Usage: python bench.py [name-prefix ...]
+#
+# Author: Wilson Giese
+#
+
+import sys
+import timeit
+
+# BINARY_DIVIDE is what codegen emits for '/' on Python 2
+DIVIDE = '/' if sys.version_info[0] == 2 else '//'
+
+# Operand values for the expression benchmarks, both signs
+OPERANDS = ['x = 7', 'x = 12345', 'x = -12345', 'x = 10 ** 6', 'x = -3']
+
+INDUCTION_ONE_USE = ('''
+i = 0
+s = 0
+while i < 1000:
+    s = s + i * k
+    i = i + 1
+''', '''
+i = 0
+s = 0
+t = i * k
+while i < 1000:
+    s = s + t
+    i = i + 1
+    t = t + k
+''')
+
+INDUCTION_TWO_USES = ('''
+i = 0
+s = 0
+while i < 1000:
+    s = s + i * k
+    s = s - i * k
+    i = i + 1
+''', '''
+i = 0
+s = 0
+t = i * k
+while i < 1000:
+    s = s + t
+    s = s - t
+    i = i + 1
+    t = t + k
+''')
+
+RANGE = 'xrange' if sys.version_info[0] == 2 else 'range'
+
+# A counting while loop, and the range loop optimize.RangeLoops makes of it
+COUNTING_LOOP = ('''
+i = 0
+s = 0
+while i < n:
+    s = s + i
+    i = i + 1
+''', '''
+i = 0
+s = 0
+try:
+    r = iter(%s(i, n, 1))
+except:
+    pass
+for i in r:
+    s = s + i
+if i < n:
+    i = i + 1
+''' % (RANGE))
+
+# (name, setups, before, after, number)
+BENCHMARKS = [('strength.double', OPERANDS, 'x * 2', 'x + x', 1000000),
+              ('strength.mul_shift', OPERANDS, 'x * 8', 'x << 3', 1000000),
+              ('strength.div_shift', OPERANDS, 'x %s 8' % (DIVIDE), 'x >> 3', 1000000),
+              ('strength.mod_mask', OPERANDS, 'x % 8', 'x & 7', 1000000),
+              ('strength.induction.1use', ['k = 37'],
+               INDUCTION_ONE_USE[0], INDUCTION_ONE_USE[1], 2000),
+              ('strength.induction.2uses', ['k = 37'],
+               INDUCTION_TWO_USES[0], INDUCTION_TWO_USES[1], 2000),
+              ('range.0trips', ['n = 0'], COUNTING_LOOP[0], COUNTING_LOOP[1], 100000),
+              ('range.10trips', ['n = 10'], COUNTING_LOOP[0], COUNTING_LOOP[1], 100000),
+              ('range.1000trips', ['n = 1000'],
+               COUNTING_LOOP[0], COUNTING_LOOP[1], 2000)]
+
+
+def measure(setups, stmt, number, repeat=7):
+    """ Best time of stmt, summed over every setup """
+    return sum(min(timeit.repeat(stmt, setup, number=number, repeat=repeat))
+               for setup in setups)
+
+
+def run(prefixes):
+    print('Python %d.%d.%d' % sys.version_info[:3])
+    print('%-28s %12s %12s %8s' % ('benchmark', 'before(ns)', 'after(ns)', 'speedup'))
+    for name, setups, before, after, number in BENCHMARKS:
+        if prefixes and not [p for p in prefixes if name.startswith(p)]:
+            continue
+        per = 1e9 / (number * len(setups))
+        t_before = measure(setups, before, number)
+        t_after = measure(setups, after, number)
+        print('%-28s %12.1f %12.1f %7.2fx' % (name, t_before * per,
+                                              t_after * per, t_before / t_after))
+
+
+if __name__ == '__main__':
+    run(sys.argv[1:])
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# Thin client for the Mini Triangle compile server
+#
+# Takes the same arguments as 'python codegen.py' and writes the same .pyc,
+# but has the resident server(server.py) do the compiling. Startup is what
+# this is for, so it imports nothing beyond socket(not even argparse); if no
+# server is listening it falls back to compiling in process with codegen.
+# So do the options whose output only the compiling process prints
+# (--time-passes, --report, --report-json and --dump-ir).
+#
+# Usage: python client.py [-s socket] [codegen.py options] /path/to/source.mt
+#
+# Author: Wilson Giese
+#
+
+import os
+import socket
+import sys
+
+BACKENDS = ['byteplay', 'pyast']
+
+# Optimization flags and their levels(codegen.py's -O is -O2)
+LEVEL_FLAGS = {'-O': 2, '-O0': 0, '-O1': 1, '-O2': 2}
+
+# Options taking a value, by the request field they set
+VALUE_FLAGS = {'-b': 'backend',
+               '--backend': 'backend',
+               '--enable': 'enable',
+               '--disable': 'disable',
+               '--max-steps': 'max_steps',
+               '--max-depth': 'max_depth',
+               '--unroll-factor': 'unroll_factor',
+               '--known-input': 'known_inputs',
+               '-I': 'include',
+               '--include': 'include',
+               '--report-json': 'report_json',
+               '-s': 'socket',
+               '--socket': 'socket'}
+
+# Fields given once per value, and those holding integers
+LIST_FIELDS = ['enable', 'disable', 'known_inputs', 'include']
+INT_FIELDS = ['max_steps', 'max_depth', 'unroll_factor', 'known_inputs']
+
+# Options only an in-process compile can honour
+LOCAL_FLAGS = ['--time-passes', '--report', '--dump-ir']
+
+
+def default_socket_path():
+    return os.environ.get('MT_SOCKET',
+                          '/tmp/minitriangle-%d.sock' % (os.getuid()))
+
+
+def request(path, text, backend='byteplay', level=0, enable=(), disable=(),
+            max_steps=None, max_depth=None, unroll_factor=None, deep=False,
+            known_inputs=(), include=('.',)):
+    """ Send one compile request; return a (status, payload) pair.
+        include is the module search path(absolute directories).
+    """
+    names = lambda l: ','.join([str(n) for n in l]) or '-'
+    limit = lambda n: '-' if n is None else str(n)
+    options = '%s %d %s %s %s %s %s %d %s' % (backend, level, names(enable),
+                                              names(disable), limit(max_steps),
+                                              limit(max_depth),
+                                              limit(unroll_factor), deep,
+                                              names(known_inputs))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(b'%s\n%s\n%d\n' % (options, os.pathsep.join(include),
+                                         len(text)) + text)
+        response = sock.makefile('rb')
+        status, length = response.readline().split()
+        payload = response.read(int(length))
+    finally:
+        sock.close()
+    return status, payload
+
+
+def is_int(value):
+    return value.lstrip('-').isdigit() and value.count('-') <= 1
+
+
+def parse_args(argv):
+    """ Return (source, options, socket path, local, codegen arguments), or
+        None on bad usage. options are request()'s keyword arguments. local
+        is set when only an in-process compile can honour them, which is
+        given the codegen arguments.
+    """
+    source = None
+    options = {'backend': 'byteplay', 'level': 0, 'deep': False,
+               'max_steps': None, 'max_depth': None, 'unroll_factor': None}
+    for field in LIST_FIELDS:
+        options[field] = []
+    path = default_socket_path()
+    local = False
+    codegen_argv = []
+
+    argv = list(argv)
+    while argv:
+        arg = argv.pop(0)
+        flag, value = arg, None
+        if arg.startswith('--') and '=' in arg:
+            flag, value = arg.split('=', 1)
+        elif arg.startswith('-I') and len(arg) > 2:
+            flag, value = '-I', arg[2:]
+        if flag in VALUE_FLAGS:
+            if value is None:
+                if not argv:
+                    return None
+                value = argv.pop(0)
+            field = VALUE_FLAGS[flag]
+            if field in INT_FIELDS:
+                if not is_int(value):
+                    return None
+                value = int(value)
+            if field == 'socket':
+                path = value
+                continue
+            elif field == 'report_json':
+                local = True
+            elif field in LIST_FIELDS:
+                options[field].append(value)
+            else:
+                options[field] = value
+            codegen_argv += [flag, str(value)]
+        elif arg in LEVEL_FLAGS:
+            options['level'] = LEVEL_FLAGS[arg]
+            codegen_argv.append(arg)
+        elif arg == '--deep-recursion':
+            options['deep'] = True
+            codegen_argv.append(arg)
+        elif arg in LOCAL_FLAGS:
+            local = True
+            codegen_argv.append(arg)
+        elif source is None and not arg.startswith('-'):
+            source = arg
+            codegen_argv.append(arg)
+        else:
+            return None
+
+    if source is None or options['backend'] not in BACKENDS:
+        return None
+    # Modules are looked for beside the source first, as codegen.py does;
+    # the server has its own working directory
+    options['include'] = [os.path.abspath(d) for d in
+                          [os.path.dirname(source) or '.'] + options['include']]
+    return source, options, path, local, codegen_argv
+
+
+def own_socket(path):
+    """ Is path there, and this user's? A socket another user made could
+        hand back any code.
+    """
+    try:
+        return os.stat(path).st_uid == os.getuid()
+    except OSError:
+        return False
+
+
+def compile_here(codegen_argv):
+    import codegen
+    codegen.main(codegen.arg_parser().parse_args(codegen_argv))
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    if args is None:
+        print('Usage: python %s [-s socket] [-b backend] [-O[level]] '
+              '[--enable pass] [--disable pass] [--unroll-factor N] '
+              '[--max-steps N] [--max-depth N] [--deep-recursion] '
+              '[-I dir] [--known-input N] [--time-passes] [--report] '
+              '[--report-json file] [--dump-ir] /path/to/source' % (sys.argv[0]))
+        sys.exit(2)
+    source_path, options, path, local, codegen_argv = args
+
+    if local or not own_socket(path):
+        compile_here(codegen_argv)
+
+    try:
+        source = open(source_path, 'r')
+    except IOError:
+        print('Could not find source file: %s' % (source_path))
+        sys.exit(0)
+
+    # Split path to get name, and file info
+    name, exten = os.path.splitext(source_path)
+
+    if exten != '.mt':
+        print('Error: Unrecoginized file type: Cannot compile \'%s\'' % (exten))
+        sys.exit(0)
+
+    text = source.read()
+    source.close()
+
+    try:
+        status, payload = request(path, text, **options)
+    except socket.error:
+        # No server running; compile here instead
+        compile_here(codegen_argv)
+
+    if status != b'ok':
+        print(payload)
+        sys.exit(0)
+
+    with open(name + '.pyc', 'wb') as pyc_f:
+        pyc_f.write(payload)
@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+#
+# Closure compiler for Mini Triangle
+#
+# Turns the AST into nested Python closures once, then runs those directly.
+# No bytecode is generated and nothing is written to disk, so this works
+# without byteplay or a writable .pyc location.
+#
+# Every variable is resolved to a slot in a per-call frame list at compile
+# time. Slot 0 of each frame holds the return value; a command closure
+# returns True once a return command has run so enclosing commands stop.
+#
+# A Mini Triangle call runs as several nested Python calls: the function,
+# then a closure for each command and expression down to the next call. So
+# programs can recurse as deep here as compiled to bytecode(one Python call
+# per call), a run raises the recursion limit by that factor, as far as
+# the C stack allows(past it Python 2 crashes rather than raising), and
+# puts it back once no run needs it.
+#
+# Author: Wilson Giese
+#
+
+import sys
+import threading
+
+import ast
+import parallel
+import parser
+import scanner
+from errors import *
+from scope import Scoped
+
+RETURN_SLOT = 0
+
+# Recursion limit compiled programs get, in Mini Triangle calls
+RECURSION_LIMIT = sys.getrecursionlimit()
+
+# Most the recursion limit is raised to: the Python calls the main thread's
+# stack holds, allowing twice the C stack a call takes on Python 2(about
+# 450 bytes). Assumes the usual 8MB stack where it is unlimited or unknown.
+FRAME_BYTES = 1024
+try:
+    import resource
+    STACK_BYTES = resource.getrlimit(resource.RLIMIT_STACK)[0]
+except (ImportError, ValueError):
+    STACK_BYTES = -1
+if STACK_BYTES <= 0:
+    STACK_BYTES = 8 << 20
+MAX_RECURSION_LIMIT = max(STACK_BYTES // FRAME_BYTES, RECURSION_LIMIT)
+
+
+class RecursionLimits(object):
+    """ Keeps the interpreter's recursion limit as high as the highest any
+        running program needs, and puts the host's back when none is
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Limit each program running(in any thread) needs
+        self.running = []
+        # The limit before the first of them started
+        self.saved = None
+
+    def enter(self, limit):
+        with self.lock:
+            if not self.running:
+                self.saved = sys.getrecursionlimit()
+            self.running.append(limit)
+            sys.setrecursionlimit(max(self.running + [self.saved]))
+
+    def leave(self, limit):
+        with self.lock:
+            self.running.remove(limit)
+            sys.setrecursionlimit(max(self.running + [self.saved]))
+
+
+recursion_limits = RecursionLimits()
+
+if sys.version_info[0] >= 3:
+    def getint():
+        return int(input())
+else:
+    getint = input
+
+
+def putint(value):
+    sys.stdout.write('%s\n' % (value,))
+
+
+# Closure factories for each binary operator(including the shifts and mask
+# only the optimizer introduces). The second table covers a constant right
+# operand, which saves a call for things like 'n - 1'.
+BINARY_OPERATORS = {'+': lambda a, b: lambda f: a(f) + b(f),
+                    '-': lambda a, b: lambda f: a(f) - b(f),
+                    '*': lambda a, b: lambda f: a(f) * b(f),
+                    '/': lambda a, b: lambda f: a(f) // b(f),
+                    '\\': lambda a, b: lambda f: a(f) % b(f),
+                    '<<': lambda a, b: lambda f: a(f) << b(f),
+                    '>>': lambda a, b: lambda f: a(f) >> b(f),
+                    '&': lambda a, b: lambda f: a(f) & b(f),
+                    '<': lambda a, b: lambda f: a(f) < b(f),
+                    '>': lambda a, b: lambda f: a(f) > b(f),
+                    '=': lambda a, b: lambda f: a(f) == b(f)}
+
+CONST_OPERATORS = {'+': lambda a, k: lambda f: a(f) + k,
+                   '-': lambda a, k: lambda f: a(f) - k,
+                   '*': lambda a, k: lambda f: a(f) * k,
+                   '/': lambda a, k: lambda f: a(f) // k,
+                   '\\': lambda a, k: lambda f: a(f) % k,
+                   '<<': lambda a, k: lambda f: a(f) << k,
+                   '>>': lambda a, k: lambda f: a(f) >> k,
+                   '&': lambda a, k: lambda f: a(f) & k,
+                   '<': lambda a, k: lambda f: a(f) < k,
+                   '>': lambda a, k: lambda f: a(f) > k,
+                   '=': lambda a, k: lambda f: a(f) == k}
+
+UNARY_OPERATORS = {'+': lambda a: lambda f: +a(f),
+                   '-': lambda a: lambda f: -a(f)}
+
+
+class ClosureGen(Scoped):
+    """ Closure compiler for Mini-Triangle """
+
+    def __init__(self, tree):
+        Scoped.__init__(self)
+        self.tree = tree
+        # Slot maps(mangled name -> frame index), one per function being compiled
+        self.slot_maps = []
+        self.slot_maps.append({})
+        # Function bindings, one single item list per function name.
+        # Declarations fill them at run time, calls read them.
+        self.function_cells = {}
+
+    def __str__(self):
+        return 'ClosureGen(%s)' % (str(self.tree))
+
+    def generate(self):
+        """ Compile the program and return it as a callable """
+        if type(self.tree) is not ast.Program:
+            raise CodeGeneratorError(self.tree)
+        if self.tree.imports:
+            raise LinkError('Modules need the byteplay backend')
+
+        body = self.gen_command(self.tree.command)
+        size = len(self.slot_maps[0]) + 1
+        limit = min(RECURSION_LIMIT * call_frames(self.tree), MAX_RECURSION_LIMIT)
+
+        def gencode():
+            frame = [None] * size
+            frame[RETURN_SLOT] = 0
+            recursion_limits.enter(limit)
+            try:
+                body(frame)
+            finally:
+                recursion_limits.leave(limit)
+            return frame[RETURN_SLOT]
+
+        return gencode
+
+    def gen_command(self, node):
+        """ Build a closure for all command types. """
+        type_ = type(node)
+
+        if type_ is ast.SequentialCommand:
+            commands = []
+            while type(node) is ast.SequentialCommand:
+                commands.append(node.command2)
+                node = node.command1
+            commands.append(node)
+            commands = [self.gen_command(c) for c in reversed(commands)]
+
+            def run(f):
+                for c in commands:
+                    if c(f):
+                        return True
+                return False
+            return run
+        elif type_ is ast.AssignCommand:
+            expr = self.gen_expression(node.expression)
+            vname = self.lookup_var(node.variable.identifier)
+            if vname is None:
+                raise InvalidExpressionError(node)
+            slot = self.slot(vname)
+
+            def run(f):
+                f[slot] = expr(f)
+            return run
+        elif type_ is ast.CallCommand:
+            call = self.gen_call(node)
+
+            def run(f):
+                call(f)
+            return run
+        elif type_ is ast.IfCommand:
+            test = self.gen_expression(node.expression)
+            command1 = self.gen_command(node.command1)
+            command2 = self.gen_command(node.command2)
+
+            def run(f):
+                if test(f):
+                    return command1(f)
+                return command2(f)
+            return run
+        elif type_ is ast.WhileCommand:
+            test = self.gen_expression(node.expression)
+            command = self.gen_command(node.command)
+
+            def run(f):
+                while test(f):
+                    if command(f):
+                        return True
+                return False
+            return run
+        elif type_ is ast.LetCommand:
+            self.raise_scope()
+            declaration = self.gen_declaration(node.declaration)
+            command = self.gen_command(node.command)
+            self.lower_scope()
+
+            def run(f):
+                declaration(f)
+                return command(f)
+            return run
+        elif type_ is ast.ReturnCommand:
+            expr = self.gen_expression(node.expression)
+
+            def run(f):
+                f[RETURN_SLOT] = expr(f)
+                return True
+            return run
+
+        else:  # Unexpected node. Raise a Code Generation Exception.
+            raise CodeGeneratorError(node)
+
+    def gen_expression(self, node):
+        """ Build a closure for an expression """
+        type_ = type(node)
+
+        if type_ is ast.BinaryExpression:
+            if node.oper not in BINARY_OPERATORS:
+                raise InvalidExpressionError(node)
+            expr1 = self.gen_expression(node.expr1)
+            if type(node.expr2) is ast.IntegerExpression:
+                return CONST_OPERATORS[node.oper](expr1, node.expr2.value)
+            return BINARY_OPERATORS[node.oper](expr1,
+                                               self.gen_expression(node.expr2))
+        elif type_ is ast.IntegerExpression:
+            value = node.value
+            return lambda f: value
+        elif type_ is ast.VnameExpression:
+            vname = self.lookup_var(node.variable.identifier)
+            if vname is None:
+                raise InvalidExpressionError(node)
+            slot = self.slot(vname)
+            return lambda f: f[slot]
+        elif type_ is ast.UnaryExpression:
+            # Only supporting positive or negative unary
+            if node.operator not in UNARY_OPERATORS:
+                raise InvalidExpressionError(node)
+            return UNARY_OPERATORS[node.operator](self.gen_expression(node.expression))
+        elif type_ is ast.CallCommand:
+            return self.gen_call(node)
+        else:
+            raise InvalidExpressionError(node)
+
+    def gen_declaration(self, node):
+        """ Build a closure for a declaration """
+        type_ = type(node)
+
+        if type_ is ast.ConstDeclaration:
+            expr = self.gen_expression(node.expression)
+            # Load const into env
+            cur_env = self.get_current_env()
+            cur_env[node.identifier] = ('Integer', False)
+            slot = self.slot(self.add_var(node.identifier))
+
+            def run(f):
+                f[slot] = expr(f)
+            return run
+        elif type_ is ast.VarDeclaration:
+            # Declare variable in environment
+            self.env_load(node.identifier, node.type_denoter, True)
+            slot = self.slot(self.add_var(node.identifier))
+
+            def run(f):
+                f[slot] = None
+            return run
+        elif type_ is ast.SequentialDeclaration:
+            decl1 = self.gen_declaration(node.decl1)
+            decl2 = self.gen_declaration(node.decl2)
+
+            def run(f):
+                decl1(f)
+                decl2(f)
+            return run
+        elif type_ is ast.FunctionDeclaration:
+            return self.gen_function(node)
+        else:
+            raise InvalidDeclarationError(node)
+
+    def gen_function(self, node):
+        # Add func name early incase of recursive calls
+        self.declared_functions[node.name] = (node.arg_list, node.return_type_denoter)
+        cell = self.function_cell(node.name)
+
+        self.raise_scope()
+        self.slot_maps.append({})
+        arg_slots = []
+        for arg in node.arg_list:
+            vname = arg[0].identifier
+            self.env_load(vname, arg[1], True)
+            arg_slots.append(self.slot(self.add_var(vname)))
+        body = self.gen_command(node.command)
+        size = len(self.slot_maps.pop()) + 1
+        self.lower_scope()
+
+        argc = len(arg_slots)
+        end = argc + 1
+
+        def function(*args):
+            frame = [None] * size
+            frame[1:end] = args
+            body(frame)
+            return frame[RETURN_SLOT]
+        function.__name__ = node.name
+
+        def run(f):
+            cell[0] = function
+        return run
+
+    def gen_call(self, node):
+        """ Build a closure calling a builtin or program defined function """
+        if node.identifier == 'getint':
+            if len(node.expr_list) != 0:
+                raise IllegalFunctionArgumentError('getint', 0)
+            return lambda f: getint()
+        elif node.identifier == 'putint':
+            if len(node.expr_list) != 1:
+                raise IllegalFunctionArgumentError('putint', 1)
+            expr = self.gen_expression(node.expr_list[0])
+            return lambda f: putint(expr(f))
+        elif node.identifier == 'parmap':
+            cell = self.function_cell(self.mapped_function(node))
+            low = self.gen_expression(node.expr_list[1])
+            high = self.gen_expression(node.expr_list[2])
+            return lambda f: parallel.parmap(cell[0], low(f), high(f))
+        elif self.declared_functions.get(node.identifier) is not None:
+            argc = len(self.declared_functions.get(node.identifier)[0])
+            if argc != len(node.expr_list):
+                raise IllegalFunctionArgumentError(node.identifier, argc)
+
+            cell = self.function_cell(node.identifier)
+            args = [self.gen_expression(e) for e in node.expr_list]
+            if argc == 1:
+                arg = args[0]
+                return lambda f: cell[0](arg(f))
+            elif argc == 2:
+                arg1, arg2 = args
+                return lambda f: cell[0](arg1(f), arg2(f))
+            return lambda f: cell[0](*[a(f) for a in args])
+        else:
+            raise InvalidExpressionError(node)
+
+    # SLOT FUNCTIONS
+    def slot(self, vname):
+        """ Return the frame slot of a variable in the function being compiled """
+        slots = self.slot_maps[-1]
+        if vname not in slots:
+            slots[vname] = len(slots) + 1  # Slot 0 is the return value
+        return slots[vname]
+
+    def function_cell(self, name):
+        cell = self.function_cells.get(name)
+        if cell is None:
+            cell = [None]
+            self.function_cells[name] = cell
+        return cell
+
+
+def call_frames(tree):
+    """ Most Python calls a Mini Triangle call in tree can nest: from the
+        function down to the closure making its deepest call
+    """
+    most = 1
+    work = [(tree, 0)]
+    while work:
+        node, depth = work.pop()
+        type_ = type(node)
+        if type_ is ast.CallCommand:
+            # A call command runs the call's closure, which calls the function
+            most = max(most, depth + 1)
+        elif type_ is ast.FunctionDeclaration:
+            depth = 1  # The function itself
+        elif type_ is ast.SequentialCommand:
+            # One closure runs a whole left-nested sequence
+            if type(node.command1) is ast.SequentialCommand:
+                work.append((node.command1, depth))
+            else:
+                work.append((node.command1, depth + 1))
+            work.append((node.command2, depth + 1))
+            continue
+        for name in node.children:
+            child = getattr(node, name)
+            if type(child) is list:
+                work.extend([(c, depth + 1) for c in child])
+            else:
+                work.append((child, depth + 1))
+    return most
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) == 2:
+        try:
+            with open(sys.argv[1], 'r') as source:
+                text = source.read()
+        except IOError:
+            print('Could not find source file: %s' % (sys.argv[1]))
+            sys.exit(0)
+
+        try:
+            tree = parser.Parser(scanner.Scanner(text).scan_stream()).parse()
+        except (scanner.ScannerError, parser.ParserException) as e:
+            print('Could not compile source:')
+            print(e)
+            sys.exit(0)
+
+        ClosureGen(tree).generate()()
+    else:
+        print('Usage: python %s /path/to/source' % (sys.argv[0]))
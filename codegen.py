@@ -10,265 +10,501 @@ from types import CodeType, FunctionType
 
 import imp
 import marshal
+import mmap
 import os
 import struct
 import sys
 import time
 
 import ast
+import compact
+import counting
+import ir
+import linker
+import optimize as optimizer
+import parallel
 import parser
 import scanner
-
-
-class CodeGeneratorError(Exception):
-    """ Code Generator Exception """
-
-    def __init__(self, ast):
-        self.ast = ast
-
-    def __str__(self):
-        return 'Error at ast node: %s' % (str(self.ast))
-
-
-class TypeMismatchError(CodeGeneratorError):
-    """ Exception for type mismatch(i.e Integer := String) """
-
-    def __init__(self, ast):
-        self.ast = ast
-
-    def __str__(self):
-        return 'Error at ast node; Type Mismatch: %s' % (str(self.ast))
-
-
-class InvalidExpressionError(CodeGeneratorError):
-    """ Exception for invalid expressions """
-
-    def __init__(self, ast):
-        self.ast = ast
-
-    def __str__(self):
-        return 'Error at ast node; Invalid Expression: %s' % (str(self.ast))
-
-
-class InvalidDeclarationError(CodeGeneratorError):
-    """ Exception for invalid declarations """
-
-    def __init__(self, ast):
-        self.ast = ast
-
-    def __str__(self):
-        return 'Error at ast node; Invalid Declaration: %s' % (str(self.ast))
-
-
-class UnknownFunctionError(CodeGeneratorError):
-    """ Exception for unknown function calls """
-
-    def __init__(self, func_name):
-        self.func_name = func_name
+import specialize
+import trampoline
+import visitor
+from errors import *
+from scope import Scoped
+
+
+# The instruction computing each IR operator, as a byteplay
+# (opcode, argument) pair
+OPERATOR_CODES = {'+': (BINARY_ADD, None),
+                  '-': (BINARY_SUBTRACT, None),
+                  '*': (BINARY_MULTIPLY, None),
+                  '/': (BINARY_DIVIDE, None),
+                  '\\': (BINARY_MODULO, None),
+                  '<': (COMPARE_OP, '<'),
+                  '>': (COMPARE_OP, '>'),
+                  '=': (COMPARE_OP, '=='),
+                  # Operators only introduced by the optimizer
+                  '<<': (BINARY_LSHIFT, None),
+                  '>>': (BINARY_RSHIFT, None),
+                  '&': (BINARY_AND, None)}
+
+UNARY_CODES = {'+': (UNARY_POSITIVE, None),
+               '-': (UNARY_NEGATIVE, None)}
+
+# Program globals holding each budget counter of a metered program
+BUDGET_COUNTERS = {'steps': '_steps_',
+                   'depth': '_depth_'}
+
+BUDGET_MESSAGES = {'steps': 'step budget of %d exhausted',
+                   'depth': 'call depth budget of %d exhausted'}
+
+# Program global holding the exception raised when a budget runs out
+BUDGET_ERROR = '_budget_error_'
+
+# Calls a function takes before tiered compilation recompiles it
+TIER_THRESHOLD = 1000
+
+# Program global holding the tier up hook(CodeGen.tier_up)
+TIER_UP = '_tier_up_'
+
+# Fast locals a range loop's arguments and iterator pass through while it
+# starts(see ir.Range)
+RANGE_ARGS = ['_range_start_', '_range_stop_', '_range_step_']
+RANGE_ITERATOR = '_range_'
+
+
+def register(temp):
+    """ Fast local holding a temporary that cannot stay on the stack """
+    return '_r%d_' % (temp)
+
+
+def stack_temps(function):
+    """ Return the temporaries that can be left on the value stack.
+
+        A temporary qualifies when it is used once, in the block defining it,
+        and is on top of the stack(in operand order) by the time it is used.
+        Operands kept on the stack must come before any that are loaded from
+        a register, and nothing may be left on the stack at the end of a block.
+    """
+    uses = {}
+    defined = {}
+    for block in function.blocks:
+        for instruction in block.instructions + [block.terminator]:
+            for arg in instruction.args:
+                uses.setdefault(arg, []).append(block)
+            if instruction.dest is not None:
+                defined[instruction.dest] = block
+
+    stacked = set([t for t in defined if uses.get(t) == [defined[t]]])
+    for block in function.blocks:
+        while not simulate_stack(block, stacked):
+            pass
+    return stacked
+
+
+def call_counter(key):
+    """ Program global counting down the calls to a function, by its key
+        (see CodeGen.retained)
+    """
+    return '_calls_%s_' % (key)
+
+
+def frames_function(name):
+    """ Program global holding the generator a function runs on frames """
+    return '_frames_%s_' % (name)
+
+
+class CallGraph(visitor.Visitor):
+    """ calls maps each function declared in a tree to the names of those
+        it calls
+    """
+
+    def __init__(self):
+        visitor.Visitor.__init__(self)
+        self.calls = {}
+        self.caller = None
+
+    def visit_CallCommand(self, node):
+        if self.caller is not None:
+            self.calls[self.caller].add(node.identifier)
+        self.generic_visit(node)
+
+    def visit_FunctionDeclaration(self, node):
+        caller = self.caller
+        self.calls.setdefault(node.name, set())
+        self.caller = node.name
+        self.visit(node.command)
+        self.caller = caller
+
+
+def recursive_functions(tree):
+    """ Names of the functions in a Program or Module that can call
+        themselves, directly or through others
+    """
+    graph = CallGraph()
+    graph.visit(tree)
+    calls = graph.calls
+    recursive = set()
+    for name in calls:
+        # Search the functions name reaches for name itself
+        seen = set()
+        work = list(calls[name])
+        while work:
+            callee = work.pop()
+            if callee == name:
+                recursive.add(name)
+                break
+            if callee not in seen and callee in calls:
+                seen.add(callee)
+                work.extend(calls[callee])
+    return recursive
+
+
+def budget(max_steps=None, max_depth=None):
+    """ The budget for a metered CodeGen: each counter given a limit """
+    limits = {'steps': max_steps, 'depth': max_depth}
+    return dict([(c, l) for c, l in limits.items() if l is not None])
+
+
+def simulate_stack(block, stacked):
+    """ Walk a block's stack, dropping temporaries from stacked at the first
+        misplaced one. Returns True if nothing was dropped.
+    """
+    stack = []
+    for instruction in block.instructions + [block.terminator]:
+        args = list(instruction.args)
+        n = 0
+        while n < len(args) and args[n] in stacked:
+            n += 1
+        late = [a for a in args[n:] if a in stacked]
+        if late:
+            stacked.difference_update(late)
+            return False
+        if n > 0:
+            if stack[-n:] != args[:n]:
+                stacked.difference_update(args[:n])
+                return False
+            del stack[-n:]
+        if instruction.dest in stacked:
+            stack.append(instruction.dest)
+    if stack:
+        stacked.difference_update(stack)
+        return False
+    return True
+
+
+class CodeGen(Scoped):
+    """ Code Generator for Mini-Triangle
+
+        Given a budget(see budget()), the program is metered: every loop
+        back-edge and function call takes a step, and calls may only nest
+        so deep. The program raises errors.BudgetExhausted when either
+        runs out. The counters are globals of the program, so each run of
+        the function generate() returns has globals of its own.
+
+        Given a tier_up PassManager, compilation is tiered: once a function
+        has been called threshold times, it is recompiled with those passes
+        from its AST, and its name rebound to the result. This needs the
+        compiler at run time, so only works for generate().
+
+        tree may also be an ast.Module, which lowers to the code defining its
+        functions. The modules a tree imports come from linker(a
+        linker.Linker), and a program links in the code of each one.
+
+        Given deep, recursive functions run on trampoline frames(see
+        trampoline.py), so recursion is only limited by memory. Their
+        calls to each other yield to the trampoline rather than call, and
+        they are not tiered.
+    """
+
+    def __init__(self, tree, passes=None, budget=None, tier_up=None,
+                 threshold=TIER_THRESHOLD, linker=None, deep=False):
+        Scoped.__init__(self)
+        self.tree = tree
+        # optimize.PassManager whose code passes run over the lowered IR
+        self.passes = passes
+        self.budget = budget or {}
+        self.tier_up_passes = tier_up
+        self.threshold = threshold
+        self.linker = linker
+        self.deep = deep
+        # Functions run on trampoline frames
+        self.recursive = set()
+        # Module defining each linked function
+        self.linked = {}
+        # Each function's declaration, and the functions it could call, by
+        # key: its name and a number, as functions declared in different
+        # scopes may share a name
+        self.retained = {}
+        # Code of the functions recompiled by tier_up(), by key
+        self.hot = {}
+        # Loop counter steps a range loop takes instead(see gen_range_loop)
+        self.skipped = set()
+        # What generates each kind of node, by class(see visitor.bind)
+        self.commands = visitor.bind(self, 'command_', default='invalid_command')
+        self.expressions = visitor.bind(self, 'expression_',
+                                        default='invalid_expression')
+        self.declarations = visitor.bind(self, 'declaration_',
+                                         default='invalid_declaration')
+        self.assemblers = visitor.bind(self, 'assemble_', visitor.IR_CLASSES)
+        # Where each charged counter raises once it runs out, in the code
+        # object being assembled
+        self.exhausted = None
+        self.function = ir.Function('gencode', [])
+        self.block = self.function.entry
+        # We need to create a stack of IR functions to keep track of current
+        # scope, holding the (function, block) to resume in each enclosing one
+        self.function_stacks = []
+        self.lowered = False
 
     def __str__(self):
-        return 'Error at ast node; Unknown Function: %s' % (func_name)
+        return 'IR: %s' % (str(self.function))
 
+    def generate_code(self):
+        """ The program's code object, as a .pyc file runs it """
+        return self.assemble(self.lower(), False).to_code()
 
-class IllegalFunctionArgumentError(CodeGeneratorError):
-    """ Exception for invalid function parameters """
-
-    def __init__(self, func_name, argc):
-        self.func_name = func_name
-        self.argc = argc
-
-    def __str__(self):
-        return 'Error at ast node; Illegal Arguments.\nFunction: %s takes exactly %d arguments.' % (self.func_name, self.argc)
-
+    def generate(self):
+        code = self.generate_code()
+        # Each program gets its own globals so its functions(STORE_NAME)
+        # cannot clobber ours, or another program's
+        namespace = {'__builtins__': __builtins__,
+                     BUDGET_ERROR: BudgetExhausted}
+        if self.tier_up_passes is not None:
+            namespace[TIER_UP] = self.tier_up
+        if not self.budget:
+            return FunctionType(code, namespace, 'gencode')
+
+        # A metered program's runs, which may be in different threads,
+        # each need their own budget counters
+        def gencode():
+            return FunctionType(code, dict(namespace), 'gencode')()
+        return gencode
+
+    def tier_up(self, key, namespace):
+        """ Recompile a hot function, by key(see retained), with the tier up
+            passes, rebind its name in the program's globals(namespace) and
+            return the new function
+        """
+        node, declared = self.retained[key]
+        code = self.hot.get(key)
+        if code is None:
+            passes = self.tier_up_passes
+            body = passes.run_ast(ast.Program(node.command)).command
+
+            cg = CodeGen(None, passes, self.budget)
+            cg.declared_functions = dict(declared)
+            cg.gen_function(ast.FunctionDeclaration(node.name, node.arg_list,
+                                                    node.return_type_denoter,
+                                                    body))
+            lowered = passes.run_ir(cg.function.functions()[0])
+            code = cg.assemble(lowered, True).to_code()
+            self.hot[key] = code
+        function = FunctionType(code, namespace, node.name)
+        namespace[node.name] = function
+        return function
+
+    def lower(self):
+        """ Lower the program to IR, returning the main IR function """
+        if type(self.tree) is not ast.Program and type(self.tree) is not ast.Module:
+            raise CodeGeneratorError(self.tree)
 
-# Environment format:
-#   key = name
-#   val = (type, writable(True/False))
-#
-class CodeGen(object):
-    """ Code Generator for Mini-Triangle """
+        if not self.lowered:
+            if self.deep:
+                self.recursive = recursive_functions(self.tree)
+            if type(self.tree) is ast.Module:
+                self.link()
+                self.gen_declaration(self.tree.declaration)
+                self.finish_function(None)
+            else:
+                if self.budget:
+                    self.add(ir.Budget(self.budget))
+                self.link()
+                self.gen_command(self.tree.command)
+                self.finish_function(0)  # Segfault without a return value
+            if self.passes is not None:
+                self.passes.run_ir(self.function)
+            self.lowered = True
+        return self.function
+
+    def link(self):
+        """ Declare the functions of the modules the tree imports. A program
+            also defines those of every module it uses.
+        """
+        if not self.tree.imports:
+            return
+        if self.linker is None:
+            raise LinkError('No modules to import %s from' % (', '.join(self.tree.imports)))
+
+        for artifact in self.linker.link(self.tree.imports):
+            for name in artifact['interface']:
+                if name in self.linked:
+                    raise LinkError('%s is defined by both %s and %s' %
+                                    (name, self.linked[name], artifact['name']))
+                self.linked[name] = artifact['name']
+            if type(self.tree) is ast.Program:
+                self.add(ir.Link(artifact['name'], artifact['code']))
+        for name in self.tree.imports:
+            interface = self.linker.load(name)['interface']
+            self.declared_functions.update(linker.declared_functions(interface))
 
-    def __init__(self, tree):
-        self.tree = tree
-        self.code = []
-        # We need to create a stack of codes to keep track of current scope
-        # We also need to store all of these scopes for pyc generation
-        self.code_stacks = []
-        self.code_stacks.append(self.code)
-        self.scope_depth = 0
-        # We also need a list of environments for each scope(For typechecking and such)
-        self.envs = []
-        self.envs.append({})
-        # Format [func name: param list, return type)]
-        self.declared_functions = {}
-        self.scope_vars = {}
+    def gen_command(self, node):
+        """ Generate IR for all command types. """
+        try:
+            generate = self.commands[type(node)]
+        except KeyError:
+            self.invalid_command(node)
+        generate(node)
+
+    def invalid_command(self, node):
+        # Unexpected node. Raise a Code Generation Exception.
+        raise CodeGeneratorError(node)
+
+    def command_SequentialCommand(self, node):
+        # Programs nest sequences as deep as they are long; don't recurse
+        for sequence, name in visitor.sequence_slots(node):
+            self.gen_command(getattr(sequence, name))
+
+    def command_AssignCommand(self, node):
+        if node in self.skipped:
+            return
+        value = self.gen_expression(node.expression)
+        vname = self.lookup_var(node.variable.identifier)
+        if vname is None:
+            raise InvalidExpressionError(node)
+        self.add(ir.Store(vname, value))
+
+    def command_CallCommand(self, node):
+        self.gen_call(node, False)
+
+    def command_IfCommand(self, node):
+        test = self.gen_expression(node.expression)
+        block_if = self.function.new_block()
+        block_else = self.function.new_block()
+        block_done = self.function.new_block()
+
+        self.terminate(ir.Branch(test, block_if, block_else))
+        self.block = block_if
+        self.gen_command(node.command1)
+        self.terminate(ir.Jump(block_done))
+        self.block = block_else
+        self.gen_command(node.command2)
+        self.terminate(ir.Jump(block_done))
+        self.block = block_done
+
+    def command_WhileCommand(self, node):
+        if node.counter is not None:
+            self.gen_range_loop(node)
+            return
+        block_test = self.function.new_block()
+        block_body = self.function.new_block()
+        block_done = self.function.new_block()
+
+        # Jump here to retest condition.
+        self.terminate(ir.Jump(block_test))
+        self.block = block_test
+        test = self.gen_expression(node.expression)
+        self.terminate(ir.Branch(test, block_body, block_done))
+        self.block = block_body
+        self.gen_command(node.command)
+        self.charge('steps')
+        self.terminate(ir.Jump(block_test))
+        # Continue here if condition fails.
+        self.block = block_done
 
-    def __str__(self):
-        return 'Code: %s' % (str(self.code))
+    def command_LetCommand(self, node):
+        self.raise_scope()
+        self.gen_declaration(node.declaration)
+        self.gen_command(node.command)
+        self.lower_scope()
 
-    def generate(self):
-        if type(self.tree) is not ast.Program:
-            raise CodeGeneratorError(self.tree)
+    def command_ReturnCommand(self, node):
+        self.gen_return(self.gen_expression(node.expression))
+        # Anything after a return is unreachable
+        self.block = self.function.new_block()
 
-        self.gen_command(self.tree.command)
-        self.code.append((LOAD_CONST, 0))  # Segfault without this
-        self.code.append((RETURN_VALUE, None))
-        code_obj = Code(self.code, [], [], False, False, False, 'gencode', '', 0, '')
-        code = code_obj.to_code()
-        func = FunctionType(code, globals(), 'gencode')
+    def gen_expression(self, node):
+        """ Generate IR for an expression, returning the temporary holding it """
+        try:
+            generate = self.expressions[type(node)]
+        except KeyError:
+            self.invalid_expression(node)
+        return generate(node)
 
-        return func
+    def invalid_expression(self, node):
+        raise InvalidExpressionError(node)
 
-    def gen_command(self, node):
-        """ Generate bytecode for all command types. """
-        type_ = type(node)
-
-        if type_ is ast.SequentialCommand:
-            self.gen_command(node.command1)
-            self.gen_command(node.command2)
-        elif type_ is ast.AssignCommand:
-            self.gen_expression(node.expression)
-            vname = self.lookup_var(node.variable.identifier)
-            if vname is None:
-                raise InvalidExpressionError(node)
-            self.code.append((STORE_FAST, vname))
-        elif type_ is ast.CallCommand:
-            # Code generation for getint function
-            if node.identifier == 'getint':
-                if len(node.expr_list) != 0:
-                    raise IllegalFunctionArgumentError('getint', 0)
-
-                self.code.append((LOAD_GLOBAL, 'input'))
-                self.code.append((CALL_FUNCTION, 0))
-            # Code generation for putint function
-            elif node.identifier == 'putint':
-                if len(node.expr_list) != 1:
-                    raise IllegalFunctionArgumentError('putint', 1)
-                self.gen_expression(node.expr_list[0])
-                self.code.append((PRINT_ITEM, None))
-                self.code.append((PRINT_NEWLINE, None))
-            # Code generation for declared functions
-            else:
-                self.gen_call_command(node)
-        elif type_ is ast.IfCommand:
-            label_else = Label()
-            label_if = Label()
-
-            self.gen_expression(node.expression)
-            self.code.append((POP_JUMP_IF_FALSE, label_else))
-            self.gen_command(node.command1)
-            self.code.append((JUMP_FORWARD, label_if))
-            self.code.append((label_else, None))
-            self.gen_command(node.command2)
-            self.code.append((label_if, None))
-
-        elif type_ is ast.WhileCommand:
-            label_loop_test = Label()
-            label_loop_done = Label()
-
-            # Jump here to test retest condition.
-            self.code.append((label_loop_test, None))
-            self.gen_expression(node.expression)
-            self.code.append((POP_JUMP_IF_FALSE, label_loop_done))
-            self.gen_command(node.command)
-            self.code.append((JUMP_ABSOLUTE, label_loop_test))
-            # Jump here if condition fails.
-            self.code.append((label_loop_done, None))
-        elif type_ is ast.LetCommand:
-            self.raise_scope()
-            self.gen_declaration(node.declaration)
-            self.gen_command(node.command)
-            self.lower_scope()
-        elif type_ is ast.ReturnCommand:
-            self.gen_expression(node.expression)
-            self.code.append((RETURN_VALUE, None))
-
-        else:  # Unexpected node. Raise a Code Generation Exception.
-            raise CodeGeneratorError(node)
+    def expression_BinaryExpression(self, node):
+        if node.oper not in OPERATOR_CODES:
+            raise InvalidExpressionError(node)
+        # Operands go straight to the table, rather than through
+        # gen_expression(): expressions are most of a program's nodes
+        expressions = self.expressions
+        expr1 = expressions[type(node.expr1)](node.expr1)
+        expr2 = expressions[type(node.expr2)](node.expr2)
+        return self.add(ir.BinaryOp(self.function.new_temp(), node.oper,
+                                    expr1, expr2))
+
+    def expression_IntegerExpression(self, node):
+        return self.add(ir.Const(self.function.new_temp(), node.value))
+
+    def expression_VnameExpression(self, node):
+        vname = self.lookup_var(node.variable.identifier)
+        if vname is None:
+            raise InvalidExpressionError(node)
+        return self.add(ir.Load(self.function.new_temp(), vname))
 
-    def gen_expression(self, node):
-        """ Generate bytecode for an expression """
-        type_ = type(node)
-
-        if type_ is ast.BinaryExpression:
-            self.gen_expression(node.expr1)
-            self.gen_expression(node.expr2)
-
-            # Call bytecode function for this operator
-            if node.oper == '+':
-                self.code.append((BINARY_ADD, None))
-            elif node.oper == '*':
-                self.code.append((BINARY_MULTIPLY, None))
-            elif node.oper == '-':
-                self.code.append((BINARY_SUBTRACT, None))
-            elif node.oper == '/':
-                self.code.append((BINARY_DIVIDE, None))
-            elif node.oper == '<' or node.oper == '>':
-                self.code.append((COMPARE_OP, node.oper))
-            elif node.oper == '=':
-                self.code.append((COMPARE_OP, '=='))
-            elif node.oper == '\\':
-                self.code.append((BINARY_MODULO, None))
-            else:
-                raise InvalidExpressionError(node)
-        elif type_ is ast.IntegerExpression:
-            self.code.append((LOAD_CONST, node.value))
-        elif type_ is ast.VnameExpression:
-            vname = self.lookup_var(node.variable.identifier)
-            if vname is None:
-                raise InvalidExpressionError(node)
-            self.code.append((LOAD_FAST, vname))
-        elif type_ is ast.UnaryExpression:
-            self.gen_expression(node.expression)
-
-            # Only supporting positive or negative unary
-            if node.operator == '+':
-                self.code.append((UNARY_POSITIVE, None))
-            elif node.operator == '-':
-                self.code.append((UNARY_NEGATIVE, None))
-            else:
-                raise InvalidExpressionError(node)
-        elif type_ is ast.CallCommand:
-            self.gen_command(node)
-        else:
+    def expression_UnaryExpression(self, node):
+        # Only supporting positive or negative unary
+        if node.operator not in UNARY_CODES:
             raise InvalidExpressionError(node)
+        expr = self.gen_expression(node.expression)
+        return self.add(ir.UnaryOp(self.function.new_temp(), node.operator,
+                                   expr))
+
+    def expression_CallCommand(self, node):
+        return self.gen_call(node, True)
 
     def gen_declaration(self, node):
-        """ Generate bytecode for a declaration """
-        type_ = type(node)
-
-        if type_ is ast.ConstDeclaration:
-            self.gen_expression(node.expression)
-            # Load const into env
-            cur_env = self.get_current_env()
-            cur_env[node.identifier] = ('Integer', False)
-            self.add_var(node.identifier)
-            vname = self.lookup_var(node.identifier)
-            if vname is None:
-                raise InvalidExpressionError(node)
-            self.code.append((STORE_FAST, vname))
-        elif type_ is ast.VarDeclaration:
-            # Declare variable in environment
-            cur_env = self.get_current_env()
-            self.env_load(node.identifier, node.type_denoter, True)
-            self.add_var(node.identifier)
-            self.code.append((LOAD_CONST, None))
-            vname = self.lookup_var(node.identifier)
-            if vname is None:
-                raise InvalidExpressionError(node)
-            self.code.append((STORE_FAST, vname))
-        elif type_ is ast.SequentialDeclaration:
-            self.gen_declaration(node.decl1)
-            self.gen_declaration(node.decl2)
-        elif type_ is ast.FunctionDeclaration:
-            self.gen_function(node)
-        else:
-            raise InvalidDeclarationError(node)
+        """ Generate IR for a declaration """
+        try:
+            generate = self.declarations[type(node)]
+        except KeyError:
+            self.invalid_declaration(node)
+        generate(node)
+
+    def invalid_declaration(self, node):
+        raise InvalidDeclarationError(node)
+
+    def declaration_ConstDeclaration(self, node):
+        value = self.gen_expression(node.expression)
+        # Load const into env
+        cur_env = self.get_current_env()
+        cur_env[node.identifier] = ('Integer', False)
+        vname = self.add_var(node.identifier)
+        self.add(ir.Store(vname, value))
+
+    def declaration_VarDeclaration(self, node):
+        # Declare variable in environment
+        self.env_load(node.identifier, node.type_denoter, True)
+        vname = self.add_var(node.identifier)
+        self.add(ir.Store(vname, self.add(ir.Const(self.function.new_temp(),
+                                                   None))))
+
+    def declaration_SequentialDeclaration(self, node):
+        self.gen_declaration(node.decl1)
+        self.gen_declaration(node.decl2)
+
+    def declaration_FunctionDeclaration(self, node):
+        self.gen_function(node)
 
     def gen_function(self, node):
-        self.raise_code_stack()
+        # Functions outside any other are globals, as are the linked ones
+        if not self.function_stacks and node.name in self.linked:
+            raise LinkError('%s is already defined by module %s' %
+                            (node.name, self.linked[node.name]))
         # Add func name early incase of recursive calls
         self.declared_functions[node.name] = (node.arg_list, node.return_type_denoter)
+        self.raise_scope()
         # Get all arg names for code_obj args
         arg_names = []
         for arg in node.arg_list:
@@ -278,148 +514,687 @@ class CodeGen(object):
             arg_names.append(vname)
 
         # Genrate function body
+        self.raise_function_stack(ir.Function(node.name, arg_names))
+        self.function.frames = node.name in self.recursive
+        key = None
+        if self.tier_up_passes is not None and not self.function.frames:
+            key = '%s_%d' % (node.name, len(self.retained))
+            self.retained[key] = (node, dict(self.declared_functions))
+            self.gen_countdown(key, arg_names)
+        self.charge('steps')
+        self.charge('depth')
         self.gen_command(node.command)
+        self.finish_function(None)
+        function = self.lower_function_stack()
+        self.lower_scope()
 
-        # Add function to environment(For calling and type cheking)
-        code_obj = Code(self.code, [], arg_names, False, False, True, node.name, '', 0, '')
-
-        # Make function from code object
-        self.lower_code_stack()
-        self.code.append((LOAD_CONST, code_obj))
-        self.code.append((MAKE_FUNCTION, 0))
-        self.code.append((STORE_NAME, node.name))
+        # Make function from the finished IR
+        self.add(ir.MakeFunction(node.name, function))
+        if key is not None:
+            self.add(ir.Counter(call_counter(key), self.threshold))
 
-    def gen_call_command(self, node):
-        """ Generates code for program defined functions """
-        if self.declared_functions.get(node.identifier) is not None:
+    def gen_countdown(self, key, params):
+        """ Count calls to the current function, retained as key. Once it is
+            hot, pass them on to the recompiled function.
+        """
+        block_body = self.function.new_block()
+        block_hot = self.function.new_block()
+        self.terminate(ir.Countdown(call_counter(key), block_hot, block_body))
+
+        self.block = block_hot
+        function = self.add(ir.TierUp(self.function.new_temp(), key))
+        args = [self.add(ir.Load(self.function.new_temp(), p)) for p in params]
+        self.terminate(ir.Return(self.add(ir.Call(self.function.new_temp(),
+                                                  function, args))))
+        self.block = block_body
+
+    def gen_call(self, node, value):
+        """ Generates a call to a builtin or program defined function.
+            Returns the result's temporary if value is set.
+        """
+        # Code generation for getint function
+        if node.identifier == 'getint':
+            if len(node.expr_list) != 0:
+                raise IllegalFunctionArgumentError('getint', 0)
+            return self.add(ir.GetInt(self.result_temp(value)))
+        # Code generation for putint function
+        elif node.identifier == 'putint':
+            if len(node.expr_list) != 1:
+                raise IllegalFunctionArgumentError('putint', 1)
+            self.add(ir.PutInt(self.gen_expression(node.expr_list[0])))
+            if value:
+                return self.add(ir.Const(self.result_temp(value), None))
+        # Parallel map, run by a copy of parallel.parmap
+        elif node.identifier == 'parmap':
+            name = self.mapped_function(node)
+            helper = self.add(ir.Helper(self.function.new_temp(),
+                                        parallel.parmap))
+            args = [self.add(ir.LoadGlobal(self.function.new_temp(), name))]
+            args += [self.gen_expression(e) for e in node.expr_list[1:]]
+            return self.add(ir.Call(self.result_temp(value), helper, args))
+        # Code generation for declared functions
+        elif self.declared_functions.get(node.identifier) is not None:
             argc = len(self.declared_functions.get(node.identifier)[0])
             if argc != len(node.expr_list):
                 raise IllegalFunctionArgumentError(node.identifier, argc)
 
-            self.code.append((LOAD_GLOBAL, node.identifier))
-            for e in node.expr_list:
-                self.gen_expression(e)
-            self.code.append((CALL_FUNCTION, argc))
-            #self.code.append((POP_TOP, None))
+            # Frames call each other through the trampoline
+            if self.function.frames and node.identifier in self.recursive:
+                func = self.add(ir.LoadGlobal(self.function.new_temp(),
+                                              frames_function(node.identifier)))
+                args = [self.gen_expression(e) for e in node.expr_list]
+                return self.add(ir.Suspend(self.result_temp(value), func, args))
+
+            func = self.add(ir.LoadGlobal(self.function.new_temp(),
+                                          node.identifier))
+            args = [self.gen_expression(e) for e in node.expr_list]
+            return self.add(ir.Call(self.result_temp(value), func, args))
         else:
             raise InvalidExpressionError(node)
 
-    # ENVIRONMENT INTERACTION FUNCTIONS
-    def get_current_env(self):
-        return self.envs[len(self.envs)-1]
+    # IR FUNCTIONS
+    def add(self, instruction):
+        """ Append an instruction to the current block, returning its dest """
+        self.block.instructions.append(instruction)
+        return instruction.dest
 
-    def env_load(self, name, type_denoter, writable):
-        self.get_current_env()[name] = (type_denoter, writable)
+    def gen_range_loop(self, node):
+        """ A loop marked by optimize.RangeLoops: the counter takes each
+            value of counting.steps(counter, bound, step) in turn, rather
+            than being tested and stepped by the loop
+        """
+        var, step, increment = node.counter
+        test = node.expression
+        if type(test.expr1) is ast.VnameExpression and \
+                test.expr1.variable.identifier == var:
+            bound, oper = test.expr2, test.oper
+        else:
+            bound, oper = test.expr1, '>' if test.oper == '<' else '<'
+        vname = self.lookup_var(var)
+        if vname is None:
+            raise InvalidExpressionError(test)
+
+        new_temp = self.function.new_temp
+        start = self.add(ir.Load(new_temp(), vname))
+        stop = self.gen_expression(bound)
+        iterator = self.add(ir.Range(new_temp(), start, stop,
+                                     self.add(ir.Const(new_temp(), step))))
+        block_test = self.function.new_block()
+        block_body = self.function.new_block()
+        block_step = self.function.new_block()
+        block_done = self.function.new_block()
+
+        self.terminate(ir.Jump(block_test))
+        self.block = block_test
+        self.terminate(ir.Iterate(iterator, vname, block_body, block_step))
+        self.block = block_body
+        self.skipped.add(increment)
+        self.gen_command(node.command)
+        self.skipped.discard(increment)
+        self.charge('steps')
+        self.terminate(ir.Jump(block_test))
+
+        # The counter holds the last value the body ran with; the loop
+        # would have stepped it once more, past the bound, to stop
+        self.block = block_step
+        last = self.add(ir.Load(new_temp(), vname))
+        ran = self.add(ir.BinaryOp(new_temp(), oper, last, stop))
+        block_last = self.function.new_block()
+        self.terminate(ir.Branch(ran, block_last, block_done))
+        self.block = block_last
+        last = self.add(ir.Load(new_temp(), vname))
+        self.add(ir.Store(vname, self.add(ir.BinaryOp(
+            new_temp(), '+', last, self.add(ir.Const(new_temp(), step))))))
+        self.terminate(ir.Jump(block_done))
+        self.block = block_done
+
+    def terminate(self, terminator):
+        """ End the current block """
+        self.block.terminator = terminator
+
+    def result_temp(self, value):
+        """ A new temporary, or None when a result is discarded """
+        return self.function.new_temp() if value else None
+
+    def finish_function(self, value):
+        """ Return value if the current function's last block falls through """
+        self.gen_return(self.add(ir.Const(self.function.new_temp(), value)))
+
+    def gen_return(self, value):
+        """ Return the temporary value, leaving the call depth if metered """
+        if self.function_stacks and 'depth' in self.budget:
+            self.add(ir.Refund('depth'))
+        self.terminate(ir.Return(value))
+
+    def charge(self, counter):
+        """ Take a unit of counter here, if it has a budget """
+        if counter in self.budget:
+            self.add(ir.Charge(counter))
+
+    # BYTECODE FUNCTIONS
+    def assemble(self, function, newlocals):
+        """ Assemble an IR function into a byteplay Code object """
+        stacked = stack_temps(function)
+        used = set([a for b in function.blocks
+                    for i in b.instructions + [b.terminator] for a in i.args])
+        blocks = function.reachable()
+        labels = dict([(b, Label()) for b in blocks])
+        # Where each charged counter raises, once it runs out
+        exhausted = {}
+        outer, self.exhausted = self.exhausted, exhausted
+        assemblers = self.assemblers
+        code = []
+
+        for index, block in enumerate(blocks):
+            next_block = blocks[index + 1] if index + 1 < len(blocks) else None
+            code.append((labels[block], None))
+            # The loop runs for every instruction, so load_args() is inline
+            for instruction in block.instructions:
+                for arg in instruction.args:
+                    if arg not in stacked:
+                        code.append((LOAD_FAST, register(arg)))
+                type_ = type(instruction)
+                try:
+                    assemble = assemblers[type_]
+                except KeyError:
+                    raise CodeGeneratorError(instruction)
+                assemble(instruction, code)
+
+                # Calls push a result even when nothing uses it
+                dest = instruction.dest
+                if dest is None:
+                    if type_ is ir.Call or type_ is ir.Suspend or type_ is ir.GetInt:
+                        code.append((POP_TOP, None))
+                elif dest not in used:
+                    code.append((POP_TOP, None))
+                elif dest not in stacked:
+                    code.append((STORE_FAST, register(dest)))
+
+            terminator = block.terminator
+            self.load_args(terminator, stacked, code)
+            type_ = type(terminator)
+            if type_ is ir.Jump:
+                if terminator.target is not next_block:
+                    code.append((JUMP_ABSOLUTE, labels[terminator.target]))
+            elif type_ is ir.Branch:
+                if terminator.if_true is next_block:
+                    code.append((POP_JUMP_IF_FALSE, labels[terminator.if_false]))
+                elif terminator.if_false is next_block:
+                    code.append((POP_JUMP_IF_TRUE, labels[terminator.if_true]))
+                else:
+                    code.append((POP_JUMP_IF_FALSE, labels[terminator.if_false]))
+                    code.append((JUMP_ABSOLUTE, labels[terminator.if_true]))
+            elif type_ is ir.Countdown:
+                # Drop the item, then the iterator
+                code.append((LOAD_GLOBAL, terminator.counter))
+                code.append((FOR_ITER, labels[terminator.if_done]))
+                code.append((POP_TOP, None))
+                code.append((POP_TOP, None))
+                if terminator.if_left is not next_block:
+                    code.append((JUMP_ABSOLUTE, labels[terminator.if_left]))
+            elif type_ is ir.Iterate:
+                # Store the item, then drop the iterator; blocks start with
+                # an empty stack
+                code.append((FOR_ITER, labels[terminator.if_done]))
+                code.append((STORE_FAST, terminator.var))
+                code.append((POP_TOP, None))
+                if terminator.if_next is not next_block:
+                    code.append((JUMP_ABSOLUTE, labels[terminator.if_next]))
+            elif type_ is ir.Return:
+                if function.frames:
+                    # A frame returns by yielding its value; the trampoline
+                    # never resumes it
+                    code.append((YIELD_VALUE, None))
+                    code.append((POP_TOP, None))
+                    code.append((LOAD_CONST, None))
+                code.append((RETURN_VALUE, None))
+            else:
+                raise CodeGeneratorError(terminator)
+
+        for counter in sorted(exhausted):
+            code.append((exhausted[counter], None))
+            code.append((LOAD_GLOBAL, BUDGET_ERROR))
+            code.append((LOAD_CONST,
+                         BUDGET_MESSAGES[counter] % (self.budget[counter])))
+            code.append((CALL_FUNCTION, 1))
+            code.append((RAISE_VARARGS, 1))
+        self.exhausted = outer
+
+        return Code(code, [], function.params, False, False, newlocals,
+                    function.name, '', 0, '')
+
+    def assemble_Const(self, instruction, code):
+        code.append((LOAD_CONST, instruction.value))
+
+    def assemble_Load(self, instruction, code):
+        code.append((LOAD_FAST, instruction.var))
+
+    def assemble_Store(self, instruction, code):
+        code.append((STORE_FAST, instruction.var))
+
+    def assemble_BinaryOp(self, instruction, code):
+        code.append(OPERATOR_CODES[instruction.oper])
+
+    def assemble_UnaryOp(self, instruction, code):
+        code.append(UNARY_CODES[instruction.oper])
+
+    def assemble_LoadGlobal(self, instruction, code):
+        code.append((LOAD_GLOBAL, instruction.name))
+
+    def assemble_Helper(self, instruction, code):
+        # The helper's code travels in the program, so a .pyc needs
+        # nothing of ours to run
+        code.append((LOAD_CONST, Code.from_code(instruction.function.func_code)))
+        code.append((MAKE_FUNCTION, 0))
+
+    def assemble_Range(self, instruction, code):
+        # iter(xrange(...)), unless that raises(past machine integers,
+        # say), when counting.steps takes over. Calling steps every
+        # time would double the cost of starting a loop.
+        fallback = Label()
+        done = Label()
+        for name in reversed(RANGE_ARGS):
+            code.append((STORE_FAST, name))
+        code.append((SETUP_EXCEPT, fallback))
+        code.append((LOAD_GLOBAL, 'xrange'))
+        code.extend([(LOAD_FAST, name) for name in RANGE_ARGS])
+        code.append((CALL_FUNCTION, 3))
+        code.append((GET_ITER, None))
+        code.append((STORE_FAST, RANGE_ITERATOR))
+        code.append((POP_BLOCK, None))
+        code.append((JUMP_FORWARD, done))
+        code.append((fallback, None))
+        code.append((POP_TOP, None))
+        code.append((POP_TOP, None))
+        code.append((POP_TOP, None))
+        code.append((LOAD_CONST, Code.from_code(counting.steps.func_code)))
+        code.append((MAKE_FUNCTION, 0))
+        code.extend([(LOAD_FAST, name) for name in RANGE_ARGS])
+        code.append((CALL_FUNCTION, 3))
+        code.append((STORE_FAST, RANGE_ITERATOR))
+        code.append((done, None))
+        code.append((LOAD_FAST, RANGE_ITERATOR))
+
+    def assemble_Call(self, instruction, code):
+        code.append((CALL_FUNCTION, len(instruction.args) - 1))
+
+    def assemble_Suspend(self, instruction, code):
+        code.append((BUILD_TUPLE, len(instruction.args)))
+        code.append((YIELD_VALUE, None))
+
+    def assemble_GetInt(self, instruction, code):
+        code.append((LOAD_GLOBAL, 'input'))
+        code.append((CALL_FUNCTION, 0))
+
+    def assemble_PutInt(self, instruction, code):
+        code.append((PRINT_ITEM, None))
+        code.append((PRINT_NEWLINE, None))
+
+    def assemble_MakeFunction(self, instruction, code):
+        code.append((LOAD_CONST, self.assemble(instruction.function, True)))
+        code.append((MAKE_FUNCTION, 0))
+        if instruction.function.frames:
+            # Frames call the generator; everything else calls it
+            # through trampoline.frames
+            code.append((DUP_TOP, None))
+            code.append((STORE_NAME, frames_function(instruction.name)))
+            code.append((LOAD_CONST, Code.from_code(trampoline.frames.func_code)))
+            code.append((MAKE_FUNCTION, 0))
+            code.append((ROT_TWO, None))
+            code.append((CALL_FUNCTION, 1))
+        code.append((STORE_NAME, instruction.name))
+
+    def assemble_Link(self, instruction, code):
+        # The module's code has no locals of its own, so the functions
+        # it stores are the program's globals
+        code.append((LOAD_CONST, instruction.code))
+        code.append((MAKE_FUNCTION, 0))
+        code.append((CALL_FUNCTION, 0))
+        code.append((POP_TOP, None))
+
+    def assemble_Budget(self, instruction, code):
+        limits = instruction.limits
+        # Steps are an iterator of that many items, so taking one is a
+        # FOR_ITER: no int to allocate, no global to store
+        if 'steps' in limits:
+            self.load_repeat(limits['steps'], code)
+            code.append((STORE_GLOBAL, BUDGET_COUNTERS['steps']))
+        # The depth starts one over its limit, so the charge taking it
+        # to zero is the first one past it
+        if 'depth' in limits:
+            code.append((LOAD_CONST, limits['depth'] + 1))
+            code.append((STORE_GLOBAL, BUDGET_COUNTERS['depth']))
+        # generate() passes in errors.BudgetExhausted; a .pyc run on
+        # its own defines an exception of that name instead
+        code.append((LOAD_GLOBAL, 'globals'))
+        code.append((CALL_FUNCTION, 0))
+        code.append((LOAD_ATTR, 'setdefault'))
+        code.append((LOAD_CONST, BUDGET_ERROR))
+        code.append((LOAD_GLOBAL, 'type'))
+        code.append((LOAD_CONST, 'BudgetExhausted'))
+        code.append((LOAD_GLOBAL, 'RuntimeError'))
+        code.append((BUILD_TUPLE, 1))
+        code.append((BUILD_MAP, 0))
+        code.append((CALL_FUNCTION, 3))
+        code.append((CALL_FUNCTION, 2))
+        code.append((POP_TOP, None))
+
+    def assemble_Charge(self, instruction, code):
+        counter = instruction.counter
+        exhausted = self.exhausted.get(counter)
+        if exhausted is None:
+            exhausted = self.exhausted[counter] = Label()
+        code.append((LOAD_GLOBAL, BUDGET_COUNTERS[counter]))
+        if counter == 'steps':
+            # Drop the item, then the iterator
+            code.append((FOR_ITER, exhausted))
+            code.append((POP_TOP, None))
+            code.append((POP_TOP, None))
+        else:
+            code.append((LOAD_CONST, 1))
+            code.append((BINARY_SUBTRACT, None))
+            code.append((DUP_TOP, None))
+            code.append((STORE_GLOBAL, BUDGET_COUNTERS[counter]))
+            code.append((POP_JUMP_IF_FALSE, exhausted))
+
+    def assemble_Counter(self, instruction, code):
+        self.load_repeat(instruction.count, code)
+        code.append((STORE_GLOBAL, instruction.counter))
+
+    def assemble_TierUp(self, instruction, code):
+        code.append((LOAD_GLOBAL, TIER_UP))
+        code.append((LOAD_CONST, instruction.key))
+        code.append((LOAD_GLOBAL, 'globals'))
+        code.append((CALL_FUNCTION, 0))
+        code.append((CALL_FUNCTION, 2))
+
+    def assemble_Refund(self, instruction, code):
+        name = BUDGET_COUNTERS[instruction.counter]
+        code.append((LOAD_GLOBAL, name))
+        code.append((LOAD_CONST, 1))
+        code.append((BINARY_ADD, None))
+        code.append((STORE_GLOBAL, name))
+
+    def load_repeat(self, count, code):
+        """ Push an iterator of count items, which FOR_ITER counts down """
+        code.append((LOAD_CONST, -1))
+        code.append((LOAD_CONST, None))
+        code.append((IMPORT_NAME, 'itertools'))
+        code.append((LOAD_ATTR, 'repeat'))
+        code.append((LOAD_CONST, None))
+        code.append((LOAD_CONST, count))
+        code.append((CALL_FUNCTION, 2))
+
+    def load_args(self, instruction, stacked, code):
+        """ Load the operands not already on the stack """
+        for arg in instruction.args:
+            if arg not in stacked:
+                code.append((LOAD_FAST, register(arg)))
 
     # SCOPING FUNCTIONS
-    def raise_code_stack(self):
-        """
-        Add a new code list to the code stack, and use as current scope.
-        A new environment for the current scope is pushed onto the environment stack.
-        """
-        new_code = []
-        self.code_stacks.append(new_code)
-        self.code = new_code
-        self.raise_scope()
+    def raise_function_stack(self, function):
+        """ Add a new IR function to the function stack, and use as current """
+        self.function_stacks.append((self.function, self.block))
+        self.function = function
+        self.block = function.entry
+
+    def lower_function_stack(self):
+        """ Bring the function stack down one, returning the finished function """
+        function = self.function
+        self.function, self.block = self.function_stacks.pop()
+        return function
 
-    def lower_code_stack(self):
-        """ Bring scope down one code list """
-        self.code = self.code_stacks[len(self.code_stacks)-2]
-        self.code_stacks.pop()
-        self.lower_scope()
+    # HELPER FUNCTIONS
+    def print_code(self):
+        print ir.dump(self.lower())
 
-    # Scoping functions
-    def add_var(self, var_name):
-        var_list = self.scope_vars.get(var_name)
 
-        if var_list is None:
-            var_list = []
-            self.scope_vars[var_name] = var_list
+def pyc_data(code):
+    """ Return the contents of a .pyc file running a generated function(or
+        its code object), compacted(see compact.py)
+    """
+    magic = int(imp.get_magic().encode('hex'), 16)
+    return (struct.pack(">L", magic) + struct.pack(">L", time.time()) +
+            marshal.dumps(compact.compact(getattr(code, 'func_code', code))))
 
-        if self.scope_depth == 0:
-            var_list.append(var_name)
-            return var_name
-        else:
-            var_list.append(var_name + str(self.scope_depth))
-            return var_name + str(self.scope_depth)
 
-    def lookup_var(self, var_name):
-        var_list = self.scope_vars.get(var_name)
-        if var_list is None:
-            return None
-        else:
-            return var_list[len(var_list)-1]
+def gen_pyc(code, name):
+    pyc_file = name + '.pyc'
 
-    def raise_scope(self):
-        self.envs.append({})
-        self.scope_depth += 1
+    with open(pyc_file, 'wb') as pyc_f:
+        pyc_f.write(pyc_data(code))
 
-    def lower_scope(self):
-        for x in self.get_current_env():
-            self.scope_vars[x].pop()
 
-        self.envs.pop()
-        self.scope_depth -= 1
+# Backends selectable from the command line
+BACKENDS = ['byteplay', 'pyast']
 
-    # HELPER FUNCTIONS
-    def print_code(self):
-        for c in self.code:
-            print c
 
+def pass_manager(backend='byteplay', optimize=0, enable=(), disable=(),
+                 unroll_factor=None):
+    """ PassManager for an optimization level(or bool) and pass names """
+    return optimizer.PassManager(optimizer.opt_level(optimize), backend,
+                                 enable, disable, unroll_factor)
 
-def gen_pyc(code, name):
-    pyc_file = name + '.pyc'
 
-    with open(pyc_file, 'wb') as pyc_f:
-        magic = int(imp.get_magic().encode('hex'), 16)
-        pyc_f.write(struct.pack(">L", magic))
-        pyc_f.write(struct.pack(">L", time.time()))
-        marshal.dump(code.func_code, pyc_f)
+def parse_text(text, passes, known_inputs=()):
+    """ Scan, parse and run the AST passes over source text(or anything
+        else scanner.Scanner takes, such as an mmap). Given known_inputs,
+        the values of the program's first getint() calls, the tree is
+        first specialized to them(see specialize.py).
 
+        Returns a (tree, error) pair. On failure tree is None and error is
+        the message to show the user.
+    """
+    # Scan
+    scan = scanner.Scanner(text)
+    try:
+        tokens = scan.scan_stream()
+    except scanner.ScannerError as e:
+        return None, str(e)
 
-if __name__ == '__main__':
+    # Parse
+    parse = parser.Parser(tokens)
+    try:
+        tree = parse.parse()
+    except parser.ParserException as e:
+        return None, 'Could not compile source:\n%s' % (e)
 
-    if len(sys.argv) == 2:
+    if known_inputs:
+        try:
+            tree = specialize.specialize(tree, known_inputs)
+        except SpecializationError as e:
+            return None, str(e)
+
+    return passes.run_ast(tree), None
+
+
+def compile_code(text, backend='byteplay', optimize=0, enable=(), disable=(),
+                 passes=None, max_steps=None, max_depth=None, path=None,
+                 deep=False, known_inputs=()):
+    """ Compile source text to the code object a .pyc file runs.
+
+        optimize is an optimization level(or a bool, True being the default
+        level); enable and disable adjust its passes by name. A PassManager
+        given as passes is used instead, so its timings can be read after.
+        max_steps and max_depth meter the program(byteplay only). path is
+        the list of directories to search for imported modules(byteplay
+        only), by default the current one. deep runs recursive functions on
+        trampoline frames(byteplay only). known_inputs specializes the
+        program to the values of its first getint() calls(see
+        parse_text()); the program compiled reads only the inputs after
+        them.
+
+        Returns a (code, error) pair. On failure code is None and error is
+        the message to show the user.
+    """
+    limits = budget(max_steps, max_depth)
+    if limits and backend != 'byteplay':
+        raise ValueError('Metering needs the byteplay backend')
+    if passes is None:
+        passes = pass_manager(backend, optimize, enable, disable)
+    tree, error = parse_text(text, passes, known_inputs)
+    if error is not None:
+        return None, error
+    if tree.imports and backend != 'byteplay':
+        raise ValueError('Modules need the byteplay backend')
+    if deep and backend != 'byteplay':
+        raise ValueError('Deep recursion needs the byteplay backend')
+
+    # Generate Code and compiled Mini-Triangle code
+    if backend == 'pyast':
+        import pygen
+        return pygen.PyGen(tree).generate_module(), None
+    else:
+        modules = linker.Linker(path or ['.'], passes, limits, deep)
+        try:
+            return CodeGen(tree, passes, limits, linker=modules,
+                           deep=deep).generate_code(), None
+        except LinkError as e:
+            return None, str(e)
+
+
+def compile_text(text, backend='byteplay', optimize=0, enable=(), disable=(),
+                 passes=None, max_steps=None, max_depth=None, path=None,
+                 deep=False, known_inputs=()):
+    """ Compile source text to the contents of a .pyc file. Takes the same
+        arguments, and returns the same kind of pair, as compile_code().
+    """
+    code, error = compile_code(text, backend, optimize, enable, disable,
+                               passes, max_steps, max_depth, path, deep,
+                               known_inputs)
+    if error is not None:
+        return None, error
+    return code_pyc_data(code, backend), None
+
+
+def code_pyc_data(code, backend='byteplay'):
+    """ The contents of a .pyc file running a compile_code() code object """
+    if backend == 'pyast':
+        import pygen
+        return pygen.pyc_data(code)
+    return pyc_data(code)
+
+
+def arg_parser():
+    """ Command line options for the compiler """
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description='Mini Triangle compiler')
+    arg_parser.add_argument('source', help='/path/to/source.mt')
+    arg_parser.add_argument('-b', '--backend', choices=BACKENDS,
+                            default='byteplay',
+                            help='code generator to use (default: byteplay)')
+    optimizer.add_level_arguments(arg_parser)
+    arg_parser.add_argument('--enable', action='append', default=[],
+                            metavar='PASS', help='also run this pass')
+    arg_parser.add_argument('--disable', action='append', default=[],
+                            metavar='PASS', help='do not run this pass')
+    arg_parser.add_argument('--unroll-factor', type=int, metavar='N',
+                            help='copies of the body in a partially unrolled '
+                            'loop (default: %d)' % (optimizer.UNROLL_FACTOR))
+    arg_parser.add_argument('--time-passes', action='store_true',
+                            help='print how long each pass took')
+    arg_parser.add_argument('--max-steps', type=int, metavar='N',
+                            help='meter the program: raise after N loop '
+                            'iterations and calls')
+    arg_parser.add_argument('--max-depth', type=int, metavar='N',
+                            help='meter the program: raise when calls nest '
+                            'deeper than N')
+    arg_parser.add_argument('--deep-recursion', action='store_true',
+                            help='run recursive functions on a heap allocated '
+                            'stack, so they can recurse past Python\'s limit')
+    arg_parser.add_argument('-I', '--include', action='append', default=[],
+                            metavar='DIR', help='also search DIR for '
+                            'imported modules')
+    arg_parser.add_argument('--known-input', action='append', type=int,
+                            default=[], metavar='N', dest='known_inputs',
+                            help='specialize the program to its next getint() '
+                            'returning N; the program compiled reads only '
+                            'the inputs after those given')
+    arg_parser.add_argument('--dump-ir', action='store_true',
+                            help='print the IR instead of writing a .pyc')
+    arg_parser.add_argument('--report', action='store_true',
+                            help='print the size and frame of each code object')
+    arg_parser.add_argument('--report-json', metavar='FILE',
+                            help='write that report to FILE as JSON')
+    return arg_parser
+
+
+def source_buffer(source):
+    """ Map a source file for the scanner, so it is not copied into a string.
+        Files that cannot be mapped(empty ones, pipes) are read in chunks.
+    """
+    try:
+        return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, EnvironmentError):
+        return source
+
+
+def main(args):
+    try:
+        source = open(args.source, 'r')
+    except IOError:
+        print 'Could not find source file: %s' % (args.source)
+        sys.exit(0)
+
+    # Split path to get name, and file info
+    name_split = os.path.splitext(args.source)
+    name = name_split[0]
+    exten = name_split[1]
+
+    if exten == '.mt':
+        text = source_buffer(source)
+
+        # Modules are looked for beside the source first
+        path = [os.path.dirname(args.source) or '.'] + args.include
         try:
-            source = open(sys.argv[1], 'r')
-        except IOError:
-            print 'Could not find source file: %s' % (sys.argv[1])
+            passes = pass_manager(args.backend, args.optimize, args.enable,
+                                  args.disable, args.unroll_factor)
+            if args.dump_ir:
+                tree, error = parse_text(text, passes, args.known_inputs)
+                if error is not None:
+                    print error
+                    sys.exit(0)
+                limits = budget(args.max_steps, args.max_depth)
+                modules = linker.Linker(path, passes, limits,
+                                        args.deep_recursion)
+                try:
+                    CodeGen(tree, passes, limits, linker=modules,
+                            deep=args.deep_recursion).print_code()
+                except LinkError as e:
+                    print e
+                source.close()
+                return
+
+            code, error = compile_code(text, args.backend, passes=passes,
+                                       max_steps=args.max_steps,
+                                       max_depth=args.max_depth, path=path,
+                                       deep=args.deep_recursion,
+                                       known_inputs=args.known_inputs)
+        except ValueError as e:  # Unknown pass, or metering or modules
+                                 # unsupported
+            print e
             sys.exit(0)
+        if error is not None:
+            print error
+            sys.exit(0)
+        if args.time_passes:
+            sys.stderr.write(passes.report() + '\n')
+        if args.report or args.report_json:
+            import report
+            entries = report.code_report(code)
+            if args.report:
+                sys.stderr.write(report.format_text(entries) + '\n')
+            if args.report_json:
+                with open(args.report_json, 'w') as json_f:
+                    json_f.write(report.format_json(entries) + '\n')
+
+        with open(name + '.pyc', 'wb') as pyc_f:
+            pyc_f.write(code_pyc_data(code, args.backend))
+    else:
+        print 'Error: Unrecoginized file type: Cannot compile \'%s\'' % (exten)
+    source.close()
 
-        # Split path to get name, and file info
-        name_split = os.path.splitext(sys.argv[1])
-        name = name_split[0]
-        exten = name_split[1]
-
-        if exten == '.mt':
-            text = source.read()
-
-            # Scan
-            scan = scanner.Scanner(text)
-            try:
-                tokens = scan.scan()
-            except scanner.ScannerError as e:
-                print e
-                sys.exit(0)
-
-            # Parse
-            parse = parser.Parser(tokens)
-            try:
-                tree = parse.parse()
-            except parser.ParserException as e:
-                print 'Could not compile source:'
-                print e
-                sys.exit(0)
-
-            # Generate Code
-            cg = CodeGen(tree)
-            func = cg.generate()
-
-            # Generate compiled Mini-Triangle code
-            gen_pyc(func, name)
 
-        else:
-            print 'Error: Unrecoginized file type: Cannot compile \'%s\'' % (exten)
-        source.close()
-    else:
-        print 'Usage: python %s /path/to/source' % (sys.argv[0])
+if __name__ == '__main__':
+    main(arg_parser().parse_args())
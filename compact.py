@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#
+# Output compaction for compiled Mini Triangle programs
+#
+# The code generators embed a runtime helper(counting.steps, parallel.parmap,
+# trampoline.frames) in every code object that uses it, and identical
+# functions declared in different scopes compile to identical code objects.
+# Python 2's marshal writes every object out in full, so each copy costs its
+# whole size in the .pyc, and again each time the .pyc is loaded.
+#
+# compact() rewrites a program so each distinct code object is stored once.
+# One used in more than one place becomes a global(SHARED_CODE), set by the
+# main program before anything else runs, and the code using it loads that
+# global instead of a constant of its own. Constants and names no instruction
+# uses go, docstrings included, and string constants are interned, which
+# marshal writes once and refers back to.
+#
+# Python 3's marshal refers back to any object it has already written, so
+# there equal constants only need to be made one object(see share()).
+#
+# Author: Wilson Giese
+#
+
+import marshal
+import opcode
+import sys
+import types
+
+# Global holding the nth code object compact() shares. Mini Triangle
+# identifiers are letters and digits only, so this never clashes.
+SHARED_CODE = '_code%d_'
+
+# Set on the code of functions(rather than of a module)
+CO_NEWLOCALS = 0x2
+
+LOAD_CONST = opcode.opmap['LOAD_CONST']
+LOAD_GLOBAL = opcode.opmap['LOAD_GLOBAL']
+STORE_GLOBAL = opcode.opmap['STORE_GLOBAL']
+EXTENDED_ARG = opcode.EXTENDED_ARG
+NAME_OPCODES = set(opcode.hasname)
+ABSOLUTE_JUMPS = set(opcode.hasjabs)
+
+
+class Unchanged(Exception):
+    """ Raised when a program cannot be compacted(an argument too big for
+        two bytes); it is then written as it is
+    """
+    pass
+
+
+def compact(code):
+    """ A code object running the same program as code(the main program's)
+        that marshals smaller
+    """
+    if sys.version_info[0] >= 3:
+        return share(code, {})
+    try:
+        return Compactor(code).run()
+    except Unchanged:
+        return code
+
+
+def share(code, shared):
+    """ code with equal constants throughout it made one object. shared
+        holds the one kept for each, by (type, marshalled value).
+    """
+    if not hasattr(code, 'replace'):  # Before Python 3.8
+        return code
+    consts = []
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            const = share(const, shared)
+        key = (type(const), marshal.dumps(const))
+        consts.append(shared.setdefault(key, const))
+    return code.replace(co_consts=tuple(consts))
+
+
+class Compactor(object):
+    """ Compacts one program(see compact()), on Python 2 """
+
+    def __init__(self, main):
+        self.main = main
+        # Marshalled code, by id(code); the originals outlive the compactor
+        self.keys = {}
+        # Global holding each shared code object, by key
+        self.globals = {}
+        # Each code object rewritten, by key
+        self.rewritten = {}
+
+    def key(self, code):
+        key = self.keys.get(id(code))
+        if key is None:
+            key = self.keys[id(code)] = marshal.dumps(code)
+        return key
+
+    def run(self):
+        # Each distinct code object is written once, wherever it is used,
+        # so count uses from each distinct one rather than from the tree
+        uses = {}
+        order = []
+        work = [self.main]
+        seen = set([self.key(self.main)])
+        while work:
+            code = work.pop()
+            for const in code.co_consts:
+                if type(const) is types.CodeType:
+                    key = self.key(const)
+                    uses[key] = uses.get(key, 0) + 1
+                    if key not in seen:
+                        seen.add(key)
+                        order.append(const)
+                        work.append(const)
+
+        shared = [c for c in order if uses[self.key(c)] > 1]
+        for n, code in enumerate(shared):
+            self.globals[self.key(code)] = SHARED_CODE % (n)
+        prelude = []
+        for code in shared:
+            prelude.append((LOAD_CONST, self.rewrite(code)))
+            prelude.append((STORE_GLOBAL, self.globals[self.key(code)]))
+        return self.rebuild(self.main, prelude)
+
+    def rewrite(self, code):
+        """ code rebuilt(see rebuild()), once for all its copies """
+        key = self.key(code)
+        new = self.rewritten.get(key)
+        if new is None:
+            new = self.rewritten[key] = self.rebuild(code, [])
+        return new
+
+    def rebuild(self, code, prelude):
+        """ code running prelude(opcode, constant or name pairs) first, and
+            holding only the constants and names it uses
+        """
+        # A function's first constant is its docstring, so keep it None
+        consts = [None] if code.co_flags & CO_NEWLOCALS else []
+        const_index = {}
+        names = []
+        name_index = {}
+
+        def add_const(value):
+            consts.append(value)
+            return len(consts) - 1
+
+        def add_name(name):
+            if name not in name_index:
+                name_index[name] = len(names)
+                names.append(name)
+            return name_index[name]
+
+        head = bytearray()
+        for op, value in prelude:
+            if op == LOAD_CONST:
+                arg = add_const(value)
+            else:
+                arg = add_name(value)
+            if arg > 0xFFFF:
+                raise Unchanged()
+            head.extend([op, arg & 0xFF, arg >> 8])
+        shift = len(head)
+
+        # Instructions keep their size, so only arguments change, in place
+        data = bytearray(code.co_code)
+        i = 0
+        while i < len(data):
+            op = data[i]
+            if op < opcode.HAVE_ARGUMENT:
+                i += 1
+                continue
+            arg = data[i + 1] | data[i + 2] << 8
+            if op == LOAD_CONST:
+                value = code.co_consts[arg]
+                name = None
+                if type(value) is types.CodeType:
+                    name = self.globals.get(self.key(value))
+                if name is not None:
+                    op, arg = LOAD_GLOBAL, add_name(name)
+                else:
+                    if arg not in const_index:
+                        if value is None and consts and consts[0] is None:
+                            const_index[arg] = 0
+                        elif type(value) is types.CodeType:
+                            const_index[arg] = add_const(self.rewrite(value))
+                        elif type(value) is str:
+                            const_index[arg] = add_const(intern(value))
+                        else:
+                            const_index[arg] = add_const(value)
+                    arg = const_index[arg]
+            elif op in NAME_OPCODES:
+                arg = add_name(code.co_names[arg])
+            elif op in ABSOLUTE_JUMPS:
+                arg += shift
+            elif op == EXTENDED_ARG:
+                raise Unchanged()
+            else:
+                i += 3
+                continue
+            if arg > 0xFFFF:
+                raise Unchanged()
+            data[i] = op
+            data[i + 1] = arg & 0xFF
+            data[i + 2] = arg >> 8
+            i += 3
+
+        # Line numbers start after the prelude
+        lnotab = code.co_lnotab
+        if shift and lnotab:
+            lnotab = '\xff\x00' * (shift // 255) + chr(shift % 255) + '\x00' + lnotab
+
+        return types.CodeType(code.co_argcount, code.co_nlocals,
+                              max(code.co_stacksize, 1 if prelude else 0),
+                              code.co_flags, str(head + data), tuple(consts),
+                              tuple(names), code.co_varnames,
+                              code.co_filename, code.co_name,
+                              code.co_firstlineno, lnotab, code.co_freevars,
+                              code.co_cellvars)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+#
+# Embeddable compile API for Mini Triangle
+#
+# compile() takes source text and returns a reusable callable which runs
+# the program. Results are kept in a bounded LRU keyed by a hash of the
+# source and the compile options, so a long-lived service that sees the
+# same snippet again does not pay for scanning, parsing and codegen. A
+# program linking modules is only reused while their sources are the ones
+# it was built from.
+#
+# Author: Wilson Giese
+#
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import parser
+import scanner
+import specialize
+from errors import LinkError
+
+DEFAULT_CACHE_SIZE = 256
+
+
+def build(text, backend='byteplay', optimize=False, enable=(), disable=(),
+          max_steps=None, max_depth=None, tiered=False, path=('.',),
+          deep=False, known_inputs=(), modules=None):
+    """ Scan, parse and generate code for source text; return the callable.
+
+        optimize is an optimization level(0-2), or a bool; enable and
+        disable are pass names to add to, or drop from, that level.
+        max_steps and max_depth meter the program(byteplay only): it raises
+        errors.BudgetExhausted after that many loop iterations and calls,
+        or when calls nest deeper. Each run has a full budget of its own,
+        even when runs overlap.
+        tiered(byteplay only) starts every function at level 0, and
+        recompiles it at the highest level once it has been called that
+        many times(codegen.TIER_THRESHOLD for True); optimize is unused.
+        path lists the directories searched for imported modules(byteplay
+        only); a module which cannot be found or linked raises
+        errors.LinkError. Imported modules are not tiered.
+        deep(byteplay only) runs recursive functions on trampoline frames,
+        so their recursion is only limited by memory; they are not tiered.
+        known_inputs specializes the program to the values of its first
+        getint() calls(see specialize.py), so the callable reads only the
+        inputs after them; a program which cannot be raises
+        errors.SpecializationError.
+        Given a list as modules, the name and source digest(see
+        linker.digest) of each module linked are appended to it.
+        Every call uses a fresh generator, so this is safe to run from
+        several threads at once.
+    """
+    import optimize as optimizer
+    if backend != 'byteplay' and (max_steps is not None or
+                                  max_depth is not None):
+        raise ValueError('Metering needs the byteplay backend')
+    if backend != 'byteplay' and tiered:
+        raise ValueError('Tiered compilation needs the byteplay backend')
+    if backend != 'byteplay' and deep:
+        raise ValueError('Deep recursion needs the byteplay backend')
+
+    if tiered:
+        # The first tier runs no passes; enable and disable are for the hot one
+        passes = optimizer.PassManager(0, backend, (), ())
+    else:
+        passes = optimizer.PassManager(optimizer.opt_level(optimize), backend,
+                                       enable, disable)
+    tree = parser.Parser(scanner.Scanner(text).scan_stream()).parse()
+    if known_inputs:
+        tree = specialize.specialize(tree, known_inputs)
+    tree = passes.run_ast(tree)
+    if backend != 'byteplay' and tree.imports:
+        raise ValueError('Modules need the byteplay backend')
+
+    if backend == 'byteplay':
+        import codegen
+        import linker
+        limits = codegen.budget(max_steps, max_depth)
+        linked = linker.Linker(path, passes, limits, deep)
+        if tiered:
+            threshold = codegen.TIER_THRESHOLD if tiered is True else tiered
+            hot = optimizer.PassManager(max(optimizer.LEVELS), backend,
+                                        enable, disable)
+            func = codegen.CodeGen(tree, passes, limits, hot, threshold,
+                                   linked, deep).generate()
+        else:
+            func = codegen.CodeGen(tree, passes, limits, linker=linked,
+                                   deep=deep).generate()
+        if modules is not None:
+            modules.extend([(name, artifact['source']) for name, artifact
+                            in sorted(linked.artifacts.items())])
+        return func
+    elif backend == 'pyast':
+        import pygen
+        return pygen.PyGen(tree).generate()
+    elif backend == 'closure':
+        import closure
+        return closure.ClosureGen(tree).generate()
+    else:
+        raise ValueError('Unknown backend: %s' % (backend))
+
+
+def cache_key(text, options):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    # Pass name and known input lists become tuples so the key can be hashed
+    options = [(k, tuple(v) if isinstance(v, list) else v)
+               for k, v in options.items()]
+    return (hashlib.sha1(text).hexdigest(), tuple(sorted(options)))
+
+
+def stale(modules, path):
+    """ Whether any of the modules a program linked(see build()) has
+        changed since, or is now found elsewhere on path
+    """
+    if not modules:
+        return False
+    import linker
+
+    finder = linker.Linker(path)
+    for name, source in modules:
+        try:
+            with open(finder.find(name), 'rb') as source_f:
+                text = source_f.read()
+        except (LinkError, IOError):
+            return True
+        if linker.digest(text) != source:
+            return True
+    return False
+
+
+class Compiler(object):
+    """ Compiles Mini Triangle source, keeping an LRU of compiled programs """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def compile(self, text, **options):
+        """ Return a callable running the program in text.
+
+            options are passed on to build(), and are part of the cache key.
+            Scanner, parser and code generator errors propagate, and are
+            not cached. A program which imports modules is compiled again
+            once one of their sources changes.
+        """
+        key = cache_key(text, options)
+        path = options.get('path', ('.',))
+
+        with self.lock:
+            entry = self.cache.get(key)
+        # Read the modules outside the lock, too
+        if entry is not None and stale(entry[1], path):
+            entry = None
+        with self.lock:
+            if entry is not None and self.cache.get(key) is entry:
+                # Move to the most recently used end
+                del self.cache[key]
+                self.cache[key] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Generate outside the lock so one slow compile does not hold up
+        # every other thread
+        modules = []
+        func = build(text, modules=modules, **options)
+
+        with self.lock:
+            entry = self.cache.pop(key, None)
+            if entry is not None and entry[1] == modules:
+                # Another thread compiled it meanwhile; share that one
+                self.cache[key] = entry
+                return entry[0]
+            self.cache[key] = (func, modules)
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+                self.evictions += 1
+        return func
+
+    def stats(self):
+        """ Return the cache counters as a dictionary """
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self.cache),
+                    'maxsize': self.maxsize}
+
+    def clear(self):
+        """ Empty the cache and reset its counters """
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+# Shared compiler behind the module level functions
+default_compiler = Compiler()
+
+
+def compile(text, **options):
+    """ Compile source text with the shared cache and return a callable """
+    return default_compiler.compile(text, **options)
+
+
+def stats():
+    return default_compiler.stats()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+#
+# Runtime for counting loops in Mini Triangle
+#
+# The byteplay backend compiles a while loop counting a variable by a
+# constant step(see optimize.RangeLoops) to a FOR_ITER over steps(). An
+# xrange is much quicker to step through than a test, an add and a store,
+# but only holds machine integers; a loop past those falls back to a
+# generator, so Integers keep their arbitrary precision.
+#
+# steps is self contained(it uses no globals), so it is embedded in the
+# programs that use it, and the .pyc files stay runnable without this
+# module.
+#
+# Author: Wilson Giese
+#
+
+
+def steps(start, stop, step):
+    """ An iterator over the values a counter takes from start, stepping by
+        step, until it reaches stop(from either side)
+    """
+    try:
+        # FOR_ITER needs an iterator; an xrange is only iterable
+        return iter(xrange(start, stop, step))
+    except OverflowError:
+        def count(value, stop, step):
+            while value < stop if step > 0 else value > stop:
+                yield value
+                value += step
+        return count(start, stop, step)
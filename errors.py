@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+# Code generation exceptions for Mini Triangle
+#
+# Author: Wilson Giese
+#
+
+
+class CodeGeneratorError(Exception):
+    """ Code Generator Exception """
+
+    def __init__(self, ast):
+        self.ast = ast
+
+    def __str__(self):
+        return 'Error at ast node: %s' % (str(self.ast))
+
+
+class TypeMismatchError(CodeGeneratorError):
+    """ Exception for type mismatch(i.e Integer := String) """
+
+    def __init__(self, ast):
+        self.ast = ast
+
+    def __str__(self):
+        return 'Error at ast node; Type Mismatch: %s' % (str(self.ast))
+
+
+class InvalidExpressionError(CodeGeneratorError):
+    """ Exception for invalid expressions """
+
+    def __init__(self, ast):
+        self.ast = ast
+
+    def __str__(self):
+        return 'Error at ast node; Invalid Expression: %s' % (str(self.ast))
+
+
+class InvalidDeclarationError(CodeGeneratorError):
+    """ Exception for invalid declarations """
+
+    def __init__(self, ast):
+        self.ast = ast
+
+    def __str__(self):
+        return 'Error at ast node; Invalid Declaration: %s' % (str(self.ast))
+
+
+class UnknownFunctionError(CodeGeneratorError):
+    """ Exception for unknown function calls """
+
+    def __init__(self, func_name):
+        self.func_name = func_name
+
+    def __str__(self):
+        return 'Error at ast node; Unknown Function: %s' % (self.func_name)
+
+
+class IllegalFunctionArgumentError(CodeGeneratorError):
+    """ Exception for invalid function parameters """
+
+    def __init__(self, func_name, argc):
+        self.func_name = func_name
+        self.argc = argc
+
+    def __str__(self):
+        return 'Error at ast node; Illegal Arguments.\nFunction: %s takes exactly %d arguments.' % (self.func_name, self.argc)
+
+
+class BudgetExhausted(RuntimeError):
+    """ Raised by a metered program(see codegen.CodeGen) which has used up
+        its step or call depth budget
+    """
+
+
+class LinkError(Exception):
+    """ Exception for modules which cannot be found, compiled or linked """
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return 'Link error: %s' % (self.message)
+
+
+class SpecializationError(Exception):
+    """ Exception for programs which cannot be specialized to known inputs
+        (see specialize.py)
+    """
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return 'Specialization error: %s' % (self.message)
@@ -0,0 +1,610 @@
+#!/usr/bin/env python
+#
+# Differential fuzzer for the Mini Triangle optimizer
+#
+# Generates random well-formed programs, compiles each with every backend
+# and optimization level in SETTINGS, runs them on the same getint input
+# and compares what they print and whether(and how) they fail. The first
+# setting is the reference. Mismatches are shrunk and saved as .mt files;
+# for programs that agree, the run time of each setting is recorded
+# against the reference.
+#
+# Generated programs follow the scoping rules of Scoped.add_var and
+# lookup_var: inner lets may shadow outer names, functions see only their
+# parameters and their own locals, and every variable is assigned before
+# it is read. Loops run a bounded number of times on a counter nothing
+# else assigns, and functions only call functions declared before them,
+# so every program terminates.
+#
+# Usage: python fuzz.py [-n count] [-s seed] [-o dir] [--json file]
+#
+# Author: Wilson Giese
+#
+
+import math
+import os
+import random
+import signal
+import sys
+import timeit
+
+try:
+    from cStringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+import compiler
+
+# (backend, optimization level[, tier up threshold]); the first one is the
+# reference. A threshold of 1 recompiles each function on its second call.
+SETTINGS = [('byteplay', 0), ('byteplay', 1), ('byteplay', 2),
+            ('byteplay', 0, 1), ('pyast', 0), ('pyast', 2),
+            ('closure', 0), ('closure', 2)]
+
+VAR_NAMES = ['a', 'b', 'n', 'x', 'y', 'z']
+# Small and power of two literals, so strength reduction has work to do
+LITERALS = [0, 1, 2, 3, 4, 5, 7, 8, 10, 16, 32, 100]
+ARITHMETIC = ['+', '-', '*', '/', '\\']
+COMPARISONS = ['<', '>', '=']
+# Keeps values from growing without bound in loops
+MODULUS = 9973
+
+# getint values given to each program
+INPUTS = 20
+# Seconds a single run may take before the program is skipped
+TIMEOUT = 1.0
+# Runs timed per setting; the best is kept
+REPEAT = 3
+MAX_SHRINK_STEPS = 2000
+
+
+def available_settings():
+    """ SETTINGS less those whose backend cannot run on this Python """
+    try:
+        import byteplay
+    except ImportError:
+        return [s for s in SETTINGS if s[0] != 'byteplay']
+    return SETTINGS
+
+
+def setting_name(setting):
+    if len(setting) > 2:
+        return '%s tiered %d' % (setting[0], setting[2])
+    return '%s -O%d' % setting
+
+
+# PROGRAM GENERATION
+#
+# Programs are nested tuples, rendered to source by render():
+#   ('program', decls, commands)
+# declarations:
+#   ('var', name, init), ('const', name, expr),
+#   ('func', name, params, decls, commands, result)
+# commands:
+#   ('init', name, expr)  assignment which must stay(see shrink)
+#   ('assign', name, expr), ('putint', expr), ('call', name, args),
+#   ('if', expr, commands, commands), ('return', expr),
+#   ('loop', counter, bound, commands), ('let', decls, commands)
+# expressions:
+#   ('int', value), ('var', name), ('neg', expr), ('bin', oper, expr, expr),
+#   ('call', name, args), ('getint',)
+
+class Generator(object):
+    """ Random program generator, deterministic for a given seed """
+
+    def __init__(self, seed, max_depth=3):
+        self.random = random.Random(seed)
+        self.max_depth = max_depth
+        self.counters = 0
+        # (name, arity) of the functions declared so far
+        self.functions = []
+
+    def program(self):
+        env = {}
+        decls = self.declarations(env, True)
+        return ('program', decls, self.commands(env, 0, False, False, None))
+
+    def declarations(self, env, functions):
+        """ Declarations for a let; adds the names they bind to env """
+        rand = self.random
+        decls = []
+        names = rand.sample(VAR_NAMES, rand.randint(1, 3))
+        # Initialisers run after every declaration of the let, so they can
+        # only read outer names this let does not shadow, and earlier ones
+        outer = dict([(k, v) for k, v in env.items() if k not in names])
+        for name in names:
+            if rand.random() < 0.25:
+                decls.append(('const', name, self.expression(outer, 1, None)))
+                env[name] = 'const'
+            else:
+                decls.append(('var', name, None))
+                env[name] = 'var'
+
+        ready = dict(outer)
+        for i, decl in enumerate(decls):
+            if decl[0] == 'var':
+                decls[i] = ('var', decl[1], self.expression(ready, 1, None))
+            ready[decl[1]] = env[decl[1]]
+
+        if functions:
+            for i in range(rand.randint(0, 2)):
+                decls.append(self.function())
+        return decls
+
+    def function(self):
+        rand = self.random
+        name = 'f%d' % (len(self.functions) + 1)
+        params = rand.sample(VAR_NAMES, rand.randint(1, 3))
+        env = dict([(p, 'var') for p in params])
+        decls = self.declarations(env, False) if rand.random() < 0.5 else []
+        commands = self.commands(env, 1, True, False, None)
+        result = self.expression(env, 0, None)
+        # Declared after its body, so it cannot call itself
+        self.functions.append((name, len(params)))
+        return ('func', name, params, decls, commands, result)
+
+    def commands(self, env, depth, in_function, in_loop, hot):
+        rand = self.random
+        if hot is None or rand.random() < 0.3:
+            # Reused across the list, so CSE and LICM have work to do
+            hot = self.expression(env, 1, None)
+        return [self.command(env, depth, in_function, in_loop, hot)
+                for i in range(rand.randint(1, 4))]
+
+    def command(self, env, depth, in_function, in_loop, hot):
+        rand = self.random
+        assignable = sorted([k for k, v in env.items() if v == 'var'])
+        choices = ['putint'] * 2
+        if assignable:
+            choices += ['assign'] * 4
+        if self.functions:
+            choices.append('call')
+        if depth < self.max_depth:
+            choices += ['if', 'loop', 'let']
+        if in_function:
+            choices.append('return')
+        kind = rand.choice(choices)
+
+        if kind == 'assign':
+            expr = self.expression(env, 0, hot)
+            if in_loop and rand.random() < 0.9:
+                expr = ('bin', '\\', expr, ('int', MODULUS))
+            return ('assign', rand.choice(assignable), expr)
+        elif kind == 'putint':
+            return ('putint', self.expression(env, 0, hot))
+        elif kind == 'call':
+            name, arity = rand.choice(self.functions)
+            return ('call', name, [self.expression(env, 1, hot) for i in range(arity)])
+        elif kind == 'return':
+            return ('return', self.expression(env, 0, hot))
+        elif kind == 'if':
+            return ('if', self.condition(env, hot),
+                    self.commands(env, depth + 1, in_function, in_loop, hot),
+                    self.commands(env, depth + 1, in_function, in_loop, hot))
+        elif kind == 'loop':
+            self.counters += 1
+            counter = 'c%d' % (self.counters)
+            inner = dict(env)
+            inner[counter] = 'counter'
+            return ('loop', counter, rand.randint(0, 6),
+                    self.commands(inner, depth + 1, in_function, True, hot))
+        else:
+            inner = dict(env)
+            decls = self.declarations(inner, False)
+            return ('let', decls,
+                    self.commands(inner, depth + 1, in_function, in_loop, hot))
+
+    def condition(self, env, hot):
+        return ('bin', self.random.choice(COMPARISONS),
+                self.expression(env, 1, hot), self.expression(env, 1, hot))
+
+    def expression(self, env, depth, hot):
+        rand = self.random
+        if hot is not None and rand.random() < 0.15:
+            return hot
+        if depth >= 3 or rand.random() < 0.3:
+            return self.leaf(env)
+
+        r = rand.random()
+        if r < 0.08:
+            return ('neg', self.expression(env, depth + 1, hot))
+        elif r < 0.12:
+            return ('getint',)
+        elif r < 0.20 and self.functions:
+            name, arity = rand.choice(self.functions)
+            return ('call', name, [self.expression(env, depth + 1, hot)
+                                   for i in range(arity)])
+        elif r < 0.26:
+            return self.condition(env, hot)
+
+        oper = rand.choice(ARITHMETIC)
+        left = self.expression(env, depth + 1, hot)
+        # Mostly non-zero literal divisors, or most programs end early on
+        # a division by zero
+        if oper in ('/', '\\') and rand.random() < 0.9 or \
+                oper == '*' and rand.random() < 0.6:
+            right = ('int', rand.choice(LITERALS[1:]))
+        else:
+            right = self.expression(env, depth + 1, hot)
+        return ('bin', oper, left, right)
+
+    def leaf(self, env):
+        rand = self.random
+        if env and rand.random() < 0.6:
+            return ('var', rand.choice(sorted(env)))
+        return ('int', rand.choice(LITERALS))
+
+
+# RENDERING
+
+def render(program):
+    lines = []
+    render_let(program[1], program[2], 0, lines)
+    return '\n'.join(lines) + '\n'
+
+
+def render_let(decls, commands, indent, lines, result=None):
+    """ 'let decls in begin ... end', or just the block without decls """
+    pad = '    ' * indent
+    inits = [('init', d[1], d[2]) for d in decls if d[0] == 'var']
+    if decls:
+        lines.append(pad + 'let')
+        for decl in decls:
+            render_declaration(decl, indent + 1, lines)
+        lines.append(pad + 'in')
+        indent += 1
+    render_block(inits + list(commands), indent, lines, result)
+
+
+def render_block(commands, indent, lines, result=None):
+    pad = '    ' * indent
+    lines.append(pad + 'begin')
+    for command in commands:
+        render_command(command, indent + 1, lines)
+    if result is not None:
+        lines.append(pad + '    return %s;' % (render_expression(result)))
+    lines.append(pad + 'end')
+
+
+def render_declaration(decl, indent, lines):
+    pad = '    ' * indent
+    kind = decl[0]
+    if kind == 'var':
+        lines.append(pad + 'var %s: Integer;' % (decl[1]))
+    elif kind == 'const':
+        lines.append(pad + 'const %s ~ %s;' % (decl[1], render_expression(decl[2])))
+    else:
+        name, params, decls, commands, result = decl[1:]
+        lines.append(pad + 'func %s(%s): Integer' %
+                     (name, ', '.join(['%s: Integer' % p for p in params])))
+        render_let(decls, commands, indent + 1, lines, result)
+
+
+def render_command(command, indent, lines):
+    pad = '    ' * indent
+    kind = command[0]
+    if kind == 'init' or kind == 'assign':
+        lines.append(pad + '%s := %s;' % (command[1], render_expression(command[2])))
+    elif kind == 'putint':
+        lines.append(pad + 'putint(%s);' % (render_expression(command[1])))
+    elif kind == 'call':
+        lines.append(pad + '%s;' % (render_expression(command)))
+    elif kind == 'return':
+        lines.append(pad + 'return %s;' % (render_expression(command[1])))
+    elif kind == 'if':
+        lines.append(pad + 'if %s then' % (render_expression(command[1])))
+        render_block(command[2], indent + 1, lines)
+        lines.append(pad + 'else')
+        render_block(command[3], indent + 1, lines)
+    elif kind == 'loop':
+        counter, bound, body = command[1:]
+        step = ('assign', counter, ('bin', '+', ('var', counter), ('int', 1)))
+        lines.append(pad + 'let')
+        lines.append(pad + '    var %s: Integer;' % (counter))
+        lines.append(pad + 'in')
+        lines.append(pad + '    begin')
+        lines.append(pad + '        %s := 0;' % (counter))
+        lines.append(pad + '        while %s < %d do' % (counter, bound))
+        render_block(list(body) + [step], indent + 3, lines)
+        lines.append(pad + '    end')
+    else:
+        render_let(command[1], command[2], indent, lines)
+
+
+def render_expression(expr):
+    kind = expr[0]
+    if kind == 'int':
+        return str(expr[1])
+    elif kind == 'var':
+        return expr[1]
+    elif kind == 'neg':
+        return '-(%s)' % (render_expression(expr[1]))
+    elif kind == 'bin':
+        return '(%s %s %s)' % (render_expression(expr[2]), expr[1],
+                               render_expression(expr[3]))
+    elif kind == 'call':
+        return '%s(%s)' % (expr[1], ', '.join([render_expression(e) for e in expr[2]]))
+    else:
+        return 'getint()'
+
+
+# RUNNING
+
+class Timeout(Exception):
+    pass
+
+
+def on_alarm(signum, frame):
+    raise Timeout()
+
+
+def run(func, inputs):
+    """ Run a compiled program; return (output, exception name, seconds) """
+    stdin, stdout = sys.stdin, sys.stdout
+    sys.stdin = StringIO(''.join(['%d\n' % i for i in inputs]))
+    sys.stdout = StringIO()
+    error = None
+    signal.setitimer(signal.ITIMER_REAL, TIMEOUT)
+    start = timeit.default_timer()
+    try:
+        func()
+    except Timeout:
+        error = 'Timeout'
+    except Exception as e:
+        error = type(e).__name__
+    finally:
+        elapsed = timeit.default_timer() - start
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        output = sys.stdout.getvalue()
+        sys.stdin, sys.stdout = stdin, stdout
+    return output, error, elapsed
+
+
+def outcome(text, setting, inputs, repeat=1):
+    """ ((output, error), best seconds) of a setting, compile errors included """
+    try:
+        func = compiler.build(text, backend=setting[0], optimize=setting[1],
+                              tiered=setting[2] if len(setting) > 2 else False)
+    except Exception as e:
+        return ('', 'compile: %s' % (type(e).__name__)), 0.0
+
+    best = None
+    for i in range(repeat):
+        output, error, elapsed = run(func, inputs)
+        if error is not None:
+            break
+        best = elapsed if best is None else min(best, elapsed)
+    return (output, error), best or elapsed
+
+
+def first_mismatch(text, settings, inputs):
+    """ Return the first setting disagreeing with settings[0], or None """
+    reference = outcome(text, settings[0], inputs)[0]
+    for setting in settings[1:]:
+        if outcome(text, setting, inputs)[0] != reference:
+            return setting
+    return None
+
+
+# SHRINKING
+#
+# Each generator below yields strictly smaller variants of its argument.
+# Variants need not be valid: one which fails the same way everywhere no
+# longer reproduces the mismatch, so it is rejected. Initialisers('init'
+# and var initial values) are never dropped, since reading an unassigned
+# variable is outside what the optimizer promises to preserve.
+
+def shrink_program(program):
+    for decls in shrink_declarations(program[1]):
+        yield ('program', decls, program[2])
+    for commands in shrink_commands(program[2]):
+        yield ('program', program[1], commands)
+
+
+def shrink_declarations(decls):
+    for i, decl in enumerate(decls):
+        if decl[0] == 'func':
+            yield decls[:i] + decls[i + 1:]
+    for i, decl in enumerate(decls):
+        for smaller in shrink_declaration(decl):
+            yield decls[:i] + [smaller] + decls[i + 1:]
+
+
+def shrink_declaration(decl):
+    if decl[0] == 'func':
+        name, params, decls, commands, result = decl[1:]
+        for commands_ in shrink_commands(commands):
+            yield ('func', name, params, decls, commands_, result)
+        for decls_ in shrink_declarations(decls):
+            yield ('func', name, params, decls_, commands, result)
+        for result_ in shrink_expression(result):
+            yield ('func', name, params, decls, commands, result_)
+    else:
+        for expr in shrink_expression(decl[2]):
+            yield (decl[0], decl[1], expr)
+
+
+def shrink_commands(commands):
+    if len(commands) > 1:
+        for i in range(len(commands)):
+            yield commands[:i] + commands[i + 1:]
+    for i, command in enumerate(commands):
+        for smaller in shrink_command(command):
+            yield commands[:i] + [smaller] + commands[i + 1:]
+
+
+def shrink_command(command):
+    kind = command[0]
+    if kind in ('init', 'assign'):
+        for expr in shrink_expression(command[2]):
+            yield (kind, command[1], expr)
+    elif kind in ('putint', 'return'):
+        for expr in shrink_expression(command[1]):
+            yield (kind, expr)
+    elif kind == 'call':
+        for args in shrink_list(command[2], shrink_expression):
+            yield ('call', command[1], args)
+    elif kind == 'if':
+        expr, then, else_ = command[1:]
+        for commands in shrink_commands(then):
+            yield ('if', expr, commands, else_)
+        for commands in shrink_commands(else_):
+            yield ('if', expr, then, commands)
+        for smaller in shrink_expression(expr):
+            yield ('if', smaller, then, else_)
+    elif kind == 'loop':
+        counter, bound, body = command[1:]
+        if bound > 1:
+            yield ('loop', counter, 1, body)
+        for commands in shrink_commands(body):
+            yield ('loop', counter, bound, commands)
+    elif kind == 'let':
+        for commands in shrink_commands(command[2]):
+            yield ('let', command[1], commands)
+        for decls in shrink_declarations(command[1]):
+            yield ('let', decls, command[2])
+
+
+def shrink_list(items, shrink):
+    for i, item in enumerate(items):
+        for smaller in shrink(item):
+            yield items[:i] + [smaller] + items[i + 1:]
+
+
+def shrink_expression(expr):
+    kind = expr[0]
+    if kind == 'int':
+        if expr[1] not in (0, 1):
+            yield ('int', 1)
+        return
+    if kind != 'var':
+        yield ('int', 1)
+    if kind == 'neg':
+        yield expr[1]
+        for e in shrink_expression(expr[1]):
+            yield ('neg', e)
+    elif kind == 'bin':
+        oper, left, right = expr[1:]
+        yield left
+        yield right
+        for e in shrink_expression(left):
+            yield ('bin', oper, e, right)
+        for e in shrink_expression(right):
+            yield ('bin', oper, left, e)
+    elif kind == 'call':
+        for args in shrink_list(expr[2], shrink_expression):
+            yield ('call', expr[1], args)
+
+
+def shrink(program, settings, inputs):
+    """ Smallest variant of program on which settings still disagree """
+    steps = 0
+    progress = True
+    while progress and steps < MAX_SHRINK_STEPS:
+        progress = False
+        for candidate in shrink_program(program):
+            steps += 1
+            if first_mismatch(render(candidate), settings, inputs) is not None:
+                program = candidate
+                progress = True
+                break
+            if steps >= MAX_SHRINK_STEPS:
+                break
+    return program
+
+
+# DRIVER
+
+def save_reproducer(directory, seed, index, text, settings, inputs):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, 'mismatch_%d_%d.mt' % (seed, index))
+    header = ['! Found by fuzz.py (seed %d, program %d)' % (seed, index),
+              '! getint input: %s' % (' '.join([str(i) for i in inputs]))]
+    for setting in settings:
+        (output, error), seconds = outcome(text, setting, inputs)
+        header.append('! %s: %s%s' % (setting_name(setting),
+                                      ' '.join(output.split()) or '(no output)',
+                                      ' (%s)' % (error) if error else ''))
+    with open(path, 'w') as f:
+        f.write('\n'.join(header) + '\n' + text)
+    return path
+
+
+def fuzz(count, seed, directory, out=sys.stdout):
+    """ Check count programs; return a summary dictionary """
+    settings = available_settings()
+    ratios = dict([(setting_name(s), []) for s in settings[1:]])
+    mismatches = []
+    skipped = 0
+    signal.signal(signal.SIGALRM, on_alarm)
+
+    for index in range(count):
+        program = Generator(seed * 1000003 + index).program()
+        text = render(program)
+        rand = random.Random(seed + index)
+        inputs = [rand.randint(-20, 20) for i in range(INPUTS)]
+
+        results = [outcome(text, s, inputs, REPEAT) for s in settings]
+        reference, base = results[0]
+        if [r for r, t in results if r[1] == 'Timeout']:
+            skipped += 1
+            continue
+
+        differs = [s for s, (r, t) in zip(settings, results) if r != reference]
+        if differs:
+            pair = [settings[0], differs[0]]
+            small = render(shrink(program, pair, inputs))
+            path = save_reproducer(directory, seed, index, small, settings, inputs)
+            mismatches.append(path)
+            out.write('program %d: %s differs from %s, saved %s\n' %
+                      (index, setting_name(differs[0]), setting_name(settings[0]), path))
+            continue
+
+        if reference[1] is None:
+            for setting, (r, seconds) in zip(settings[1:], results[1:]):
+                if seconds > 0 and base > 0:
+                    ratios[setting_name(setting)].append(base / seconds)
+
+    speedups = {}
+    for name, values in ratios.items():
+        if values:
+            speedups[name] = math.exp(sum([math.log(v) for v in values]) / len(values))
+    return {'seed': seed,
+            'programs': count,
+            'skipped': skipped,
+            'mismatches': mismatches,
+            'reference': setting_name(settings[0]),
+            'speedups': speedups}
+
+
+def report(summary):
+    lines = ['%d programs, %d mismatches, %d skipped(timeout)' %
+             (summary['programs'], len(summary['mismatches']), summary['skipped']),
+             'speedup over %s(geometric mean of programs that ran cleanly):' %
+             (summary['reference'])]
+    for name in sorted(summary['speedups']):
+        lines.append('    %-18s %6.2fx' % (name, summary['speedups'][name]))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    arg_parser = argparse.ArgumentParser(description='Mini Triangle optimizer fuzzer')
+    arg_parser.add_argument('-n', '--count', type=int, default=200,
+                            help='programs to generate (default: %(default)s)')
+    arg_parser.add_argument('-s', '--seed', type=int, default=0,
+                            help='random seed (default: %(default)s)')
+    arg_parser.add_argument('-o', '--output', default='fuzz-failures',
+                            help='directory for reproducers (default: %(default)s)')
+    arg_parser.add_argument('--json', help='also write the summary to this file')
+    args = arg_parser.parse_args()
+
+    summary = fuzz(args.count, args.seed, args.output)
+    print(report(summary))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    sys.exit(1 if summary['mismatches'] else 0)
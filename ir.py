@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+#
+# Intermediate representation for Mini Triangle
+#
+# A linear, three-address IR sitting between the AST and bytecode. Each
+# Function(the main program or a declared function) is a list of basic
+# blocks forming an explicit control-flow graph. Each block runs a list of
+# instructions and ends in one terminator (Jump, Branch, Countdown, Iterate
+# or Return).
+#
+# Values live in numbered temporaries('%n'), each assigned exactly once.
+# Variables are only touched through Load and Store, and constants through
+# Const, so every instruction operand is a temporary. That keeps uses and
+# definitions explicit for dataflow passes(liveness, dead stores, value
+# numbering, slot allocation). The byteplay backend keeps single-use
+# temporaries on the stack. Metered programs also Charge budget counters
+# at loop back-edges and function entry.
+#
+# Author: Wilson Giese
+#
+
+
+class Instruction(object):
+    """ Base class of IR instructions.
+
+        dest: the temporary defined, or None.
+        args: the temporaries used, in evaluation(stack) order.
+    """
+    dest = None
+    args = ()
+
+    def uses(self):
+        return list(self.args)
+
+    def dest_str(self):
+        return '%%%d = ' % (self.dest) if self.dest is not None else ''
+
+
+class Const(Instruction):
+
+    def __init__(self, dest, value):
+        self.dest = dest
+        self.value = value
+
+    def __str__(self):
+        return '%sconst %r' % (self.dest_str(), self.value)
+
+
+class Load(Instruction):
+    """ Read a variable(by mangled name) """
+
+    def __init__(self, dest, var):
+        self.dest = dest
+        self.var = var
+
+    def __str__(self):
+        return '%sload %s' % (self.dest_str(), self.var)
+
+
+class Store(Instruction):
+    """ Write a temporary to a variable """
+
+    def __init__(self, var, arg):
+        self.var = var
+        self.args = (arg,)
+
+    def __str__(self):
+        return 'store %s, %%%d' % (self.var, self.args[0])
+
+
+class BinaryOp(Instruction):
+
+    def __init__(self, dest, oper, arg1, arg2):
+        self.dest = dest
+        self.oper = oper
+        self.args = (arg1, arg2)
+
+    def __str__(self):
+        return '%s%%%d %s %%%d' % (self.dest_str(), self.args[0], self.oper,
+                                   self.args[1])
+
+
+class UnaryOp(Instruction):
+
+    def __init__(self, dest, oper, arg):
+        self.dest = dest
+        self.oper = oper
+        self.args = (arg,)
+
+    def __str__(self):
+        return '%s%s%%%d' % (self.dest_str(), self.oper, self.args[0])
+
+
+class LoadGlobal(Instruction):
+    """ Look up a declared function by name """
+
+    def __init__(self, dest, name):
+        self.dest = dest
+        self.name = name
+
+    def __str__(self):
+        return '%sglobal %s' % (self.dest_str(), self.name)
+
+
+class Helper(Instruction):
+    """ Make a function object of a runtime helper(a self contained Python
+        function, such as parallel.parmap)
+    """
+
+    def __init__(self, dest, function):
+        self.dest = dest
+        self.function = function
+
+    def __str__(self):
+        return '%shelper %s' % (self.dest_str(), self.function.__name__)
+
+
+class Range(Instruction):
+    """ An iterator over counting.steps(args): the values a loop counter
+        takes from args[0] to args[1], stepping by args[2]
+    """
+
+    def __init__(self, dest, start, stop, step):
+        self.dest = dest
+        self.args = (start, stop, step)
+
+    def __str__(self):
+        return '%srange %%%d, %%%d, %%%d' % ((self.dest_str(),) + self.args)
+
+
+class Call(Instruction):
+    """ Call the function in args[0] with the rest of args.
+        dest is None when the result is discarded.
+    """
+
+    def __init__(self, dest, func, args):
+        self.dest = dest
+        self.args = tuple([func] + list(args))
+
+    def __str__(self):
+        return '%scall %%%d(%s)' % (self.dest_str(), self.args[0],
+                                    ', '.join(['%%%d' % a for a in self.args[1:]]))
+
+
+class Suspend(Instruction):
+    """ Call a function running on trampoline frames from another: yield
+        args(the callee, then its arguments) to the trampoline, which sends
+        back the result(see trampoline.py). dest is None when the result
+        is discarded.
+    """
+
+    def __init__(self, dest, func, args):
+        self.dest = dest
+        self.args = tuple([func] + list(args))
+
+    def __str__(self):
+        return '%ssuspend %%%d(%s)' % (self.dest_str(), self.args[0],
+                                       ', '.join(['%%%d' % a for a in self.args[1:]]))
+
+
+class GetInt(Instruction):
+
+    def __init__(self, dest):
+        self.dest = dest
+
+    def __str__(self):
+        return '%sgetint' % (self.dest_str())
+
+
+class PutInt(Instruction):
+
+    def __init__(self, arg):
+        self.args = (arg,)
+
+    def __str__(self):
+        return 'putint %%%d' % (self.args[0])
+
+
+class MakeFunction(Instruction):
+    """ Bind a declared function's name to a new function object """
+
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+
+    def __str__(self):
+        if self.function.frames:
+            return 'function %s(frames)' % (self.name)
+        return 'function %s' % (self.name)
+
+
+class Link(Instruction):
+    """ Define the functions of a compiled module(see linker.py), by running
+        its code object
+    """
+
+    def __init__(self, name, code):
+        self.name = name
+        self.code = code
+
+    def __str__(self):
+        return 'link %s' % (self.name)
+
+
+# Metering(see codegen.CodeGen's budget)
+class Budget(Instruction):
+    """ Start metering: give each counter in limits(a dict) its budget """
+
+    def __init__(self, limits):
+        self.limits = limits
+
+    def __str__(self):
+        return 'budget %s' % (', '.join(['%s %d' % (c, self.limits[c])
+                                         for c in sorted(self.limits)]))
+
+
+class Charge(Instruction):
+    """ Take one from a budget counter, raising BudgetExhausted when it has
+        none left. Only placed where the value stack is empty.
+    """
+
+    def __init__(self, counter):
+        self.counter = counter
+
+    def __str__(self):
+        return 'charge %s' % (self.counter)
+
+
+class Refund(Instruction):
+    """ Give one back to a budget counter(the call depth, on return) """
+
+    def __init__(self, counter):
+        self.counter = counter
+
+    def __str__(self):
+        return 'refund %s' % (self.counter)
+
+
+# Tiered compilation(see codegen.CodeGen's tier_up)
+class Counter(Instruction):
+    """ Set a call counter(a global) to an iterator of count items """
+
+    def __init__(self, counter, count):
+        self.counter = counter
+        self.count = count
+
+    def __str__(self):
+        return 'counter %s, %d' % (self.counter, self.count)
+
+
+class TierUp(Instruction):
+    """ Recompile a hot function at the top tier and rebind its name.
+        dest is the new function; key names its retained declaration.
+    """
+
+    def __init__(self, dest, key):
+        self.dest = dest
+        self.key = key
+
+    def __str__(self):
+        return '%stierup %s' % (self.dest_str(), self.key)
+
+
+# Terminators
+class Jump(Instruction):
+
+    def __init__(self, target):
+        self.target = target
+
+    def targets(self):
+        return [self.target]
+
+    def __str__(self):
+        return 'jump %s' % (self.target.name)
+
+
+class Branch(Instruction):
+    """ Go to if_true when args[0] is true, otherwise if_false """
+
+    def __init__(self, arg, if_true, if_false):
+        self.args = (arg,)
+        self.if_true = if_true
+        self.if_false = if_false
+
+    def targets(self):
+        return [self.if_true, self.if_false]
+
+    def __str__(self):
+        return 'branch %%%d, %s, %s' % (self.args[0], self.if_true.name,
+                                        self.if_false.name)
+
+
+class Countdown(Instruction):
+    """ Take one from a counter, going to if_done once it has run out,
+        otherwise to if_left
+    """
+
+    def __init__(self, counter, if_done, if_left):
+        self.counter = counter
+        self.if_done = if_done
+        self.if_left = if_left
+
+    def targets(self):
+        return [self.if_done, self.if_left]
+
+    def __str__(self):
+        return 'countdown %s, %s, %s' % (self.counter, self.if_done.name,
+                                         self.if_left.name)
+
+
+class Iterate(Instruction):
+    """ Store the next item of the iterator args[0] in var and go to
+        if_next, or go to if_done once it has run out. The only terminator
+        to write a variable.
+    """
+
+    def __init__(self, iterator, var, if_next, if_done):
+        self.args = (iterator,)
+        self.var = var
+        self.if_next = if_next
+        self.if_done = if_done
+
+    def targets(self):
+        return [self.if_next, self.if_done]
+
+    def __str__(self):
+        return 'iterate %%%d, %s, %s, %s' % (self.args[0], self.var,
+                                             self.if_next.name, self.if_done.name)
+
+
+class Return(Instruction):
+
+    def __init__(self, arg):
+        self.args = (arg,)
+
+    def targets(self):
+        return []
+
+    def __str__(self):
+        return 'return %%%d' % (self.args[0])
+
+
+class Block(object):
+    """ A basic block: instructions, then one terminator """
+
+    def __init__(self, name):
+        self.name = name
+        self.instructions = []
+        self.terminator = None
+
+    def successors(self):
+        if self.terminator is None:
+            return []
+        return self.terminator.targets()
+
+    def __str__(self):
+        lines = ['%s:' % (self.name)]
+        for instruction in self.instructions:
+            lines.append('    %s' % (instruction))
+        lines.append('    %s' % (self.terminator))
+        return '\n'.join(lines)
+
+
+class Function(object):
+    """ One code object's worth of IR: the main program or a function """
+
+    def __init__(self, name, params):
+        self.name = name
+        # Mangled parameter names
+        self.params = params
+        # Runs on trampoline frames(a generator; see trampoline.py)
+        self.frames = False
+        self.blocks = []
+        self.temps = 0
+        self.entry = self.new_block()
+
+    def new_temp(self):
+        self.temps += 1
+        return self.temps
+
+    def new_block(self):
+        block = Block('L%d' % (len(self.blocks)))
+        self.blocks.append(block)
+        return block
+
+    def reachable(self):
+        """ Blocks reachable from the entry, in layout order """
+        seen = set()
+        work = [self.entry]
+        while work:
+            block = work.pop()
+            if block in seen:
+                continue
+            seen.add(block)
+            work.extend(block.successors())
+        return [b for b in self.blocks if b in seen]
+
+    def predecessors(self):
+        """ Map each reachable block to the list of blocks jumping to it """
+        preds = {}
+        for block in self.reachable():
+            preds.setdefault(block, [])
+            for succ in block.successors():
+                preds.setdefault(succ, []).append(block)
+        return preds
+
+    def functions(self):
+        """ Functions declared directly in this one """
+        return [i.function for b in self.blocks for i in b.instructions
+                if type(i) is MakeFunction]
+
+    def __str__(self):
+        lines = ['function %s(%s)' % (self.name, ', '.join(self.params))]
+        for block in self.reachable():
+            lines.append(str(block))
+        return '\n'.join(lines)
+
+
+def dump(function):
+    """ Text of a function and every function declared within it """
+    parts = [str(function)]
+    for f in function.functions():
+        parts.append(dump(f))
+    return '\n\n'.join(parts)
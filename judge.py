@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+#
+# Batch runner for judging a Mini Triangle program
+#
+# Compiles a program once, then runs the callable against every test case
+# in a directory on a pool of warm worker processes. Each case is a pair
+# of files: NAME.in, given to the program as stdin, and NAME.out, the
+# output expected of it(optional; without one the case only runs). Cases
+# are judged in the order of their names, and the report gives each
+# one's verdict and time, and the throughput in cases per second.
+#
+# Workers are forked, so they inherit the compiled program(a generated
+# function, which could not be pickled) and start with it warm. A case
+# past its timeout is stopped by an alarm in its worker, which goes on to
+# the next case. One that ignores the alarm(say, stuck in a single huge
+# multiplication) or kills its worker has the worker replaced.
+#
+# Usage: python judge.py [-b backend] [-O[level]] [-j workers] [-t seconds]
+#                        [-I dir] [--json file] source.mt cases/
+#
+# Author: Wilson Giese
+#
+
+import os
+import signal
+import sys
+import timeit
+
+try:
+    from cStringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+try:
+    from Queue import Empty
+except ImportError:  # Python 3
+    from queue import Empty
+
+import compiler
+
+INPUT_EXTENSION = '.in'
+OUTPUT_EXTENSION = '.out'
+
+# Seconds a case may run before it is stopped
+DEFAULT_TIMEOUT = 2.0
+# Seconds past its timeout before a worker that has not stopped is replaced
+GRACE = 1.0
+# Longest wait for a result before checking for dead workers
+POLL = 0.1
+
+PASSED = 'pass'
+FAILED = 'fail'
+ERROR = 'error'
+TIMEOUT = 'timeout'
+RAN = 'ran'  # No expected output to compare with
+
+
+class Timeout(Exception):
+    pass
+
+
+def on_alarm(signum, frame):
+    raise Timeout()
+
+
+def load_cases(directory):
+    """ (name, input, expected output or None) of each case in a directory """
+    cases = []
+    for entry in sorted(os.listdir(directory)):
+        name, exten = os.path.splitext(entry)
+        if exten != INPUT_EXTENSION:
+            continue
+        with open(os.path.join(directory, entry), 'r') as input_f:
+            text = input_f.read()
+        expected = None
+        output_path = os.path.join(directory, name + OUTPUT_EXTENSION)
+        if os.path.isfile(output_path):
+            with open(output_path, 'r') as output_f:
+                expected = output_f.read()
+        cases.append((name, text, expected))
+    return cases
+
+
+def normalize(output):
+    """ Output lines, ignoring trailing spaces and blank lines """
+    lines = [line.rstrip() for line in output.splitlines()]
+    while lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def verdict(output, error, expected):
+    if error == 'Timeout':
+        return TIMEOUT
+    elif error is not None:
+        return ERROR
+    elif expected is None:
+        return RAN
+    elif normalize(output) == normalize(expected):
+        return PASSED
+    return FAILED
+
+
+def run_case(func, text, timeout):
+    """ Run the program on one input; return (output, exception name,
+        seconds)
+    """
+    stdin, stdout = sys.stdin, sys.stdout
+    sys.stdin = StringIO(text)
+    sys.stdout = StringIO()
+    error = None
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    start = timeit.default_timer()
+    try:
+        func()
+    except Timeout:
+        error = 'Timeout'
+    except Exception as e:
+        error = type(e).__name__
+    finally:
+        elapsed = timeit.default_timer() - start
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        output = sys.stdout.getvalue()
+        sys.stdin, sys.stdout = stdin, stdout
+    return output, error, elapsed
+
+
+def work(func, worker, tasks, results, timeout):
+    """ Worker loop: run each (index, input) task until given None """
+    signal.signal(signal.SIGALRM, on_alarm)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        index, text = task
+        output, error, elapsed = run_case(func, text, timeout)
+        results.put((worker, index, output, error, elapsed))
+
+
+class Pool(object):
+    """ Worker processes running one compiled program, each given its own
+        task queue so the parent knows which case each one is on
+    """
+
+    def __init__(self, func, workers, timeout):
+        import multiprocessing
+        if hasattr(multiprocessing, 'get_context'):
+            # Python 3 may default to spawning workers, which would have
+            # to pickle func
+            multiprocessing = multiprocessing.get_context('fork')
+        self.multiprocessing = multiprocessing
+        self.func = func
+        self.timeout = timeout
+        self.results = multiprocessing.Queue()
+        self.tasks = [None] * workers
+        self.processes = [None] * workers
+        for worker in range(workers):
+            self.start(worker)
+
+    def start(self, worker):
+        """ Start(or replace) a worker """
+        # The worker would otherwise flush its copy of anything buffered
+        sys.stdout.flush()
+        self.tasks[worker] = self.multiprocessing.Queue()
+        process = self.multiprocessing.Process(
+            target=work, args=(self.func, worker, self.tasks[worker],
+                               self.results, self.timeout))
+        process.daemon = True
+        process.start()
+        self.processes[worker] = process
+
+    def replace(self, worker):
+        process = self.processes[worker]
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        self.start(worker)
+
+    def close(self):
+        for worker, process in enumerate(self.processes):
+            if process.is_alive():
+                self.tasks[worker].put(None)
+        for process in self.processes:
+            process.join(GRACE)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+
+def judge(func, cases, workers=None, timeout=DEFAULT_TIMEOUT):
+    """ Run a compiled program on each of cases((name, input, expected)).
+
+        Returns the result of each case, in order: a dictionary of its
+        name, verdict, exception name(or None), seconds, output and
+        expected output.
+    """
+    import multiprocessing
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(cases)))
+
+    results = [None] * len(cases)
+
+    def record(index, output, error, elapsed):
+        name, text, expected = cases[index]
+        results[index] = {'name': name,
+                          'verdict': verdict(output, error, expected),
+                          'error': error,
+                          'seconds': elapsed,
+                          'output': output,
+                          'expected': expected}
+
+    if not cases:
+        return results
+    pool = Pool(func, workers, timeout)
+    try:
+        idle = list(range(workers))
+        # Worker: (case index, when it was sent, deadline)
+        running = {}
+        next_case = 0
+        while next_case < len(cases) or running:
+            while idle and next_case < len(cases):
+                worker = idle.pop()
+                pool.tasks[worker].put((next_case, cases[next_case][1]))
+                now = timeit.default_timer()
+                running[worker] = (next_case, now, now + timeout + GRACE)
+                next_case += 1
+
+            wait = min([deadline for i, s, deadline in running.values()])
+            wait = min(POLL, max(0.01, wait - timeit.default_timer()))
+            try:
+                message = pool.results.get(True, wait)
+            except Empty:
+                pass
+            else:
+                worker, index, output, error, elapsed = message
+                # Unless the worker was replaced before this arrived
+                if worker in running and running[worker][0] == index:
+                    record(index, output, error, elapsed)
+                    del running[worker]
+                    idle.append(worker)
+
+            # Replace workers stuck past their deadline, or that died
+            now = timeit.default_timer()
+            for worker, (index, sent, deadline) in list(running.items()):
+                alive = pool.processes[worker].is_alive()
+                if alive and now < deadline:
+                    continue
+                pool.replace(worker)
+                record(index, '', 'Timeout' if alive else 'WorkerDied',
+                       now - sent)
+                del running[worker]
+                idle.append(worker)
+    finally:
+        pool.close()
+    return results
+
+
+def summarize(results, seconds, workers):
+    """ Counts of each verdict, the wall time and the throughput """
+    counts = dict([(v, 0) for v in (PASSED, FAILED, ERROR, TIMEOUT, RAN)])
+    for result in results:
+        counts[result['verdict']] += 1
+    return {'cases': len(results),
+            'verdicts': counts,
+            'seconds': seconds,
+            'cases_per_second': len(results) / seconds if seconds else 0.0,
+            'workers': workers}
+
+
+def report(results, summary):
+    """ Text report: a line per case, then the totals """
+    lines = []
+    for result in results:
+        detail = ''
+        if result['verdict'] == ERROR:
+            detail = ' (%s)' % (result['error'])
+        lines.append('%-20s %-8s %8.1fms%s' % (result['name'], result['verdict'],
+                                               result['seconds'] * 1000, detail))
+    counts = summary['verdicts']
+    lines.append('%d cases: %d passed, %d failed, %d errors, %d timeouts, %d ran '
+                 'in %.2fs(%.1f cases/s on %d workers)' %
+                 (summary['cases'], counts[PASSED], counts[FAILED],
+                  counts[ERROR], counts[TIMEOUT], counts[RAN],
+                  summary['seconds'], summary['cases_per_second'],
+                  summary['workers']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import multiprocessing
+
+    import optimize
+
+    arg_parser = argparse.ArgumentParser(description='Mini Triangle batch judge')
+    arg_parser.add_argument('source', help='/path/to/source.mt')
+    arg_parser.add_argument('cases', help='directory of NAME.in and NAME.out files')
+    arg_parser.add_argument('-b', '--backend', default='byteplay',
+                            choices=['byteplay', 'pyast', 'closure'],
+                            help='code generator to use (default: byteplay)')
+    optimize.add_level_arguments(arg_parser)
+    arg_parser.add_argument('-j', '--workers', type=int,
+                            default=multiprocessing.cpu_count(),
+                            help='worker processes (default: %(default)s)')
+    arg_parser.add_argument('-t', '--timeout', type=float, default=DEFAULT_TIMEOUT,
+                            help='seconds each case may run (default: %(default)s)')
+    arg_parser.add_argument('-I', '--include', action='append', default=[],
+                            metavar='DIR', help='also search DIR for imported modules')
+    arg_parser.add_argument('--json', help='also write the results to this file')
+    args = arg_parser.parse_args()
+
+    with open(args.source, 'r') as source:
+        text = source.read()
+    path = [os.path.dirname(args.source) or '.'] + args.include
+    options = {'backend': args.backend, 'optimize': args.optimize}
+    if args.backend == 'byteplay':
+        options['path'] = path
+    func = compiler.build(text, **options)
+
+    cases = load_cases(args.cases)
+    start = timeit.default_timer()
+    results = judge(func, cases, args.workers, args.timeout)
+    summary = summarize(results, timeit.default_timer() - start,
+                        max(1, min(args.workers, len(cases))))
+    print(report(results, summary))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'summary': summary, 'results': results}, f, indent=2,
+                      sort_keys=True)
+    sys.exit(0 if all([r['verdict'] in (PASSED, RAN) for r in results]) else 1)
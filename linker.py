@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+#
+# Separate compilation and linking of Mini Triangle modules
+#
+# A program(or a module) names the modules it uses with 'import name;'. A
+# module is a file, name.mt, holding only function declarations(after any
+# imports of its own). Each module compiles once to an artifact, name.mto
+# beside its source, holding:
+#
+#   code:      a code object which defines the module's functions
+#   interface: the signature of each function it exports, by name, as
+#              ([(parameter, type), ...], return type): the
+#              declared_functions format(see scope.Scoped), less its ast
+#              nodes, so it can be marshalled
+#   imports:   the modules it imports, with the stamp(a digest of the
+#              interface) of each one it was compiled against
+#
+# Linking a program puts the code of every module it uses, directly or
+# not, in front of its own, dependencies first. Functions find each other
+# through the program's globals, so a module's code does not change when
+# the code of one it imports does. It is only recompiled when its own
+# source changes, or the interface of a module it imports.
+#
+# Author: Wilson Giese
+#
+
+import hashlib
+import imp
+import marshal
+import os
+import threading
+
+import ast
+import parser
+import scanner
+from errors import *
+
+MODULE_EXTENSION = '.mt'
+ARTIFACT_EXTENSION = '.mto'
+
+# Bumped when the artifact layout changes
+ARTIFACT_VERSION = 1
+
+
+def digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def interface(declaration):
+    """ The signatures of the functions in a module's declarations """
+    signatures = {}
+    work = [declaration]
+    while work:
+        node = work.pop()
+        if type(node) is ast.SequentialDeclaration:
+            work.extend([node.decl1, node.decl2])
+        elif type(node) is ast.FunctionDeclaration:
+            params = [(v.identifier, t.identifier) for v, t in node.arg_list]
+            signatures[node.name] = (params, node.return_type_denoter)
+    return signatures
+
+
+def declared_functions(signatures):
+    """ An interface in the declared_functions format """
+    return dict([(name, ([(ast.Vname(p), ast.TypeDenoter(t)) for p, t in params],
+                         returns))
+                 for name, (params, returns) in signatures.items()])
+
+
+def optimize_functions(declaration, passes):
+    """ Run the AST passes over the body of each function in a module """
+    type_ = type(declaration)
+
+    if type_ is ast.SequentialDeclaration:
+        optimize_functions(declaration.decl1, passes)
+        optimize_functions(declaration.decl2, passes)
+    elif type_ is ast.FunctionDeclaration:
+        declaration.command = passes.run_ast(ast.Program(declaration.command)).command
+
+
+class Linker(object):
+    """ Finds the modules a program imports, compiling those with no up to
+        date artifact.
+
+        path is the list of directories searched for modules. passes, budget
+        and deep are the program's(see codegen.CodeGen), so its modules are
+        optimized, metered and run the same way. An artifact built with
+        other options is rebuilt.
+    """
+
+    def __init__(self, path, passes=None, budget=None, deep=False):
+        self.path = list(path)
+        self.passes = passes
+        self.budget = budget or {}
+        self.deep = deep
+        # Artifacts loaded so far, by module name
+        self.artifacts = {}
+        # Modules compiled rather than loaded from their artifact, in order
+        self.compiled = []
+        # Modules being loaded, to catch import cycles
+        self.loading = []
+
+    def options(self):
+        """ What a module's code depends on besides its source """
+        names = []
+        if self.passes is not None:
+            names = [p.name for p in self.passes.passes]
+            if 'unroll' in names:
+                names.append(self.passes.context.unroll_factor)
+        return (imp.get_magic(), ARTIFACT_VERSION, tuple(names),
+                tuple(sorted(self.budget.items())), self.deep)
+
+    def link(self, imports):
+        """ The artifacts of the modules imports names, and every module
+            they use, dependencies first
+        """
+        order = []
+        for name in imports:
+            self.collect(name, order)
+        return [self.artifacts[name] for name in order]
+
+    def collect(self, name, order):
+        if name in order:
+            return
+        artifact = self.load(name)
+        for dependency, stamp in artifact['imports']:
+            self.collect(dependency, order)
+        order.append(name)
+
+    def find(self, name):
+        """ Path of a module's source """
+        for directory in self.path:
+            source = os.path.join(directory, name + MODULE_EXTENSION)
+            if os.path.isfile(source):
+                return source
+        raise LinkError('No module named %s' % (name))
+
+    def load(self, name):
+        """ A module's artifact, compiled first if it is missing or stale """
+        artifact = self.artifacts.get(name)
+        if artifact is not None:
+            return artifact
+        if name in self.loading:
+            cycle = self.loading[self.loading.index(name):] + [name]
+            raise LinkError('Import cycle: %s' % (' -> '.join(cycle)))
+
+        self.loading.append(name)
+        try:
+            source_path = self.find(name)
+            with open(source_path, 'rb') as source:
+                text = source.read()
+            path = os.path.splitext(source_path)[0] + ARTIFACT_EXTENSION
+            artifact = self.cached(path, digest(text))
+            if artifact is None:
+                artifact = self.compile(name, text)
+                self.store(path, artifact)
+        finally:
+            self.loading.pop()
+
+        self.artifacts[name] = artifact
+        return artifact
+
+    def cached(self, path, source):
+        """ The artifact at path, or None if there is none up to date with
+            the source digest and the modules it imports
+        """
+        try:
+            with open(path, 'rb') as artifact_f:
+                artifact = marshal.load(artifact_f)
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+        if (type(artifact) is not dict or
+                artifact.get('options') != self.options() or
+                artifact.get('source') != source):
+            return None
+        for dependency, stamp in artifact['imports']:
+            if self.load(dependency)['stamp'] != stamp:
+                return None
+        return artifact
+
+    def compile(self, name, text):
+        """ Compile a module's source to its artifact """
+        import codegen
+
+        try:
+            module = parser.Parser(scanner.Scanner(text).scan_stream()).parse_module()
+        except (scanner.ScannerError, parser.ParserException) as e:
+            raise LinkError('Could not compile module %s:\n%s' % (name, e))
+        imports = [(d, self.load(d)['stamp']) for d in module.imports]
+        if self.passes is not None:
+            optimize_functions(module.declaration, self.passes)
+
+        cg = codegen.CodeGen(module, self.passes, self.budget, linker=self,
+                             deep=self.deep)
+        cg.function.name = name
+        code = cg.assemble(cg.lower(), False).to_code()
+        signatures = interface(module.declaration)
+        self.compiled.append(name)
+        return {'name': name,
+                'options': self.options(),
+                'source': digest(text),
+                'imports': imports,
+                'interface': signatures,
+                'stamp': digest(repr(sorted(signatures.items()))),
+                'code': code}
+
+    def store(self, path, artifact):
+        """ Write an artifact. One that cannot be written(say the module is
+            in a read only directory) is compiled again next time.
+        """
+        # Each thread(the compile server runs one per request) writes a
+        # file of its own
+        temp = '%s.%d.%d' % (path, os.getpid(),
+                             threading.current_thread().ident)
+        try:
+            with open(temp, 'wb') as artifact_f:
+                marshal.dump(artifact, artifact_f)
+            # Readers see the old artifact or the new one, never half of one
+            os.rename(temp, path)
+        except (IOError, OSError):
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
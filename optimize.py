@@ -0,0 +1,1265 @@
+#!/usr/bin/env python
+#
+# Optimization passes for Mini Triangle
+#
+# Each pass is a class whose run() method takes what it optimizes and
+# returns the (possibly rewritten) result. AST passes(stage 'ast') take a
+# Program; code passes(stage 'ir') take an ir.Function and run on the
+# main program and every declared function. Passes rewrite in place, so
+# PassManager.run_ast() works on a copy of the tree.
+#
+# Passes and the walks they share are visitors(see visitor.py): a method
+# per kind of node they handle, the rest walked generically.
+#
+# Author: Wilson Giese
+#
+
+import sys
+import timeit
+
+import ast
+import ir
+import visitor
+
+# Operators which cannot raise on Integer operands. Division and modulo are
+# only safe with a non-zero literal divisor, see can_raise().
+SAFE_OPERATORS = ['+', '-', '*', '<', '>', '=']
+
+
+# Loops of up to this many iterations are unrolled completely
+FULL_UNROLL_TRIPS = 8
+# Default copies of the body in a partially unrolled loop
+UNROLL_FACTOR = 4
+
+
+def temp_name(n):
+    """ Name of the nth compiler temporary.
+
+        Mini Triangle identifiers are letters and digits only, so these
+        never clash with program names. The trailing '_' keeps them unique
+        once the code generators append a scope depth.
+    """
+    return '_t%d_' % (n)
+
+
+class Context(object):
+    """ What the passes over one tree share.
+
+        temps: the temporary name allocator.
+        target: major version of the Python that will run the code, which
+        decides what pays off.
+        unroll_factor: copies of its body a partially unrolled loop holds.
+    """
+
+    def __init__(self, target, unroll_factor=None):
+        self.temps = Temps()
+        self.target = target
+        self.unroll_factor = UNROLL_FACTOR if unroll_factor is None else unroll_factor
+
+
+def target_version(backend):
+    """ Python major version the code from a backend runs on """
+    if backend == 'byteplay':
+        return 2
+    return sys.version_info[0]
+
+
+class Temps(object):
+    """ Hands out temporary names, unique across all passes over a tree """
+
+    def __init__(self):
+        self.count = 0
+
+    def new(self):
+        self.count += 1
+        return temp_name(self.count)
+
+
+def is_pure(node):
+    """ Is an expression free of calls(and so of side effects)? """
+    type_ = type(node)
+
+    if type_ is ast.BinaryExpression:
+        return is_pure(node.expr1) and is_pure(node.expr2)
+    elif type_ is ast.UnaryExpression:
+        return is_pure(node.expression)
+    elif type_ is ast.IntegerExpression or type_ is ast.VnameExpression:
+        return True
+    return False
+
+
+def can_raise(node):
+    """ Could evaluating a pure expression raise on Integer operands? """
+    type_ = type(node)
+
+    if type_ is ast.BinaryExpression:
+        if node.oper not in SAFE_OPERATORS:
+            if node.oper not in ['/', '\\'] or \
+                    type(node.expr2) is not ast.IntegerExpression or \
+                    node.expr2.value == 0:
+                return True
+        return can_raise(node.expr1) or can_raise(node.expr2)
+    elif type_ is ast.UnaryExpression:
+        return node.operator not in ['+', '-'] or can_raise(node.expression)
+    return False
+
+
+def expression_names(node, names):
+    """ Add every variable an expression reads to names """
+    type_ = type(node)
+
+    if type_ is ast.BinaryExpression:
+        expression_names(node.expr1, names)
+        expression_names(node.expr2, names)
+    elif type_ is ast.UnaryExpression:
+        expression_names(node.expression, names)
+    elif type_ is ast.VnameExpression:
+        names.add(node.variable.identifier)
+    elif type_ is ast.CallCommand:
+        for e in node.expr_list:
+            expression_names(e, names)
+    return names
+
+
+class WrittenNames(visitor.Visitor):
+    """ Adds every name the commands visited assign or declare to names.
+
+        Function bodies are skipped; they run in their own frame.
+    """
+
+    def __init__(self, names):
+        visitor.Visitor.__init__(self)
+        self.names = names
+
+    def visit_AssignCommand(self, node):
+        self.names.add(node.variable.identifier)
+
+    def visit_ConstDeclaration(self, node):
+        self.names.add(node.identifier)
+
+    def visit_VarDeclaration(self, node):
+        self.names.add(node.identifier)
+
+    def visit_Expression(self, node):
+        pass
+
+    def visit_FunctionDeclaration(self, node):
+        pass
+
+
+class DeclaredNames(WrittenNames):
+    """ Adds every name declared within the commands visited to names(not
+        in functions)
+    """
+
+    def visit_AssignCommand(self, node):
+        pass
+
+
+def written_names(node, names):
+    """ Add every name a command assigns or declares to names """
+    WrittenNames(names).visit(node)
+    return names
+
+
+def declared_names(node, names):
+    """ Add every name declared within a command to names(not in functions) """
+    DeclaredNames(names).visit(node)
+    return names
+
+
+def map_expressions(node, fn, functions=True):
+    """ Replace every outermost expression in a command or declaration by
+        fn(expression). Function bodies are skipped unless functions is True.
+    """
+    type_ = type(node)
+
+    if type_ is ast.SequentialCommand:
+        for command in sequence(node):
+            map_expressions(command, fn, functions)
+    elif type_ is ast.AssignCommand or type_ is ast.ReturnCommand:
+        node.expression = fn(node.expression)
+    elif type_ is ast.CallCommand:
+        node.expr_list = [fn(e) for e in node.expr_list]
+    elif type_ is ast.IfCommand:
+        node.expression = fn(node.expression)
+        map_expressions(node.command1, fn, functions)
+        map_expressions(node.command2, fn, functions)
+    elif type_ is ast.WhileCommand:
+        node.expression = fn(node.expression)
+        map_expressions(node.command, fn, functions)
+    elif type_ is ast.LetCommand:
+        map_expressions(node.declaration, fn, functions)
+        map_expressions(node.command, fn, functions)
+    elif type_ is ast.ConstDeclaration:
+        node.expression = fn(node.expression)
+    elif type_ is ast.SequentialDeclaration:
+        map_expressions(node.decl1, fn, functions)
+        map_expressions(node.decl2, fn, functions)
+    elif type_ is ast.FunctionDeclaration and functions:
+        map_expressions(node.command, fn, functions)
+
+
+def map_subexpressions(node, fn):
+    """ Replace the operands of an expression by fn(operand) """
+    type_ = type(node)
+
+    if type_ is ast.BinaryExpression:
+        node.expr1 = fn(node.expr1)
+        node.expr2 = fn(node.expr2)
+    elif type_ is ast.UnaryExpression:
+        node.expression = fn(node.expression)
+    elif type_ is ast.CallCommand:
+        node.expr_list = [fn(e) for e in node.expr_list]
+    return node
+
+
+class LoopMapper(visitor.Transformer):
+    """ Replaces every while loop by fn(loop), innermost first """
+
+    def __init__(self, fn):
+        visitor.Transformer.__init__(self)
+        self.fn = fn
+
+    def visit_WhileCommand(self, node):
+        node.command = self.visit(node.command)
+        return self.fn(node)
+
+    def visit_Expression(self, node):
+        return node
+
+
+def map_loops(node, fn):
+    """ Replace every while loop in a command by fn(loop), innermost first.
+
+        Returns the replacement for node itself.
+    """
+    return LoopMapper(fn).visit(node)
+
+
+def sequence(node):
+    """ The commands a (nested) SequentialCommand runs, in order """
+    if type(node) is not ast.SequentialCommand:
+        return [node]
+    return [getattr(s, name) for s, name in visitor.sequence_slots(node)]
+
+
+def make_sequence(commands):
+    """ Nest a list of commands into SequentialCommands, as the parser does """
+    node = commands[0]
+    for command in commands[1:]:
+        node = ast.SequentialCommand(node, command)
+    return node
+
+
+def declare_consts(temps, command):
+    """ Wrap command in lets binding temps, a list of (name, expression).
+
+        A const is stored once and needs no None initialisation first.
+    """
+    for name, expr in reversed(temps):
+        command = ast.LetCommand(ast.ConstDeclaration(name, expr), command)
+    return command
+
+
+def declare_temps(temps, command):
+    """ Wrap command in a let declaring temps, a list of (name, expression),
+        each assigned its expression before command runs.
+    """
+    decl = None
+    init = None
+    for name, expr in temps:
+        var = ast.VarDeclaration(name, ast.TypeDenoter('Integer'))
+        assign = ast.AssignCommand(ast.Vname(name), expr)
+        decl = var if decl is None else ast.SequentialDeclaration(decl, var)
+        init = assign if init is None else ast.SequentialCommand(init, assign)
+    return ast.LetCommand(decl, ast.SequentialCommand(init, command))
+
+
+class LoopInvariantMotion(object):
+    """ Moves loop invariant expressions out of while loops.
+
+        An expression is hoisted into a temporary computed before the loop
+        when it reads no name the loop assigns or declares, makes no calls,
+        and cannot raise. The last rule makes evaluating it when the loop
+        would not have run unobservable. Uninitialised variables are taken
+        to hold Integers.
+    """
+
+    name = 'licm'
+    stage = 'ast'
+
+    def __init__(self, context):
+        self.temps = context.temps
+
+    def run(self, tree):
+        # Inner loops go first; what they hoist may move further out
+        tree.command = map_loops(tree.command, self.hoist)
+        return tree
+
+    def hoist(self, loop):
+        variant = written_names(loop.command, set())
+        hoisted = []
+        replace = lambda e: self.replace(e, variant, hoisted)
+        loop.expression = replace(loop.expression)
+        # Function bodies run in their own frame; leave them alone
+        map_expressions(loop.command, replace, functions=False)
+
+        if len(hoisted) == 0:
+            return loop
+        return declare_consts([(name, expr) for key, name, expr in hoisted], loop)
+
+    def invariant(self, node, variant):
+        return (is_pure(node) and not can_raise(node) and
+                len(expression_names(node, set()) & variant) == 0)
+
+    def replace(self, node, variant, hoisted):
+        """ Replace the largest invariant parts of an expression by temporaries """
+        type_ = type(node)
+
+        if type_ is ast.BinaryExpression or type_ is ast.UnaryExpression:
+            if self.invariant(node, variant):
+                key = str(node)
+                for k, name, expr in hoisted:
+                    if k == key:
+                        break
+                else:
+                    name = self.temps.new()
+                    hoisted.append((key, name, node))
+                return ast.VnameExpression(ast.Vname(name))
+
+        return map_subexpressions(node,
+                                  lambda e: self.replace(e, variant, hoisted))
+
+
+def power_of_two(node):
+    """ Return k if node is the literal 2**k(k >= 1), otherwise None """
+    if type(node) is ast.IntegerExpression and node.value >= 2 and \
+            node.value & (node.value - 1) == 0:
+        return node.value.bit_length() - 1
+    return None
+
+
+def integer_step(oper, value):
+    """ Build 'oper value' for an update, keeping literals non-negative """
+    if value < 0:
+        oper = '-' if oper == '+' else '+'
+    return oper, ast.IntegerExpression(abs(value))
+
+
+class StrengthReduction(object):
+    r""" Replaces Integer arithmetic by cheaper equivalents.
+
+        double:     x * 2  ->  x + x             (x a variable)
+        mul_shift:  x * 2**k  ->  x << k
+        div_shift:  x / 2**k  ->  x >> k
+        mod_mask:   x \ 2**k  ->  x & (2**k - 1)
+        induction:  i * k in a while loop stepping i by a constant becomes
+                    a temporary advanced by the step times k each iteration
+
+        '/' and '\' floor, as Python's do, and >> and & floor the same way,
+        so the shift and mask rewrites hold for negative x too.
+
+        Which rewrites pay off depends on the interpreter; the defaults come
+        from PROFITABLE_REWRITES, measured with bench.py.
+    """
+
+    name = 'strength'
+    stage = 'ast'
+
+    def __init__(self, context, rewrites=None):
+        self.temps = context.temps
+        if rewrites is None:
+            rewrites = PROFITABLE_REWRITES.get(context.target, [])
+        self.rewrites = rewrites
+        self.min_induction_uses = MIN_INDUCTION_USES.get(context.target, 2)
+
+    def run(self, tree):
+        if 'induction' in self.rewrites:
+            tree.command = map_loops(tree.command, self.induction)
+        map_expressions(tree.command, self.reduce)
+        return tree
+
+    def reduce(self, node):
+        """ Return an expression with its operators reduced """
+        map_subexpressions(node, self.reduce)
+        if type(node) is not ast.BinaryExpression:
+            return node
+
+        if node.oper == '*':
+            # Constant on the left; operands of '*' may swap, a literal has
+            # no side effects to reorder
+            if type(node.expr1) is ast.IntegerExpression and \
+                    type(node.expr2) is not ast.IntegerExpression:
+                node.expr1, node.expr2 = node.expr2, node.expr1
+            if 'double' in self.rewrites and \
+                    type(node.expr2) is ast.IntegerExpression and \
+                    node.expr2.value == 2 and \
+                    type(node.expr1) is ast.VnameExpression:
+                return ast.BinaryExpression(node.expr1, '+', visitor.copy(node.expr1))
+            k = power_of_two(node.expr2)
+            if 'mul_shift' in self.rewrites and k is not None:
+                return ast.BinaryExpression(node.expr1, '<<', ast.IntegerExpression(k))
+        elif node.oper == '/':
+            k = power_of_two(node.expr2)
+            if 'div_shift' in self.rewrites and k is not None:
+                return ast.BinaryExpression(node.expr1, '>>', ast.IntegerExpression(k))
+        elif node.oper == '\\':
+            k = power_of_two(node.expr2)
+            if 'mod_mask' in self.rewrites and k is not None:
+                return ast.BinaryExpression(node.expr1, '&',
+                                            ast.IntegerExpression(node.expr2.value - 1))
+        return node
+
+    def induction(self, loop):
+        """ Reduce multiplications by the loop's induction variables """
+        written = written_names(loop.command, set())
+        declared = declared_names(loop.command, set())
+        temps = []
+
+        for command in sequence(loop.command):
+            if type(command) is not ast.AssignCommand:
+                continue
+            var = command.variable.identifier
+            step = induction_step(command)
+            if step is None or var in declared or \
+                    count_assignments(loop.command, var) != 1:
+                continue
+
+            # Count i * k for every loop invariant k
+            uses = {}
+            count = lambda e: self.count_products(e, var, written, uses)
+            count(loop.expression)
+            map_expressions(loop.command, count, functions=False)
+
+            for key, (factor, n) in sorted(uses.items()):
+                if n < self.min_induction_uses:
+                    continue
+                temp = self.temps.new()
+                temps.append((temp, ast.BinaryExpression(
+                    ast.VnameExpression(ast.Vname(var)), '*', visitor.copy(factor))))
+
+                if type(factor) is ast.IntegerExpression:
+                    oper, delta = integer_step('+', step * factor.value)
+                elif abs(step) == 1:
+                    oper, delta = '+' if step > 0 else '-', visitor.copy(factor)
+                else:
+                    delta_temp = self.temps.new()
+                    temps.append((delta_temp, ast.BinaryExpression(
+                        visitor.copy(factor), '*', ast.IntegerExpression(abs(step)))))
+                    oper = '+' if step > 0 else '-'
+                    delta = ast.VnameExpression(ast.Vname(delta_temp))
+
+                replace = lambda e: self.replace_products(e, var, key, temp)
+                loop.expression = replace(loop.expression)
+                map_expressions(loop.command, replace, functions=False)
+
+                # Keep the temporary equal to i * k right after i steps
+                update = ast.AssignCommand(ast.Vname(temp), ast.BinaryExpression(
+                    ast.VnameExpression(ast.Vname(temp)), oper, delta))
+                loop.command = replace_command(loop.command, command,
+                                               ast.SequentialCommand(command, update))
+
+        if len(temps) == 0:
+            return loop
+        return declare_temps(temps, loop)
+
+    def count_products(self, node, var, written, uses):
+        factor = product_factor(node, var, written)
+        if factor is not None:
+            key = str(factor)
+            uses[key] = (factor, uses.get(key, (factor, 0))[1] + 1)
+        map_subexpressions(node, lambda e: self.count_products(e, var, written, uses))
+        return node
+
+    def replace_products(self, node, var, key, temp):
+        factor = product_factor(node, var, set())
+        if factor is not None and str(factor) == key:
+            return ast.VnameExpression(ast.Vname(temp))
+        return map_subexpressions(node,
+                                  lambda e: self.replace_products(e, var, key, temp))
+
+
+def count_assignments(node, var):
+    """ How many assignments to var a command holds(not in functions) """
+    count = [0]
+
+    def visit(command):
+        for c in sequence(command):
+            type_ = type(c)
+            if type_ is ast.AssignCommand and c.variable.identifier == var:
+                count[0] += 1
+            elif type_ is ast.IfCommand:
+                visit(c.command1)
+                visit(c.command2)
+            elif type_ is ast.WhileCommand or type_ is ast.LetCommand:
+                visit(c.command)
+    visit(node)
+    return count[0]
+
+
+def induction_step(assign):
+    """ Return c for 'i := i + c', 'i := c + i' or(as -c) 'i := i - c' """
+    var = assign.variable.identifier
+    expr = assign.expression
+    if type(expr) is not ast.BinaryExpression or expr.oper not in ['+', '-']:
+        return None
+
+    is_var = lambda e: type(e) is ast.VnameExpression and e.variable.identifier == var
+    is_int = lambda e: type(e) is ast.IntegerExpression
+    if is_var(expr.expr1) and is_int(expr.expr2):
+        return expr.expr2.value if expr.oper == '+' else -expr.expr2.value
+    if expr.oper == '+' and is_int(expr.expr1) and is_var(expr.expr2):
+        return expr.expr1.value
+    return None
+
+
+def product_factor(node, var, written):
+    """ For var * k or k * var, k a literal or a variable not in written,
+        return k; otherwise None.
+    """
+    if type(node) is not ast.BinaryExpression or node.oper != '*':
+        return None
+
+    for a, b in [(node.expr1, node.expr2), (node.expr2, node.expr1)]:
+        if type(a) is ast.VnameExpression and a.variable.identifier == var:
+            if type(b) is ast.IntegerExpression:
+                return b
+            if type(b) is ast.VnameExpression and \
+                    b.variable.identifier != var and \
+                    b.variable.identifier not in written:
+                return b
+    return None
+
+
+def replace_command(node, old, new):
+    """ Replace command old, somewhere in the sequence node, by new """
+    if node is old:
+        return new
+    if type(node) is ast.SequentialCommand:
+        node.command1 = replace_command(node.command1, old, new)
+        node.command2 = replace_command(node.command2, old, new)
+    return node
+
+
+class LoopUnrolling(visitor.Transformer):
+    """ Unrolls counting while loops with a trip count known statically.
+
+        A loop qualifies when its test is i < n or i > n(either way round),
+        n a literal or a name holding one, and its body steps i by a
+        constant with an assignment of its own(i := i + c) and assigns i
+        nowhere else. The value of i on entry must be known: the pass
+        follows which variables hold literals through the commands before
+        the loop.
+
+        A loop of up to full_trips iterations becomes that many copies of
+        its body. A longer one keeps its loop with factor copies of the
+        body in it, so it tests once per factor iterations, and runs the
+        iterations left over first. Loops whose body would grow past
+        MAX_SIZE nodes are left alone.
+    """
+
+    name = 'unroll'
+    stage = 'ast'
+
+    # AST nodes an unrolled loop body may hold
+    MAX_SIZE = 240
+
+    def __init__(self, context, factor=None, full_trips=None):
+        visitor.Transformer.__init__(self)
+        self.factor = context.unroll_factor if factor is None else factor
+        self.full_trips = FULL_UNROLL_TRIPS if full_trips is None else full_trips
+        # The names holding a literal before the command being visited,
+        # with their values; updated to after it
+        self.known = {}
+
+    def run(self, tree):
+        tree.command = self.visit(tree.command)
+        return tree
+
+    def visit_AssignCommand(self, node):
+        value = literal_value(node.expression, self.known)
+        if value is None:
+            self.known.pop(node.variable.identifier, None)
+        else:
+            self.known[node.variable.identifier] = value
+        return node
+
+    def visit_IfCommand(self, node):
+        known = self.known
+        self.known = dict(known)
+        node.command1 = self.visit(node.command1)
+        self.known = dict(known)
+        node.command2 = self.visit(node.command2)
+        self.known = known
+        forget(known, written_names(node, set()))
+        return node
+
+    def visit_WhileCommand(self, node):
+        known = self.known
+        written = written_names(node.command, set())
+        self.known = dict(known)
+        forget(self.known, written)
+        node.command = self.visit(node.command)
+        self.known = known
+        node, final = self.unroll_loop(node, known)
+        forget(known, written)
+        known.update(final)
+        return node
+
+    def visit_LetCommand(self, node):
+        declared = declared_names(node.declaration, set())
+        forget(self.known, declared)
+        self.visit(node.declaration)
+        node.command = self.visit(node.command)
+        # Outer names these shadowed may hold something else again
+        forget(self.known, declared)
+        return node
+
+    def visit_ConstDeclaration(self, node):
+        value = literal_value(node.expression, self.known)
+        if value is not None:
+            self.known[node.identifier] = value
+        return node
+
+    def visit_FunctionDeclaration(self, node):
+        # A function sees nothing of the frame it is declared in
+        known, self.known = self.known, {}
+        node.command = self.visit(node.command)
+        self.known = known
+        return node
+
+    def visit_Expression(self, node):
+        return node
+
+    def unroll_loop(self, loop, known):
+        """ Return (replacement, {i: its value after}) for a loop """
+        counter = counting_loop(loop, known)
+        if counter is None:
+            return loop, {}
+        var, start, bound, step = counter
+        trips = trip_count(start, bound, step)
+        final = {var: start + trips * step}
+        size = node_count(loop.command)
+
+        if 0 < trips <= self.full_trips and trips * size <= self.MAX_SIZE:
+            return make_sequence(self.copies(loop.command, trips)), final
+        if self.factor > 1 and trips >= 2 * self.factor and \
+                self.factor * size <= self.MAX_SIZE:
+            body = loop.command
+            left = trips % self.factor
+            loop.command = make_sequence(self.copies(body, self.factor))
+            if left == 0:
+                return loop, final
+            return make_sequence(self.copies(body, left) + [loop]), final
+        return loop, final
+
+    def copies(self, node, n):
+        return [visitor.copy(c) for i in range(n) for c in sequence(node)]
+
+
+def literal_value(node, known):
+    """ The value of a literal, or of a name holding one; otherwise None """
+    if type(node) is ast.IntegerExpression:
+        return node.value
+    elif type(node) is ast.VnameExpression:
+        return known.get(node.variable.identifier)
+    return None
+
+
+def forget(known, names):
+    for name in names:
+        known.pop(name, None)
+
+
+def node_count(node):
+    """ Number of AST nodes in a tree """
+    if type(node) is list or type(node) is tuple:
+        return sum([node_count(n) for n in node])
+    elif not isinstance(node, ast.AST):
+        return 0
+    return 1 + sum([node_count(v) for v in vars(node).values()])
+
+
+class FunctionFinder(visitor.Visitor):
+    """ Sets found on visiting anything declaring a function """
+    found = False
+
+    def visit_FunctionDeclaration(self, node):
+        self.found = True
+
+    def visit_Expression(self, node):
+        pass
+
+
+def declares_function(node):
+    """ Does a command declare a function anywhere within it? """
+    finder = FunctionFinder()
+    finder.visit(node)
+    return finder.found
+
+
+def counting_loop(loop, known):
+    """ For a loop stepping i from a known value to a known bound, return
+        (i, start, bound, step); otherwise None.
+    """
+    test = loop.expression
+    if type(test) is not ast.BinaryExpression or test.oper not in ['<', '>']:
+        return None
+    body = loop.command
+    written = written_names(body, set())
+    if declares_function(body):
+        return None
+
+    for var_side, bound_side, oper in [(test.expr1, test.expr2, test.oper),
+                                       (test.expr2, test.expr1,
+                                        '>' if test.oper == '<' else '<')]:
+        if type(var_side) is not ast.VnameExpression:
+            continue
+        var = var_side.variable.identifier
+        start = known.get(var)
+        bound = literal_value(bound_side, known)
+        if start is None or bound is None or \
+                type(bound_side) is ast.VnameExpression and \
+                bound_side.variable.identifier in written:
+            continue
+        if var in declared_names(body, set()) or count_assignments(body, var) != 1:
+            continue
+
+        for command in sequence(body):
+            if type(command) is ast.AssignCommand and \
+                    command.variable.identifier == var:
+                step = induction_step(command)
+                if step is None or (step > 0) != (oper == '<'):
+                    return None
+                return var, start, bound, step
+    return None
+
+
+def trip_count(start, bound, step):
+    """ Iterations of a loop stepping from start while short of bound """
+    if step > 0:
+        return max(0, (bound - start + step - 1) // step)
+    return max(0, (start - bound - step - 1) // -step)
+
+
+class CommonSubexpressionElimination(object):
+    """ Computes repeated expressions once per basic block.
+
+        A basic block is a run of assignments, call and return commands,
+        optionally ended by an if command's condition. Within one, each
+        pure expression evaluated more than once with the same operand
+        values is bound to a temporary const before its first use, and the
+        later uses read that. Largest expressions are taken first.
+
+        An assignment to an operand starts a new value of the expression.
+        Calls cannot write their caller's variables(functions only see
+        their own frame), so they invalidate nothing; but an expression
+        which may raise is never moved ahead of a call in its command.
+    """
+
+    name = 'cse'
+    stage = 'ast'
+
+    def __init__(self, context):
+        self.temps = context.temps
+
+    def run(self, tree):
+        tree.command = self.command(tree.command)
+        return tree
+
+    def command(self, node):
+        """ Eliminate within every block of a command, return its replacement """
+        result = []
+        block = []
+        for command in sequence(node):
+            type_ = type(command)
+
+            if type_ is ast.AssignCommand or type_ is ast.CallCommand or \
+                    type_ is ast.ReturnCommand:
+                block.append(command)
+                continue
+
+            if type_ is ast.IfCommand:
+                command.command1 = self.command(command.command1)
+                command.command2 = self.command(command.command2)
+                block.append(command)
+            elif type_ is ast.WhileCommand:
+                command.command = self.command(command.command)
+            elif type_ is ast.LetCommand:
+                self.declaration(command.declaration)
+                command.command = self.command(command.command)
+
+            if len(block) > 0:
+                result.append(self.block(block))
+                block = []
+            if type_ is not ast.IfCommand:
+                result.append(command)
+
+        if len(block) > 0:
+            result.append(self.block(block))
+        return make_sequence(result)
+
+    def declaration(self, node):
+        type_ = type(node)
+
+        if type_ is ast.SequentialDeclaration:
+            self.declaration(node.decl1)
+            self.declaration(node.decl2)
+        elif type_ is ast.FunctionDeclaration:
+            node.command = self.command(node.command)
+
+    def block(self, block):
+        """ Eliminate within a list of commands; return the command to run.
+
+            Temporaries are held in the list as ConstDeclarations until the
+            end, where each wraps the rest of the block in a let.
+        """
+        excluded = set()
+        while True:
+            occurrences = self.occurrences(block)
+            counts = {}
+            for index, node, identity in occurrences:
+                counts[identity] = counts.get(identity, 0) + 1
+
+            best = None
+            for index, node, identity in occurrences:
+                if counts[identity] < 2 or identity in excluded:
+                    continue
+                if best is None or len(identity[0]) > len(best[2][0]):
+                    best = (index, node, identity)
+            if best is None:
+                break
+
+            index, node, identity = best
+            if can_raise(node) and has_call(block[index]):
+                excluded.add(identity)
+                continue
+
+            temp = self.temps.new()
+            nodes = set(id(n) for i, n, ident in occurrences if ident == identity)
+            replace = lambda e: replace_nodes(e, nodes, temp)
+            for command in block:
+                slots_map(command, replace)
+            block.insert(index, ast.ConstDeclaration(temp, node))
+
+        return self.rebuild(block)
+
+    def rebuild(self, block):
+        for index, command in enumerate(block):
+            if type(command) is ast.ConstDeclaration:
+                let = ast.LetCommand(command, self.rebuild(block[index + 1:]))
+                return make_sequence(block[:index] + [let])
+        return make_sequence(block)
+
+    def occurrences(self, block):
+        """ Every pure operator expression in a block, in evaluation order,
+            as (command index, node, identity). Nodes computing the same
+            value share an identity.
+        """
+        versions = {}
+        found = []
+
+        def visit(node):
+            type_ = type(node)
+            if (type_ is ast.BinaryExpression or type_ is ast.UnaryExpression) \
+                    and is_pure(node):
+                names = sorted(expression_names(node, set()))
+                found.append((index, node, (str(node), tuple(
+                    versions.get(n, 0) for n in names))))
+            return map_subexpressions(node, visit)
+
+        for index, command in enumerate(block):
+            slots_map(command, visit)
+            written = block_written(command)
+            if written is not None:
+                versions[written] = versions.get(written, 0) + 1
+        return found
+
+
+def slots_map(command, fn):
+    """ Replace each expression a block command evaluates by fn(expression) """
+    type_ = type(command)
+
+    if type_ is ast.CallCommand:
+        command.expr_list = [fn(e) for e in command.expr_list]
+    else:  # Assign, Return, If(its condition) and ConstDeclaration
+        command.expression = fn(command.expression)
+
+
+def block_written(command):
+    """ The name a block command writes, if any """
+    type_ = type(command)
+
+    if type_ is ast.AssignCommand:
+        return command.variable.identifier
+    elif type_ is ast.ConstDeclaration:
+        return command.identifier
+    return None
+
+
+def has_call(command):
+    """ Does a block command call anything? """
+    found = []
+    slots_map(command, lambda e: found.append(is_pure(e)) or e)
+    return False in found
+
+
+def replace_nodes(node, nodes, name):
+    """ Replace the expressions whose id() is in nodes by a read of name """
+    if id(node) in nodes:
+        return ast.VnameExpression(ast.Vname(name))
+    return map_subexpressions(node, lambda e: replace_nodes(e, nodes, name))
+
+
+class RangeLoops(visitor.Visitor):
+    """ Marks while loops the byteplay backend can run as a FOR_ITER over a
+        range(see counting.steps), by setting their counter.
+
+        A loop qualifies when its test is i < n or i > n(either way round)
+        and the last command its body runs steps i by a constant, towards
+        n. i must be assigned nowhere else in the body, nor declared in it,
+        and n must make no calls and read nothing the body writes; it is
+        then evaluated once, before the loop, rather than at every test.
+        Like loop invariant motion, this takes i to hold an Integer.
+
+        Starting a loop over a range costs about as much as ten iterations
+        save(bench.py), so only loops which are not in another loop of
+        their function are marked: the rest may start often and run short.
+        Other backends run marked loops as plain while loops.
+    """
+
+    name = 'range'
+    stage = 'ast'
+
+    def __init__(self, context):
+        visitor.Visitor.__init__(self)
+        # Is the node being visited in a loop of its function?
+        self.in_loop = False
+
+    def run(self, tree):
+        self.visit(tree.command)
+        return tree
+
+    def visit_WhileCommand(self, node):
+        if not self.in_loop:
+            self.mark(node)
+        in_loop, self.in_loop = self.in_loop, True
+        self.visit(node.command)
+        self.in_loop = in_loop
+
+    def visit_FunctionDeclaration(self, node):
+        # A function's loops start once per call, whatever calls it
+        in_loop, self.in_loop = self.in_loop, False
+        self.visit(node.command)
+        self.in_loop = in_loop
+
+    def visit_Expression(self, node):
+        pass
+
+    def mark(self, loop):
+        test = loop.expression
+        if type(test) is not ast.BinaryExpression or test.oper not in ['<', '>']:
+            return
+        body = loop.command
+        increment = last_command(body)
+        if type(increment) is not ast.AssignCommand:
+            return
+        var = increment.variable.identifier
+        step = induction_step(increment)
+        if step is None or var in declared_names(body, set()) or \
+                count_assignments(body, var) != 1:
+            return
+
+        written = written_names(body, set())
+        for var_side, bound, oper in [(test.expr1, test.expr2, test.oper),
+                                      (test.expr2, test.expr1,
+                                       '>' if test.oper == '<' else '<')]:
+            if type(var_side) is ast.VnameExpression and \
+                    var_side.variable.identifier == var and \
+                    (step > 0) == (oper == '<') and is_pure(bound) and \
+                    len(expression_names(bound, set()) & written) == 0:
+                loop.counter = (var, step, increment)
+                return
+
+
+def last_command(node):
+    """ The command a command always runs last, or None if that depends on
+        a test
+    """
+    while True:
+        type_ = type(node)
+        if type_ is ast.SequentialCommand:
+            node = node.command2
+        elif type_ is ast.LetCommand:
+            node = node.command
+        elif type_ is ast.IfCommand or type_ is ast.WhileCommand:
+            return None
+        else:
+            return node
+
+
+# Rewrites StrengthReduction applies by default, per target Python major
+# version. Only those bench.py shows to be a win are listed.
+PROFITABLE_REWRITES = {2: ['double', 'mul_shift', 'div_shift', 'mod_mask',
+                           'induction'],
+                       3: ['double', 'mod_mask', 'induction']}
+
+# Multiplies in a loop an induction temporary must replace, per target
+# Python major version. The temporary costs an add and a store per
+# iteration: on 2 that still beats a single multiply(bench.py's
+# strength.induction.1use, 1.1-1.2x), on 3 it can take two.
+MIN_INDUCTION_USES = {2: 1, 3: 2}
+
+
+class JumpThreading(object):
+    """ Sends jumps and branches straight to their final destination.
+
+        A block holding nothing but a jump is skipped by everything that
+        jumps to it; an if command at the end of a loop body then jumps
+        back to the loop test, instead of jumping to a jump.
+    """
+
+    name = 'threading'
+    stage = 'ir'
+
+    def __init__(self, context):
+        pass
+
+    def run(self, function):
+        for block in function.reachable():
+            terminator = block.terminator
+            if type(terminator) is ir.Jump:
+                terminator.target = self.destination(terminator.target)
+            elif type(terminator) is ir.Branch:
+                terminator.if_true = self.destination(terminator.if_true)
+                terminator.if_false = self.destination(terminator.if_false)
+            elif type(terminator) is ir.Iterate:
+                terminator.if_next = self.destination(terminator.if_next)
+                terminator.if_done = self.destination(terminator.if_done)
+        return function
+
+    def destination(self, block):
+        seen = set()
+        while len(block.instructions) == 0 and \
+                type(block.terminator) is ir.Jump and block not in seen:
+            seen.add(block)
+            block = block.terminator.target
+        return block
+
+
+class DeadStoreElimination(object):
+    """ Removes stores to variables never read again, and the instructions
+        computing nothing but what they stored.
+
+        Liveness runs backwards over the control-flow graph, on variables
+        and temporaries alike. An instruction that only computes a value
+        (see the pure_ methods) makes its arguments live only if its own
+        result is, so chains of dead values go in one go, loops included.
+        A var declaration's None is the commonest dead store: a variable
+        assigned before it is read never needs it.
+
+        Calls, getint and the rest keep running when their result is dead.
+        The assembler pops what they push.
+    """
+
+    name = 'dse'
+    stage = 'ir'
+
+    def __init__(self, context):
+        self.pure = visitor.bind(self, 'pure_', visitor.IR_CLASSES, 'impure')
+        # Values of the function's constants, by temporary
+        self.consts = {}
+
+    def run(self, function):
+        blocks = function.reachable()
+        self.consts = dict([(i.dest, i.value) for b in blocks
+                            for i in b.instructions if type(i) is ir.Const])
+        live_out = self.liveness(function, blocks)
+        for block in blocks:
+            live = set(live_out[block])
+            self.live_through(block.terminator, live)
+            kept = []
+            for instruction in reversed(block.instructions):
+                if self.live_through(instruction, live):
+                    kept.append(instruction)
+            kept.reverse()
+            block.instructions = kept
+        return function
+
+    def liveness(self, function, blocks):
+        """ Map each block to what is live on leaving it """
+        preds = function.predecessors()
+        live_in = dict([(b, set()) for b in blocks])
+        live_out = dict([(b, set()) for b in blocks])
+        # Blocks are mostly laid out in order, so going backwards settles
+        # most of them in the first round
+        work = list(blocks)
+        queued = set(blocks)
+        while work:
+            block = work.pop()
+            queued.discard(block)
+            live = set()
+            for succ in block.successors():
+                live |= live_in[succ]
+            live_out[block] = set(live)
+            self.live_through(block.terminator, live)
+            for instruction in reversed(block.instructions):
+                self.live_through(instruction, live)
+            if live != live_in[block]:
+                live_in[block] = live
+                for pred in preds[block]:
+                    if pred not in queued:
+                        queued.add(pred)
+                        work.append(pred)
+        return live_out
+
+    def live_through(self, instruction, live):
+        """ Update live, the set live after an instruction, to what is live
+            before it. Returns False if the instruction is dead.
+        """
+        written = written_value(instruction)
+        if written is not None:
+            if written not in live and self.pure[type(instruction)](instruction):
+                return False
+            live.discard(written)
+        live.update(instruction.args)
+        if type(instruction) is ir.Load:
+            live.add(instruction.var)
+        return True
+
+    def impure(self, instruction):
+        return False
+
+    def pure_Const(self, instruction):
+        return True
+
+    def pure_Load(self, instruction):
+        return True
+
+    def pure_Store(self, instruction):
+        return True
+
+    def pure_LoadGlobal(self, instruction):
+        return True
+
+    def pure_UnaryOp(self, instruction):
+        return True
+
+    def pure_BinaryOp(self, instruction):
+        # Shifts and masks are only made by strength reduction, from a
+        # division or modulo by a power of two
+        oper = instruction.oper
+        if oper in SAFE_OPERATORS or oper in ['<<', '>>', '&']:
+            return True
+        divisor = self.consts.get(instruction.args[1])
+        return oper in ['/', '\\'] and divisor is not None and divisor != 0
+
+
+def written_value(instruction):
+    """ The variable or temporary an instruction sets, or None """
+    type_ = type(instruction)
+    if type_ is ir.Store or type_ is ir.Iterate:
+        return instruction.var
+    return instruction.dest
+
+
+# Every pass, in the order they run
+PASSES = [LoopInvariantMotion, StrengthReduction, LoopUnrolling,
+          CommonSubexpressionElimination, RangeLoops, JumpThreading,
+          DeadStoreElimination]
+
+# Passes enabled at each optimization level. 1 is the cheap local rewrites,
+# 2 adds the passes that move code or introduce temporaries.
+LEVELS = {0: [],
+          1: ['strength', 'threading', 'dse'],
+          2: ['licm', 'strength', 'unroll', 'cse', 'range', 'threading', 'dse']}
+
+# Level used for a bare -O, or optimize=True
+DEFAULT_LEVEL = 2
+
+
+def add_level_arguments(arg_parser):
+    """ Add the -O, -O0, -O1 ... flags setting an argparse parser's
+        optimize option
+    """
+    # -O takes no value so '-O file.mt' keeps working; levels are flags
+    arg_parser.add_argument('-O', dest='optimize', action='store_const',
+                            const=DEFAULT_LEVEL, default=0,
+                            help='optimize (same as -O%d)' % (DEFAULT_LEVEL))
+    for level in sorted(LEVELS):
+        arg_parser.add_argument('-O%d' % (level), dest='optimize',
+                                action='store_const', const=level,
+                                help='passes: %s' % (', '.join(LEVELS[level]) or 'none'))
+
+
+def opt_level(optimize):
+    """ Optimization level for an optimize option: a level, or a bool """
+    if optimize is True:
+        return DEFAULT_LEVEL
+    elif optimize is False or optimize is None:
+        return 0
+    elif optimize not in LEVELS:
+        raise ValueError('Unknown optimization level: %s' % (optimize))
+    return optimize
+
+
+class PassManager(object):
+    """ Runs the passes of an optimization level, timing each one.
+
+        enable and disable name passes to add to, or drop from, the level.
+        unroll_factor sets how far loops are partially unrolled.
+        timings holds (pass name, seconds) for every pass run, in order.
+    """
+
+    def __init__(self, level=DEFAULT_LEVEL, backend='byteplay', enable=(),
+                 disable=(), unroll_factor=None):
+        names = [p.name for p in PASSES]
+        for name in list(enable) + list(disable):
+            if name not in names:
+                raise ValueError('Unknown pass: %s' % (name))
+
+        selected = (set(LEVELS[opt_level(level)]) | set(enable)) - set(disable)
+        self.passes = [p for p in PASSES if p.name in selected]
+        self.context = Context(target_version(backend), unroll_factor)
+        self.timings = []
+
+    def run_ast(self, tree):
+        """ Return the Program optimized by the AST passes """
+        passes = [p for p in self.passes if p.stage == 'ast']
+        if len(passes) == 0:
+            return tree
+
+        tree = visitor.copy(tree)
+        for pass_ in passes:
+            start = timeit.default_timer()
+            tree = pass_(self.context).run(tree)
+            self.timings.append((pass_.name, timeit.default_timer() - start))
+        return tree
+
+    def run_ir(self, function):
+        """ Run the code passes over an IR function and those declared in it """
+        for pass_ in self.passes:
+            if pass_.stage != 'ir':
+                continue
+            start = timeit.default_timer()
+            run = pass_(self.context).run
+            work = [function]
+            while work:
+                f = work.pop()
+                run(f)
+                work.extend(f.functions())
+            self.timings.append((pass_.name, timeit.default_timer() - start))
+        return function
+
+    def report(self):
+        """ Text table of the pass timings """
+        lines = ['%-10s %10s' % ('pass', 'time(ms)')]
+        for name, seconds in self.timings:
+            lines.append('%-10s %10.3f' % (name, seconds * 1000))
+        return '\n'.join(lines)
+
+
+def optimize(tree, backend='byteplay'):
+    """ Return a copy of a Program optimized by the default level's AST passes """
+    return PassManager(DEFAULT_LEVEL, backend).run_ast(tree)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# Parallel map runtime for Mini Triangle
+#
+# parmap(f, low, high) prints f(low), ..., f(high - 1) in order, as putint
+# would, computing them on a pool of worker processes. Workers are forked,
+# so they inherit f(a generated function, which could not be pickled) and
+# only integers go through the queues.
+#
+# parmap is self contained(it imports what it needs itself, and uses no
+# globals), so the backends can embed it in the programs they generate:
+# codegen embeds its code object and pygen its source. The .pyc files stay
+# runnable without this module.
+#
+# Author: Wilson Giese
+#
+
+
+def parmap(function, low, high):
+    """ Print function(i) for each low <= i < high, in order.
+
+        function should be pure: the workers run it with no stdin, and
+        anything it prints comes out of order. An exception it raises in
+        a worker is raised here, after the results before it are printed,
+        as is a RuntimeError if a worker dies without one.
+
+        A metered program's function runs in process: forked workers would
+        each take steps from a copy of the budget, rather than the one. So
+        does one called in a daemonic process(such as a judge.py worker),
+        which may not have children.
+    """
+    import pickle
+    import sys
+    import multiprocessing
+    try:
+        from Queue import Empty
+    except ImportError:  # Python 3
+        from queue import Empty
+
+    if hasattr(multiprocessing, 'get_context'):
+        # Python 3 may default to spawning workers, which would have to
+        # pickle function
+        multiprocessing = multiprocessing.get_context('fork')
+
+    write = sys.stdout.write
+    count = high - low
+    workers = min(multiprocessing.cpu_count(), count)
+    # The budget counters of a metered program(codegen.BUDGET_COUNTERS)
+    namespace = getattr(function, '__globals__', {})
+    if '_steps_' in namespace or '_depth_' in namespace:
+        workers = 1
+    if multiprocessing.current_process().daemon:
+        workers = 1
+    if workers < 2:
+        i = low
+        while i < high:
+            write('%s\n' % (function(i),))
+            i += 1
+        return None
+
+    # A few chunks per worker, so uneven ones still spread the load
+    chunk = max(1, count // (workers * 8))
+
+    def work(tasks, results):
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            start, stop = task
+            values = []
+            try:
+                i = start
+                while i < stop:
+                    values.append(function(i))
+                    i += 1
+            except Exception as error:
+                try:
+                    pickle.dumps(error)
+                except Exception:
+                    # Such as the BudgetExhausted a .pyc defines for itself
+                    error = RuntimeError(str(error))
+                results.put((start, values, error))
+                return
+            results.put((start, values, None))
+
+    # Workers would otherwise flush their copy of anything buffered
+    sys.stdout.flush()
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    pool = [multiprocessing.Process(target=work, args=(tasks, results))
+            for _ in range(workers)]
+    # Start the workers before the queues' feeder threads, so nothing
+    # forks a threaded process
+    for process in pool:
+        process.daemon = True
+        process.start()
+
+    try:
+        start = low
+        while start < high:
+            tasks.put((start, min(start + chunk, high)))
+            start += chunk
+        for process in pool:
+            tasks.put(None)
+
+        # Print each chunk once those before it are in
+        done = {}
+        start = low
+        while start < high:
+            while start not in done:
+                # Workers found stopped before the wait have sent all they
+                # will by the time it gives up
+                stopped = [p for p in pool if not p.is_alive()]
+                try:
+                    first, values, error = results.get(True, 0.1)
+                except Empty:
+                    # A worker killed, or exiting(SystemExit) mid chunk,
+                    # never sends that chunk
+                    lost = [p.exitcode for p in stopped if p.exitcode]
+                    if lost or len(stopped) == len(pool):
+                        raise RuntimeError('parmap worker died(exit code %s)'
+                                           % (lost[0] if lost else 0,))
+                    continue
+                done[first] = (values, error)
+            values, error = done.pop(start)
+            for value in values:
+                write('%s\n' % (value,))
+            if error is not None:
+                raise error
+            start += chunk
+    finally:
+        for process in pool:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+    return None
@@ -29,27 +29,55 @@ class ParserException(Exception):
 class Parser(object):
 
     def __init__(self, tokens):
+        # Lists of Tokens are packed into a stream, so lookahead is always
+        # indexed access into its arrays
+        if not isinstance(tokens, scanner.TokenStream):
+            tokens = scanner.TokenStream.from_tokens(tokens)
         self.tokens = tokens
+        self.types = tokens.types
         self.curindex = 0
-        self.curtoken = tokens[0]
+        self.curtype = self.types[0]
 
     def parse(self):
         """Parse the token stream"""
         return self.parse_program()
 
     def parse_program(self):
-        """Command """
+        """( import Identifier ';' )* Command """
 
-        program = ast.Program(self.parse_command())
+        imports = self.parse_imports()
+        program = ast.Program(self.parse_command(), imports)
         self.token_accept(scanner.TK_EOT)
         return program
 
+    def parse_module(self):
+        """( import Identifier ';' )* func-Declaration ( func-Declaration )* """
+
+        imports = self.parse_imports()
+        d1 = self.parse_function_declaration()
+        while self.curtype != scanner.TK_EOT:
+            d2 = self.parse_function_declaration()
+            d1 = ast.SequentialDeclaration(d1, d2)
+        return ast.Module(imports, d1)
+
+    def parse_imports(self):
+        """( import Identifier ';' )*
+        Returns the list of module names
+        """
+        imports = []
+        while self.curtype == scanner.TK_IMPORT:
+            self.token_accept_any()
+            imports.append(self.token_value())
+            self.token_accept(scanner.TK_IDENTIFIER)
+            self.token_accept(scanner.TK_SEMICOLON)
+        return imports
+
     def parse_command(self):
         """ single-Command ( single-Command )* """
 
         c1 = self.parse_single_command()
         # Look for single_commands until we do not encounter an END or EOT
-        while self.curtoken.type != scanner.TK_END and self.curtoken.type != scanner.TK_EOT:
+        while self.curtype != scanner.TK_END and self.curtype != scanner.TK_EOT:
             c2 = self.parse_single_command()
             c1 = ast.SequentialCommand(c1, c2)
 
@@ -64,18 +92,18 @@ class Parser(object):
         |  begin Command end
         """
         # Assignment or Function Call
-        if self.curtoken.type == scanner.TK_IDENTIFIER:
-            name = self.token_current().val
+        if self.curtype == scanner.TK_IDENTIFIER:
+            name = self.token_value()
             self.token_accept_any()
 
             # Variable Assignment
-            if self.curtoken.type == scanner.TK_BECOMES:
+            if self.curtype == scanner.TK_BECOMES:
                 self.token_accept_any()
                 expr = self.parse_expression()
                 self.token_accept(scanner.TK_SEMICOLON)
                 return ast.AssignCommand(ast.Vname(name), expr)
             # Function call
-            elif self.curtoken.type == scanner.TK_LPAREN:
+            elif self.curtype == scanner.TK_LPAREN:
                 self.token_accept_any()
                 param_list = self.parse_argument_list()
                 self.token_accept(scanner.TK_RPAREN)
@@ -83,16 +111,16 @@ class Parser(object):
                 return ast.CallCommand(name, param_list)
             # Unexpected tokens
             else:
-                raise ParserException(self.curtoken.pos, self.curtoken.type)
+                raise ParserException(self.token_pos(), self.curtype)
         # While Loop
-        elif self.curtoken.type == scanner.TK_WHILE:
+        elif self.curtype == scanner.TK_WHILE:
             self.token_accept_any()
             expr = self.parse_expression()
             self.token_accept(scanner.TK_DO)
             com = self.parse_single_command()
             return ast.WhileCommand(expr, com)
         # If Statement
-        elif self.curtoken.type == scanner.TK_IF:
+        elif self.curtype == scanner.TK_IF:
             self.token_accept_any()
             expr = self.parse_expression()
             self.token_accept(scanner.TK_THEN)
@@ -101,37 +129,35 @@ class Parser(object):
             com2 = self.parse_single_command()
             return ast.IfCommand(expr, com1, com2)
         # Let-In Statement
-        elif self.curtoken.type == scanner.TK_LET:
+        elif self.curtype == scanner.TK_LET:
             self.token_accept_any()
             dec = self.parse_declaration()
             self.token_accept(scanner.TK_IN)
             com = self.parse_single_command()
             return ast.LetCommand(dec, com)
         # Begin-End Statement
-        elif self.curtoken.type == scanner.TK_BEGIN:
+        elif self.curtype == scanner.TK_BEGIN:
             self.token_accept_any()
             com = self.parse_command()
             self.token_accept(scanner.TK_END)
             return com
-        elif self.curtoken.type == scanner.TK_RETURN:
+        elif self.curtype == scanner.TK_RETURN:
             self.token_accept_any()
             expr = self.parse_expression()
             self.token_accept(scanner.TK_SEMICOLON)
             return ast.ReturnCommand(expr)
         # Unexpected tokens
         else:
-            raise ParserException(self.curtoken.pos, self.curtoken.type)
+            raise ParserException(self.token_pos(), self.curtype)
 
     def parse_expression(self):
         """Ter-Expression ( Oper-Ter Ter-Expression )* """
 
         e1 = self.parse_tertiary_expression()
-        token = self.token_current()
-        while token.type == scanner.TK_OPERATOR and token.val in ['<', '>', '=']:
-            oper = token.val
+        while self.curtype == scanner.TK_OPERATOR and self.token_value() in ['<', '>', '=']:
+            oper = self.token_value()
             self.token_accept_any()
             e2 = self.parse_tertiary_expression()
-            token = self.token_current()
             e1 = ast.BinaryExpression(e1, oper, e2)
         return e1
 
@@ -139,12 +165,10 @@ class Parser(object):
         """ Sec-Expression ( Oper-Sec Sec-Expression )* """
 
         e1 = self.parse_secondary_expression()
-        token = self.token_current()
-        while token.type == scanner.TK_OPERATOR and token.val in ['+', '-']:
-            oper = token.val
+        while self.curtype == scanner.TK_OPERATOR and self.token_value() in ['+', '-']:
+            oper = self.token_value()
             self.token_accept_any()
             e2 = self.parse_secondary_expression()
-            token = self.token_current()
             e1 = ast.BinaryExpression(e1, oper, e2)
         return e1
 
@@ -152,12 +176,10 @@ class Parser(object):
         """ Pri-Expression ( Oper-Pri Pri-Expression )* """
 
         e1 = self.parse_primary_expression()
-        token = self.token_current()
-        while token.type == scanner.TK_OPERATOR and token.val in ['*', '/', '']:
-            oper = token.val
+        while self.curtype == scanner.TK_OPERATOR and self.token_value() in ['*', '/', '\\']:
+            oper = self.token_value()
             self.token_accept_any()
             e2 = self.parse_primary_expression()
-            token = self.token_current()
             e1 = ast.BinaryExpression(e1, oper, e2)
         return e1
 
@@ -169,18 +191,17 @@ class Parser(object):
         |  function-call
         """
 
-        token = self.token_current()
         # Integer-Literal
-        if token.type == scanner.TK_INTLITERAL:
-            e1 = ast.IntegerExpression(token.val)
+        if self.curtype == scanner.TK_INTLITERAL:
+            e1 = ast.IntegerExpression(self.token_value())
             self.token_accept_any()
         # Variable name or function call
-        elif token.type == scanner.TK_IDENTIFIER:
-            name = self.token_current().val
+        elif self.curtype == scanner.TK_IDENTIFIER:
+            name = self.token_value()
             self.token_accept_any()
 
             # Function call
-            if self.curtoken.type == scanner.TK_LPAREN:
+            if self.curtype == scanner.TK_LPAREN:
                 self.token_accept_any()
                 param_list = self.parse_argument_list()
                 self.token_accept(scanner.TK_RPAREN)
@@ -189,18 +210,18 @@ class Parser(object):
             else:
                 e1 = ast.VnameExpression(ast.Vname(name))
         # Unary Expression
-        elif token.type == scanner.TK_OPERATOR:
-            oper = self.token_current()
+        elif self.curtype == scanner.TK_OPERATOR:
+            oper = self.token_value()
             self.token_accept_any()
-            e1 = ast.UnaryExpression(oper.val, self.parse_primary_expression())
+            e1 = ast.UnaryExpression(oper, self.parse_primary_expression())
         # ( Expression )
-        elif token.type == scanner.TK_LPAREN:
+        elif self.curtype == scanner.TK_LPAREN:
             self.token_accept_any()
             e1 = self.parse_expression()
             self.token_accept(scanner.TK_RPAREN)
         # Unexpected tokens
         else:
-            raise ParserException(self.curtoken.pos, self.curtoken.type)
+            raise ParserException(self.token_pos(), self.curtype)
         return e1
 
     def parse_declaration(self):
@@ -208,7 +229,7 @@ class Parser(object):
 
         d1 = self.parse_single_declaration()
         # Look for single_declarations until we do not encounter IN
-        while self.curtoken.type != scanner.TK_IN:
+        while self.curtype != scanner.TK_IN:
             d2 = self.parse_single_declaration()
             d1 = ast.SequentialDeclaration(d1, d2)
         return d1
@@ -220,40 +241,40 @@ class Parser(object):
         """
 
         # Constant Declaration
-        if self.curtoken.type == scanner.TK_CONST:
+        if self.curtype == scanner.TK_CONST:
             self.token_accept_any()
-            name = self.token_current().val
+            name = self.token_value()
             self.token_accept(scanner.TK_IDENTIFIER)
             self.token_accept(scanner.TK_IS)
             expr = self.parse_expression()
             self.token_accept(scanner.TK_SEMICOLON)
             return ast.ConstDeclaration(name, expr)
         # Variable Declaration
-        elif self.curtoken.type == scanner.TK_VAR:
+        elif self.curtype == scanner.TK_VAR:
             self.token_accept_any()
-            name = self.token_current().val
+            name = self.token_value()
             self.token_accept(scanner.TK_IDENTIFIER)
             self.token_accept(scanner.TK_COLON)
-            type_d = ast.TypeDenoter(self.token_current().val)
+            type_d = ast.TypeDenoter(self.token_value())
             self.token_accept(scanner.TK_IDENTIFIER)
             self.token_accept(scanner.TK_SEMICOLON)
             return ast.VarDeclaration(name, type_d)
         # Function Declaration
-        elif self.curtoken.type == scanner.TK_FUNCDEF:
+        elif self.curtype == scanner.TK_FUNCDEF:
             return self.parse_function_declaration()
         # Unexpected tokens
         else:
-            raise ParserException(self.curtoken.pos, self.curtoken.type)
+            raise ParserException(self.token_pos(), self.curtype)
 
     def parse_function_declaration(self):
         self.token_accept(scanner.TK_FUNCDEF)
-        name = self.token_current().val
+        name = self.token_value()
         self.token_accept(scanner.TK_IDENTIFIER)
         self.token_accept(scanner.TK_LPAREN)
         param_list = self.parse_parameter_list()
         self.token_accept(scanner.TK_RPAREN)
         self.token_accept(scanner.TK_COLON)
-        return_type = self.token_current().val
+        return_type = self.token_value()
         self.token_accept(scanner.TK_IDENTIFIER)
         com = self.parse_single_command()
         return ast.FunctionDeclaration(name, param_list, return_type, com)
@@ -264,19 +285,19 @@ class Parser(object):
         """
 
         param_list = []
-        var_name = self.token_current().val
+        var_name = self.token_value()
         self.token_accept(scanner.TK_IDENTIFIER)
         self.token_accept(scanner.TK_COLON)
-        var_type = self.token_current().val
+        var_type = self.token_value()
         self.token_accept(scanner.TK_IDENTIFIER)
         param_list.append((ast.Vname(var_name), ast.TypeDenoter(var_type)))
 
-        while self.curtoken.type == scanner.TK_COMMA:
+        while self.curtype == scanner.TK_COMMA:
             self.token_accept_any()
-            var_name = self.token_current().val
+            var_name = self.token_value()
             self.token_accept(scanner.TK_IDENTIFIER)
             self.token_accept(scanner.TK_COLON)
-            var_type = self.token_current().val
+            var_type = self.token_value()
             self.token_accept(scanner.TK_IDENTIFIER)
             param_list.append((ast.Vname(var_name), ast.TypeDenoter(var_type)))
         return param_list
@@ -284,38 +305,45 @@ class Parser(object):
     def parse_argument_list(self):
         """ Expression ( ',' Expression )* """
         arg_list = []
-        if self.curtoken.type != scanner.TK_RPAREN:
+        if self.curtype != scanner.TK_RPAREN:
             arg_list.append(self.parse_expression())
         else:
             return arg_list
 
-        while self.curtoken.type == scanner.TK_COMMA:
+        while self.curtype == scanner.TK_COMMA:
             self.token_accept_any()
             arg_list.append(self.parse_expression())
         return arg_list
 
     def token_current(self):
         """Return curent token"""
-        return self.curtoken
+        return self.tokens[self.curindex]
+
+    def token_value(self):
+        """Return the current token's value"""
+        return self.tokens.value(self.curindex)
+
+    def token_pos(self):
+        """Return the current token's position"""
+        return self.tokens.positions[self.curindex]
 
     def token_accept_any(self):
         """Remove Token except EOT"""
 
-        if self.curtoken.type != scanner.TK_EOT:
+        if self.curtype != scanner.TK_EOT:
             self.curindex += 1
-            self.curtoken = self.tokens[self.curindex]
+            self.curtype = self.types[self.curindex]
 
     def token_look_ahead(self):
-        if self.curtoken.tye != scanner.TK_EOT:
-            forward_token = self.tokens[self.curindex + 1]
-        else:
-            forward_token = self.curtoken
-        return forward_token
+        """Return the type of the token after the current one"""
+        if self.curtype != scanner.TK_EOT:
+            return self.types[self.curindex + 1]
+        return self.curtype
 
     def token_accept(self, type):
         """Check and then remove token"""
-        if self.curtoken.type != type:
-            raise ParserException(self.curtoken.pos, self.curtoken.type,
+        if self.curtype != type:
+            raise ParserException(self.token_pos(), self.curtype,
                                   exp_type=type)
         self.token_accept_any()
 
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+#
+# Python AST code generator for Mini Triangle
+#
+# Lowers the Mini Triangle AST onto the host interpreter's own syntax
+# tree and hands it to compile(), so the program runs on whatever CPython
+# is compiling it(and picks up that interpreter's optimizer for free).
+# Unlike codegen.py this does not need byteplay, and runs on Python 2
+# and 3 alike.
+#
+# Author: Wilson Giese
+#
+
+import _ast as py  # The stdlib 'ast' module is shadowed by our own ast.py
+import marshal
+import os
+import struct
+import sys
+import time
+
+import ast
+import compact
+import parallel
+import parser
+import scanner
+from errors import *
+from scope import Scoped
+
+if sys.version_info[0] >= 3:
+    import importlib.util
+    MAGIC = importlib.util.MAGIC_NUMBER
+else:
+    import imp
+    MAGIC = imp.get_magic()
+
+# Names used by the generated module. Mini Triangle identifiers are made of
+# letters and digits only, so a leading underscore can never clash with them.
+MAIN_NAME = '_main'
+PUTINT_NAME = '_putint'
+GETINT_NAME = '_getint'
+INT_NAME = '_int'
+PARMAP_NAME = '_parmap'
+
+BINARY_OPERATORS = {'+': py.Add,
+                    '-': py.Sub,
+                    '*': py.Mult,
+                    '/': py.FloorDiv,  # BINARY_DIVIDE floors on Python 2 ints
+                    '\\': py.Mod,
+                    # Operators only introduced by the optimizer
+                    '<<': py.LShift,
+                    '>>': py.RShift,
+                    '&': py.BitAnd}
+
+COMPARE_OPERATORS = {'<': py.Lt,
+                     '>': py.Gt,
+                     '=': py.Eq}
+
+UNARY_OPERATORS = {'+': py.UAdd,
+                   '-': py.USub}
+
+# Node fields that must be present as lists even when empty
+LIST_FIELDS = ('args', 'body', 'decorator_list', 'defaults', 'keywords',
+               'kw_defaults', 'kwonlyargs', 'orelse', 'posonlyargs',
+               'type_ignores', 'type_params')
+
+
+def py_node(cls, **fields):
+    """ Build a Python AST node, filling in whatever fields and attributes
+        this interpreter's version of the node expects.
+    """
+    for field in cls._fields:
+        if field not in fields:
+            fields[field] = [] if field in LIST_FIELDS else None
+    if 'lineno' in cls._attributes:
+        fields['lineno'] = 1
+        fields['col_offset'] = 0
+    return cls(**fields)
+
+
+def name_load(name):
+    return py_node(py.Name, id=name, ctx=py.Load())
+
+
+def name_store(name):
+    return py_node(py.Name, id=name, ctx=py.Store())
+
+
+def integer(value):
+    if hasattr(py, 'Constant'):
+        return py_node(py.Constant, value=value)
+    return py_node(py.Num, n=value)
+
+
+def none():
+    if hasattr(py, 'Constant'):
+        return py_node(py.Constant, value=None)
+    return name_load('None')
+
+
+def call(name, args):
+    return py_node(py.Call, func=name_load(name), args=args)
+
+
+def assign(name, value):
+    return py_node(py.Assign, targets=[name_store(name)], value=value)
+
+
+def arguments(arg_names):
+    if hasattr(py, 'arg'):  # Python 3
+        args = [py_node(py.arg, arg=a) for a in arg_names]
+    else:
+        args = [py_node(py.Name, id=a, ctx=py.Param()) for a in arg_names]
+    return py_node(py.arguments, args=args)
+
+
+class PyGen(Scoped):
+    """ Python AST Generator for Mini-Triangle """
+
+    def __init__(self, tree):
+        Scoped.__init__(self)
+        self.tree = tree
+        self.body = []
+        # Statement lists being built, innermost last
+        self.body_stacks = []
+        self.body_stacks.append(self.body)
+        # Functions declared in each Python function, these have to be
+        # declared global so calls can find them(as STORE_NAME does in codegen)
+        self.function_names = []
+        self.function_names.append([])
+        # Set once parmap is called, to bring in parallel.parmap
+        self.uses_parmap = False
+
+    def __str__(self):
+        return 'Body: %s' % (str(self.body))
+
+    def generate(self):
+        """ Compile the program and return it as a callable """
+        code = self.to_code([])
+        namespace = {}
+        exec(code, namespace)
+        return namespace[MAIN_NAME]
+
+    def generate_module(self):
+        """ Compile the program into a module code object which runs it """
+        return self.to_code([py_node(py.Expr, value=call(MAIN_NAME, []))])
+
+    def to_code(self, trailer):
+        if type(self.tree) is not ast.Program:
+            raise CodeGeneratorError(self.tree)
+        if self.tree.imports:
+            raise LinkError('Modules need the byteplay backend')
+
+        if len(self.body) == 0:
+            self.gen_command(self.tree.command)
+            self.body.append(py_node(py.Return, value=integer(0)))
+            self.add_globals(self.body, self.function_names[0])
+
+        prologue = [assign(PUTINT_NAME, name_load('print')),
+                    assign(GETINT_NAME, name_load('input')),
+                    assign(INT_NAME, name_load('int'))]
+        if self.uses_parmap:
+            prologue.append(self.helper(parallel.parmap, PARMAP_NAME))
+        main = py_node(py.FunctionDef, name=MAIN_NAME, args=arguments([]),
+                    body=self.body)
+        module = py_node(py.Module, body=prologue + [main] + trailer)
+        return compile(module, '<minitriangle>', 'exec')
+
+    def gen_command(self, node):
+        """ Generate statements for all command types. """
+        type_ = type(node)
+
+        if type_ is ast.SequentialCommand:
+            self.gen_command(node.command1)
+            self.gen_command(node.command2)
+        elif type_ is ast.AssignCommand:
+            vname = self.lookup_var(node.variable.identifier)
+            if vname is None:
+                raise InvalidExpressionError(node)
+            self.body.append(assign(vname, self.gen_expression(node.expression)))
+        elif type_ is ast.CallCommand:
+            self.body.append(py_node(py.Expr, value=self.gen_call(node)))
+        elif type_ is ast.IfCommand:
+            test = self.gen_expression(node.expression)
+            body = self.gen_block(node.command1)
+            orelse = self.gen_block(node.command2)
+            self.body.append(py_node(py.If, test=test, body=body, orelse=orelse))
+        elif type_ is ast.WhileCommand:
+            test = self.gen_expression(node.expression)
+            body = self.gen_block(node.command)
+            self.body.append(py_node(py.While, test=test, body=body))
+        elif type_ is ast.LetCommand:
+            self.raise_scope()
+            self.gen_declaration(node.declaration)
+            self.gen_command(node.command)
+            self.lower_scope()
+        elif type_ is ast.ReturnCommand:
+            self.body.append(py_node(py.Return,
+                                  value=self.gen_expression(node.expression)))
+        else:  # Unexpected node. Raise a Code Generation Exception.
+            raise CodeGeneratorError(node)
+
+    def gen_expression(self, node):
+        """ Generate a Python expression for an expression """
+        type_ = type(node)
+
+        if type_ is ast.BinaryExpression:
+            left = self.gen_expression(node.expr1)
+            right = self.gen_expression(node.expr2)
+
+            if node.oper in BINARY_OPERATORS:
+                return py_node(py.BinOp, left=left,
+                            op=BINARY_OPERATORS[node.oper](), right=right)
+            elif node.oper in COMPARE_OPERATORS:
+                return py_node(py.Compare, left=left,
+                            ops=[COMPARE_OPERATORS[node.oper]()],
+                            comparators=[right])
+            else:
+                raise InvalidExpressionError(node)
+        elif type_ is ast.IntegerExpression:
+            return integer(node.value)
+        elif type_ is ast.VnameExpression:
+            vname = self.lookup_var(node.variable.identifier)
+            if vname is None:
+                raise InvalidExpressionError(node)
+            return name_load(vname)
+        elif type_ is ast.UnaryExpression:
+            # Only supporting positive or negative unary
+            if node.operator not in UNARY_OPERATORS:
+                raise InvalidExpressionError(node)
+            return py_node(py.UnaryOp, op=UNARY_OPERATORS[node.operator](),
+                        operand=self.gen_expression(node.expression))
+        elif type_ is ast.CallCommand:
+            return self.gen_call(node)
+        else:
+            raise InvalidExpressionError(node)
+
+    def gen_declaration(self, node):
+        """ Generate statements for a declaration """
+        type_ = type(node)
+
+        if type_ is ast.ConstDeclaration:
+            value = self.gen_expression(node.expression)
+            # Load const into env
+            cur_env = self.get_current_env()
+            cur_env[node.identifier] = ('Integer', False)
+            vname = self.add_var(node.identifier)
+            self.body.append(assign(vname, value))
+        elif type_ is ast.VarDeclaration:
+            # Declare variable in environment
+            self.env_load(node.identifier, node.type_denoter, True)
+            vname = self.add_var(node.identifier)
+            self.body.append(assign(vname, none()))
+        elif type_ is ast.SequentialDeclaration:
+            self.gen_declaration(node.decl1)
+            self.gen_declaration(node.decl2)
+        elif type_ is ast.FunctionDeclaration:
+            self.gen_function(node)
+        else:
+            raise InvalidDeclarationError(node)
+
+    def gen_function(self, node):
+        # Add func name early incase of recursive calls
+        self.declared_functions[node.name] = (node.arg_list,
+                                               node.return_type_denoter)
+        self.function_names[-1].append(node.name)
+
+        self.raise_body_stack()
+        self.raise_scope()
+        self.function_names.append([])
+        arg_names = []
+        for arg in node.arg_list:
+            vname = arg[0].identifier
+            self.env_load(vname, arg[1], True)
+            arg_names.append(self.add_var(vname))
+
+        # Generate function body
+        self.gen_command(node.command)
+        self.add_globals(self.body, self.function_names.pop())
+        self.lower_scope()
+        body = self.lower_body_stack()
+
+        self.body.append(py_node(py.FunctionDef, name=node.name,
+                              args=arguments(arg_names), body=body))
+
+    def gen_call(self, node):
+        """ Generate a call to a builtin or program defined function """
+        if node.identifier == 'getint':
+            if len(node.expr_list) != 0:
+                raise IllegalFunctionArgumentError('getint', 0)
+            return call(INT_NAME, [call(GETINT_NAME, [])])
+        elif node.identifier == 'putint':
+            if len(node.expr_list) != 1:
+                raise IllegalFunctionArgumentError('putint', 1)
+            return call(PUTINT_NAME, [self.gen_expression(node.expr_list[0])])
+        elif node.identifier == 'parmap':
+            name = self.mapped_function(node)
+            self.uses_parmap = True
+            return call(PARMAP_NAME, [name_load(name)] +
+                        [self.gen_expression(e) for e in node.expr_list[1:]])
+        elif self.declared_functions.get(node.identifier) is not None:
+            argc = len(self.declared_functions.get(node.identifier)[0])
+            if argc != len(node.expr_list):
+                raise IllegalFunctionArgumentError(node.identifier, argc)
+            return call(node.identifier,
+                        [self.gen_expression(e) for e in node.expr_list])
+        else:
+            raise InvalidExpressionError(node)
+
+    def helper(self, function, name):
+        """ Definition of a runtime helper(see parallel.py) as name, from
+            its source, so generated modules do not need to import it
+        """
+        # Not inspect.getsource(), which needs the stdlib ast module
+        path = sys.modules[function.__module__].__file__
+        with open(os.path.splitext(path)[0] + '.py') as source:
+            module = compile(source.read(), path, 'exec', py.PyCF_ONLY_AST)
+        for definition in module.body:
+            if (type(definition) is py.FunctionDef and
+                    definition.name == function.__name__):
+                definition.name = name
+                return definition
+
+    def gen_block(self, node):
+        """ Generate a command into a fresh statement list and return it """
+        self.raise_body_stack()
+        self.gen_command(node)
+        return self.lower_body_stack()
+
+    def add_globals(self, body, names):
+        if len(names) > 0:
+            body.insert(0, py_node(py.Global, names=sorted(set(names))))
+
+    # SCOPING FUNCTIONS
+    def raise_body_stack(self):
+        """ Add a new statement list to the body stack, and use as current body """
+        self.body_stacks.append([])
+        self.body = self.body_stacks[-1]
+
+    def lower_body_stack(self):
+        """ Bring the body down one statement list and return the finished list """
+        body = self.body_stacks.pop()
+        self.body = self.body_stacks[-1]
+        if len(body) == 0:
+            body.append(py_node(py.Pass))
+        return body
+
+
+def pyc_data(code):
+    """ Return the contents of a .pyc file for the running interpreter,
+        compacted(see compact.py)
+    """
+    header = MAGIC
+    if sys.version_info >= (3, 7):
+        header += struct.pack('<L', 0)  # Timestamp based pyc
+    header += struct.pack('<L', int(time.time()) & 0xFFFFFFFF)
+    if sys.version_info >= (3, 3):
+        header += struct.pack('<L', 0)  # Source size, no source
+    return header + marshal.dumps(compact.compact(code))
+
+
+def gen_pyc(code, name):
+    """ Write a module code object as a .pyc for the running interpreter """
+    pyc_file = name + '.pyc'
+
+    with open(pyc_file, 'wb') as pyc_f:
+        pyc_f.write(pyc_data(code))
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) == 2:
+        name, exten = os.path.splitext(sys.argv[1])
+        if exten != '.mt':
+            print('Error: Unrecoginized file type: Cannot compile \'%s\'' % (exten))
+            sys.exit(0)
+
+        try:
+            with open(sys.argv[1], 'r') as source:
+                text = source.read()
+        except IOError:
+            print('Could not find source file: %s' % (sys.argv[1]))
+            sys.exit(0)
+
+        try:
+            tree = parser.Parser(scanner.Scanner(text).scan_stream()).parse()
+        except (scanner.ScannerError, parser.ParserException) as e:
+            print('Could not compile source:')
+            print(e)
+            sys.exit(0)
+
+        gen_pyc(PyGen(tree).generate_module(), name)
+    else:
+        print('Usage: python %s /path/to/source' % (sys.argv[0]))
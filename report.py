@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+# Compile report for Mini Triangle
+#
+# One entry per code object in a compiled program: the main program, each
+# declared function(named by its FunctionDeclaration, and qualified by the
+# functions enclosing it) and any runtime helper embedded in the program.
+# Each entry gives the code's size in bytes and instructions, its jumps,
+# co_stacksize, locals, constants table size and call sites. The report
+# comes as text, or as JSON for diffing builds.
+#
+# It reads real code objects, so it works for every bytecode backend, and
+# on Python 2 or 3.
+#
+# Author: Wilson Giese
+#
+
+import dis
+import json
+import types
+
+# Entry fields, in report order, with their text column headings
+FIELDS = [('bytes', 'bytes'),
+          ('instructions', 'instrs'),
+          ('jumps', 'jumps'),
+          ('stacksize', 'stack'),
+          ('locals', 'locals'),
+          ('constants', 'consts'),
+          ('calls', 'calls')]
+
+JUMP_OPCODES = set(dis.hasjrel + dis.hasjabs)
+
+
+def instructions(code):
+    """ The (opcode, argument) of each instruction in a code object, with
+        EXTENDED_ARG folded into the instruction it extends
+    """
+    if hasattr(dis, 'get_instructions'):
+        return [(i.opcode, i.arg) for i in dis.get_instructions(code)
+                if i.opname != 'EXTENDED_ARG']
+
+    # Python 2: one byte opcodes, with two byte arguments from HAVE_ARGUMENT
+    result = []
+    co_code = code.co_code
+    extended = 0
+    i = 0
+    while i < len(co_code):
+        op = ord(co_code[i])
+        arg = None
+        if op >= dis.HAVE_ARGUMENT:
+            arg = ord(co_code[i + 1]) + ord(co_code[i + 2]) * 256 + extended
+            extended = 0
+            i += 3
+        else:
+            i += 1
+        if op == dis.EXTENDED_ARG:
+            extended = arg * 65536
+        else:
+            result.append((op, arg))
+    return result
+
+
+def is_call(opcode):
+    """ A call site(intrinsics are operations, not calls) """
+    name = dis.opname[opcode]
+    return name.startswith('CALL') and not name.startswith('CALL_INTRINSIC')
+
+
+def code_entry(code, path):
+    ops = [op for op, arg in instructions(code)]
+    return {'name': code.co_name,
+            'path': path,
+            'bytes': len(code.co_code),
+            'instructions': len(ops),
+            'jumps': len([op for op in ops if op in JUMP_OPCODES]),
+            'stacksize': code.co_stacksize,
+            'locals': code.co_nlocals,
+            'constants': len(code.co_consts),
+            'calls': len([op for op in ops if is_call(op)])}
+
+
+def code_report(code, path=None):
+    """ Entries for a code object(or function) and every code object nested
+        in it, enclosing ones first. path names each by the co_names
+        leading to it, joined by dots.
+    """
+    code = getattr(code, '__code__', code)
+    path = code.co_name if path is None else '%s.%s' % (path, code.co_name)
+    entries = [code_entry(code, path)]
+    for const in code.co_consts:
+        if type(const) is types.CodeType:
+            entries.extend(code_report(const, path))
+    return entries
+
+
+def totals(entries):
+    """ Each numeric field summed over entries, except the stack size, which
+        is the largest
+    """
+    total = {}
+    for field, heading in FIELDS:
+        values = [e[field] for e in entries]
+        total[field] = max(values) if field == 'stacksize' else sum(values)
+    return total
+
+
+def format_text(entries):
+    """ A table of entries, one line each, followed by the totals """
+    width = max([len(e['path']) for e in entries] + [len('code object')])
+    row = lambda name, values: '%-*s %s' % (width, name,
+                                            ' '.join(['%7s' % v for v in values]))
+    lines = [row('code object', [heading for field, heading in FIELDS])]
+    for entry in entries:
+        lines.append(row(entry['path'], [entry[f] for f, h in FIELDS]))
+    total = totals(entries)
+    lines.append(row('total', [total[f] for f, h in FIELDS]))
+    return '\n'.join(lines)
+
+
+def format_json(entries):
+    """ entries and their totals as JSON, laid out to diff well """
+    return json.dumps({'code_objects': entries, 'total': totals(entries)},
+                      indent=2, separators=(',', ': '), sort_keys=True)
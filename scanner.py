@@ -5,8 +5,8 @@
 # Author: Wilson Giese
 #
 
-import cStringIO as StringIO
-import string
+import re
+from array import array
 
 # Token Constants
 TK_IDENTIFIER = 0   # Function names, class names, variable names, etc...
@@ -33,6 +33,7 @@ TK_EOT        = 20  # end of text
 TK_FUNCDEF    = 21  # func
 TK_RETURN     = 22  # return
 TK_COMMA      = 23  # ,
+TK_IMPORT     = 24  # import
 
 TOKENS = {TK_IDENTIFIER: 'IDENTIFIER',
           TK_INTLITERAL: 'INTLITERAL',
@@ -57,7 +58,8 @@ TOKENS = {TK_IDENTIFIER: 'IDENTIFIER',
           TK_EOT:        'EOT',
           TK_FUNCDEF:    'FUNCDEF',
           TK_RETURN:     'RETURN',
-          TK_COMMA:      'COMMA'}
+          TK_COMMA:      'COMMA',
+          TK_IMPORT:     'IMPORT'}
 
 KEYWORDS = {'begin':  TK_BEGIN,
             'const':  TK_CONST,
@@ -71,7 +73,8 @@ KEYWORDS = {'begin':  TK_BEGIN,
             'var':    TK_VAR,
             'while':  TK_WHILE,
             'func':   TK_FUNCDEF,
-            'return': TK_RETURN}
+            'return': TK_RETURN,
+            'import': TK_IMPORT}
 
 OPERATORS = ['+', '*', '-', '/', '<', '>', '=', '!=', '\\']
 
@@ -106,23 +109,114 @@ class ScannerError(Exception):
         return 'ScannerError at pos = %d, char = %s' % (self.pos, self.char)
 
 
+# One token, after any separators. Groups are named after the kind of token.
+#
+# A comment only matches up to the end of its line, so when a token fails to
+# match, backtracking cannot end it early: that would try every way of
+# splitting a comment of n '!'s(2**n of them), and match tokens inside it.
+TOKEN_PATTERN = re.compile(r"""
+    (?:\s|![^\n]*(?=\n|\Z))*        # Separators: spaces and comments
+    (?:(?P<int>[0-9]+)
+     | (?P<word>[A-Za-z][A-Za-z0-9]*)
+     | (?P<becomes>:=)
+     | (?P<punct>[;:~(),])
+     | (?P<oper>[-+*/<>=\\])
+     | (?P<eot>\Z))
+""", re.VERBOSE)
+
+SEPARATORS = re.compile(r'(?:\s|![^\n]*(?=\n|\Z))*')
+
+# The same patterns for bytes input(an mmap, or a file opened in binary mode)
+BYTES_TOKEN_PATTERN = re.compile(TOKEN_PATTERN.pattern.encode('ascii'), re.VERBOSE)
+BYTES_SEPARATORS = re.compile(SEPARATORS.pattern.encode('ascii'))
+
+# Array typecode for token positions, which may pass 4GB in a mapped file:
+# 64 bits('Q' before Python 3.3 does not exist, but 'L' is 64 bits on
+# 64-bit Unix)
+try:
+    POSITION_TYPECODE = array('Q').typecode
+except ValueError:
+    POSITION_TYPECODE = 'L'
+
+# Bytes read at a time from a file-like input
+CHUNK_SIZE = 1 << 20
+
+PUNCTUATION = {';': TK_SEMICOLON,
+               ':': TK_COLON,
+               '~': TK_IS,
+               '(': TK_LPAREN,
+               ')': TK_RPAREN,
+               ',': TK_COMMA}
+
+
+class TokenStream(object):
+    """ Tokens stored as parallel typed arrays.
+
+        types: token type codes.
+        positions: start offset of each token in the input text.
+        values: index of each token's value in table. Values are interned,
+        and table[0] is the 0 carried by tokens without a value.
+
+        Indexing returns a Token, built on demand.
+    """
+
+    def __init__(self):
+        self.types = array('B')
+        self.positions = array(POSITION_TYPECODE)
+        self.values = array('I')
+        self.table = [0]
+        self.table_index = {0: 0}
+
+    def intern(self, value):
+        """ Return the table index of value, adding it if new """
+        index = self.table_index.get(value)
+        if index is None:
+            index = len(self.table)
+            self.table.append(value)
+            self.table_index[value] = index
+        return index
+
+    def append(self, type, val, pos):
+        self.types.append(type)
+        self.positions.append(pos)
+        self.values.append(self.intern(val))
+
+    def value(self, i):
+        return self.table[self.values[i]]
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, i):
+        return Token(self.types[i], self.table[self.values[i]], self.positions[i])
+
+    def __iter__(self):
+        for i in range(len(self.types)):
+            yield self[i]
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        stream = cls()
+        for token in tokens:
+            stream.append(token.type, token.val, token.pos)
+        return stream
+
+
 class Scanner(object):
     """Scanner for the following token grammar
 
     Token     ::=  Letter (Letter | Digit)* | Digit Digit* |
                    '+' | '-' | '*' | '/' | '<' | '>' | '=' | '\'
-                   ':' ('=' | <empty>) | ';' | '~' | '(' | ')' | <eot>
+                   ':' ('=' | <empty>) | ';' | '~' | '(' | ')' | ',' | <eot>
 
     Separator ::=  '!' Graphic* <eol> | <space> | <eol>
     """
 
     def __init__(self, input):
-        # Use StringIO to treat input string like a file.
-        self.inputstr = StringIO.StringIO(input)
-        self.eot = False   # Are we at the end of the input text?
-        self.pos = 0       # Position in the input text
-        self.char = ''     # The current character from the input text
-        self.char_take()   # Fill self.char with the first character
+        # A string, a bytes-like buffer such as an mmap, or a file-like
+        # object to be read CHUNK_SIZE at a time. Buffers are scanned in
+        # place, without copying them into a string first.
+        self.input = input
 
     def scan(self):
         """Main entry point to scanner object.
@@ -130,155 +224,100 @@ class Scanner(object):
         Return a list of Tokens.
         """
 
-        self.tokens = []
-        while 1:
-            token = self.scan_token()
-            self.tokens.append(token)
-
-            if token.type == TK_EOT:
-                break
+        self.tokens = list(self.scan_stream())
         return self.tokens
 
-    def scan_token(self):
-        """Scan a single token from input text.
+    def scan_stream(self):
+        """Scan the input text into a TokenStream.
 
-        Return a Token.
+        Only the stream's arrays grow per token; identifiers and integers
+        are interned, so repeats share one value.
         """
 
-        c = self.char_current()
-        token = None
-
-        while not self.char_eot():
-            # Remove spaces
-            if c.isspace():
-                self.char_take()
-                c = self.char_current()
-                continue
-
-            # Remove Comments
-            if c == '!':
-                while self.char_current() != '\n' and not self.char_eot():
-                    self.char_take()
-                c = self.char_current()
-                continue
-
-            if c.isdigit():   # Integer
-                token = self.scan_int()
-                break
-            elif c.isalpha():  # Keyword/Identifier
-                pos = self.char_pos()
-                word = self.scan_keyword()
-
-                # Get type from dictionary
-                token_type = KEYWORDS.get(word)
+        stream = TokenStream()
+        if not hasattr(self.input, 'read'):
+            self.scan_buffer(self.input, 0, True, stream)
+            return stream
+
+        # Keep the unfinished end of each chunk(a token or comment which
+        # may continue in the next one) and scan it again with the next
+        offset = 0
+        tail = None
+        while True:
+            chunk = self.input.read(CHUNK_SIZE)
+            final = len(chunk) == 0
+            buffer = chunk if tail is None else tail + chunk
+            done = self.scan_buffer(buffer, offset, final, stream)
+            if final:
+                return stream
+            tail = buffer[done:]
+            offset += done
+
+    def scan_buffer(self, text, offset, final, stream):
+        """Scan tokens from text into stream, offsetting their positions.
+
+        Unless final, stop before a token which reaches the end of text,
+        as it may continue past it. Return how much of text was scanned.
+        """
 
+        if isinstance(text, str):
+            match = TOKEN_PATTERN.match
+            separators = SEPARATORS
+            decode = None
+        else:
+            match = BYTES_TOKEN_PATTERN.match
+            separators = BYTES_SEPARATORS
+            # Python 3 matches bytes to bytes; values must be strings
+            decode = None if str is bytes else lambda b: b.decode('ascii')
+
+        intern = stream.intern
+        add_type = stream.types.append
+        add_pos = stream.positions.append
+        add_value = stream.values.append
+        end = len(text)
+        pos = 0
+
+        while True:
+            m = match(text, pos)
+            if m is None:
+                pos = separators.match(text, pos).end()
+                char = text[pos:pos + 1]
+                raise ScannerError(offset + pos, decode(char) if decode else char)
+
+            kind = m.lastgroup
+            if not final and (m.end() == end or kind == 'eot'):
+                return pos
+            start = m.start(kind)
+            pos = m.end()
+
+            if kind == 'word':
+                word = m.group(kind)
+                if decode is not None:
+                    word = decode(word)
+                token_type = KEYWORDS.get(word)
                 if token_type is None:  # Not a keyword
-                    token = Token(TK_IDENTIFIER, word, pos)
+                    add_type(TK_IDENTIFIER)
+                    add_value(intern(word))
                 else:  # Is a keyword
-                    token = Token(token_type, 0, pos)
-                break
-            elif c in OPERATORS:
-                pos = self.char_pos()
-                val = self.char_take()
-                token = Token(TK_OPERATOR, val, pos)
-                break
-            elif c == ';':
-                pos = self.char_pos()
-                val = self.char_take()
-                token = Token(TK_SEMICOLON, 0, pos)
-                break
-            elif c == ':':
-                pos = self.char_pos()
-                val = self.char_take()
-
-                # Check for becomes(:=) token
-                if(self.char_current() == '='):
-                    val += self.char_take()
-                    token = Token(TK_BECOMES, 0, pos)
-                else:
-                    token = Token(TK_COLON, 0, pos)
-                break
-            elif c == '~':
-                pos = self.char_pos()
-                val = self.char_take()
-                token = Token(TK_IS, 0, pos)
-                break
-            elif c == '(':
-                pos = self.char_pos()
-                val = self.char_take()
-                token = Token(TK_LPAREN, 0, pos)
-                break
-            elif c == ')':
-                pos = self.char_pos()
-                val = self.char_take()
-                token = Token(TK_RPAREN, 0, pos)
-                break
-            elif c == ',':
-                pos = self.char_pos()
-                val = self.char_take()
-                token = Token(TK_COMMA, 0, pos)
-                break
+                    add_type(token_type)
+                    add_value(0)
+            elif kind == 'int':
+                add_type(TK_INTLITERAL)
+                add_value(intern(int(m.group(kind))))
+            elif kind == 'oper':
+                oper = m.group(kind)
+                add_type(TK_OPERATOR)
+                add_value(intern(decode(oper) if decode else oper))
+            elif kind == 'punct':
+                punct = m.group(kind)
+                add_type(PUNCTUATION[decode(punct) if decode else punct])
+                add_value(0)
+            elif kind == 'becomes':
+                add_type(TK_BECOMES)
+                add_value(0)
             else:
-                raise ScannerError(self.char_pos(), self.char_current())
-
-        # Finished building token
-        if token is not None:
-            return token
-
-        if self.char_eot():
-            return(Token(TK_EOT, 0, self.char_pos()))
-
-    def scan_int(self):
-        """Int :== Digit (Digit*)"""
-
-        pos = self.char_pos()
-        numlist = [self.char_take()]
-
-        while self.char_current().isdigit():
-            numlist.append(self.char_take())
-
-        return Token(TK_INTLITERAL, int(string.join(numlist, '')), pos)
-
-    def scan_keyword(self):
-        """Scans and builds keyword. Terminates on any non-alpha or non-digit character
-
-        Note: Keywords CANNOT start with digits. Those should all be considered ints
-        """
-        word = self.char_take()
-
-        while self.char_current().isalpha() or self.char_current().isdigit():
-            word += self.char_take()
-
-        return word
-
-    def char_current(self):
-        """Return in the current input character."""
-
-        return self.char
-
-    def char_take(self):
-        """Consume the current character and read the next character
-        from the input text.
-
-        Update self.char, self.eot, and self.pos
-        """
-
-        char_prev = self.char
-
-        self.char = self.inputstr.read(1)
-        if self.char == '':
-            self.eot = True
-
-        self.pos += 1
-
-        return char_prev
-
-    def char_pos(self):
-        """Return the position of the *current* character in the input text."""
-
-        return self.pos - 1
-
-    def char_eot(self):
-        """Determine if we are at the end of the input text."""
-
-        return self.eot
+                add_type(TK_EOT)
+                add_value(0)
+                add_pos(offset + start)
+                return pos
+            add_pos(offset + start)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# Environment and scoping shared by the Mini Triangle backends
+#
+# Author: Wilson Giese
+#
+
+import ast
+from errors import *
+
+
+# Environment format:
+#   key = name
+#   val = (type, writable(True/False))
+#
+class Scoped(object):
+    """ Environment and variable scoping for a code generator """
+
+    def __init__(self):
+        self.scope_depth = 0
+        # We also need a list of environments for each scope(For typechecking and such)
+        self.envs = []
+        self.envs.append({})
+        # Format [func name: param list, return type)]
+        self.declared_functions = {}
+        self.scope_vars = {}
+
+    # ENVIRONMENT INTERACTION FUNCTIONS
+    def get_current_env(self):
+        return self.envs[len(self.envs)-1]
+
+    def env_load(self, name, type_denoter, writable):
+        self.get_current_env()[name] = (type_denoter, writable)
+
+    # Scoping functions
+    def add_var(self, var_name):
+        var_list = self.scope_vars.get(var_name)
+
+        if var_list is None:
+            var_list = []
+            self.scope_vars[var_name] = var_list
+
+        if self.scope_depth == 0:
+            var_list.append(var_name)
+            return var_name
+        else:
+            var_list.append(var_name + str(self.scope_depth))
+            return var_name + str(self.scope_depth)
+
+    def lookup_var(self, var_name):
+        var_list = self.scope_vars.get(var_name)
+        if var_list is None:
+            return None
+        else:
+            return var_list[len(var_list)-1]
+
+    def raise_scope(self):
+        self.envs.append({})
+        self.scope_depth += 1
+
+    def lower_scope(self):
+        for x in self.get_current_env():
+            self.scope_vars[x].pop()
+
+        self.envs.pop()
+        self.scope_depth -= 1
+
+    # BUILTIN FUNCTIONS
+    def mapped_function(self, node):
+        """ Check a parmap(f, low, high) call, returning the name of f. It
+            must be a declared function taking one argument.
+        """
+        if len(node.expr_list) != 3:
+            raise IllegalFunctionArgumentError('parmap', 3)
+        function = node.expr_list[0]
+        if type(function) is not ast.VnameExpression:
+            raise InvalidExpressionError(node)
+        declared = self.declared_functions.get(function.variable.identifier)
+        if declared is None:
+            raise UnknownFunctionError(function.variable.identifier)
+        if len(declared[0]) != 1:
+            raise IllegalFunctionArgumentError(function.variable.identifier, 1)
+        return function.variable.identifier
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#
+# Persistent compile server for Mini Triangle
+#
+# Keeps a warm compiler(byteplay, scanner, parser and codegen already
+# imported) resident and serves compile requests over a local Unix domain
+# socket, one thread per connection. client.py is the matching drop-in
+# replacement for 'python codegen.py'.
+#
+# Protocol, kept trivial so the client needs nothing beyond socket:
+#   request:  <options> '\n' <path> '\n' <length> '\n' <source>
+#   response: ('ok' | 'error') ' ' <length> '\n' <.pyc contents | message>
+#
+# options is '<backend> [<level> [<enable> [<disable> [<max steps>
+# [<max depth> [<unroll factor> [<deep> [<known inputs>]]]]]]]]', the
+# lists comma separated, '-' for none(and for no budget or the default
+# unroll factor), deep 0 or 1. path is the directories imported modules are
+# searched for in, separated by os.pathsep; the client sends them absolute,
+# as the server's working directory is not the client's.
+#
+# The socket is only accessible to the user running the server.
+#
+# Author: Wilson Giese
+#
+
+import errno
+import os
+import socket
+import stat
+import sys
+import traceback
+
+try:
+    import SocketServer as socketserver
+except ImportError:  # Python 3
+    import socketserver
+
+import codegen
+
+# Fields of a request's options line left out at the end
+DEFAULT_OPTIONS = ['byteplay', '0', '-', '-', '-', '-', '-', '0', '-']
+
+
+def default_socket_path():
+    return os.environ.get('MT_SOCKET',
+                          '/tmp/minitriangle-%d.sock' % (os.getuid()))
+
+
+def parse_options(line):
+    """ Return (backend, level, enable, disable, max steps, max depth,
+        unroll factor, deep, known inputs) from a request's first line
+    """
+    fields = line.split()
+    fields += DEFAULT_OPTIONS[len(fields):]
+    backend, level, enable, disable, steps, depth, unroll, deep, known = fields[:9]
+    names = lambda s: [] if s == '-' else s.split(',')
+    limit = lambda s: None if s == '-' else int(s)
+    return (backend, int(level), names(enable), names(disable), limit(steps),
+            limit(depth), limit(unroll), deep == '1',
+            [int(n) for n in names(known)])
+
+
+def parse_path(line):
+    """ The module search path a request's second line gives """
+    return [d for d in line.rstrip('\n').split(os.pathsep) if d] or ['.']
+
+
+class CompileHandler(socketserver.StreamRequestHandler):
+    """ Serves compile requests until the client closes the connection """
+
+    def handle(self):
+        while True:
+            options = self.rfile.readline()
+            if not options:
+                break
+            path = parse_path(self.rfile.readline())
+            length = int(self.rfile.readline())
+            text = self.rfile.read(length)
+
+            status, payload = self.respond(text, path, *parse_options(options))
+            self.wfile.write(b'%s %d\n' % (status, len(payload)) + payload)
+            self.wfile.flush()
+
+    def respond(self, text, path, backend, level, enable, disable, max_steps,
+                max_depth, unroll_factor, deep, known_inputs):
+        try:
+            passes = codegen.pass_manager(backend, level, enable, disable,
+                                          unroll_factor)
+            data, error = codegen.compile_text(text, backend, passes=passes,
+                                               max_steps=max_steps,
+                                               max_depth=max_depth, path=path,
+                                               deep=deep,
+                                               known_inputs=known_inputs)
+        except ValueError as e:  # Unknown pass name or level, or metering,
+                                 # modules or deep recursion with another
+                                 # backend
+            return b'error', str(e)
+        except Exception:
+            # Keep the server up; the client shows what went wrong
+            return b'error', traceback.format_exc()
+
+        if error is not None:
+            return b'error', error
+        return b'ok', data
+
+
+class CompileServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def remove_stale_socket(path):
+    """ Remove a socket left behind by a server that is no longer running.
+        Raise EnvironmentError if path is anything else: not a socket,
+        another user's, or one a server is listening on.
+    """
+    try:
+        info = os.lstat(path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise EnvironmentError(errno.EEXIST, 'Not a socket of this user, '
+                               'refusing to replace it', path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as e:
+        if e.errno != errno.ECONNREFUSED:
+            raise
+        os.unlink(path)
+        return
+    finally:
+        sock.close()
+    raise EnvironmentError(errno.EADDRINUSE, 'A server is already listening',
+                           path)
+
+
+def serve(path):
+    remove_stale_socket(path)
+    # Created readable and writable by this user only
+    umask = os.umask(0o177)
+    try:
+        server = CompileServer(path, CompileHandler)
+    finally:
+        os.umask(umask)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description='Mini Triangle compile server')
+    arg_parser.add_argument('-s', '--socket', default=default_socket_path(),
+                            help='Unix socket to listen on (default: $MT_SOCKET or %(default)s)')
+    args = arg_parser.parse_args()
+
+    try:
+        serve(args.socket)
+    except EnvironmentError as e:
+        sys.stderr.write('Could not listen on %s: %s\n' % (args.socket,
+                                                           e.strerror or e))
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
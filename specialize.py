@@ -0,0 +1,586 @@
+#!/usr/bin/env python
+#
+# Partial evaluation of Mini Triangle programs for known inputs
+#
+# Given the values a program's first getint() calls return, specialize()
+# runs the program as far as those values decide it, and returns the
+# residual program: what is left to do at run time, reading only the inputs
+# after them. Variables with known values are replaced by them, conditions
+# that become known pick their branch, loops whose test stays known are
+# unrolled, and calls of functions that only compute are evaluated once
+# their arguments are known(see Evaluator).
+#
+# Known inputs are only handed out while it is certain which getint() call
+# comes next. Where control depends on an unknown value, both branches of
+# an if must read as many known inputs, and loops left in the residual
+# program must read none; otherwise SpecializationError.
+#
+# Reads of a variable with a known value become that value, so storing it
+# is put off until code left in the residual program could read the
+# variable without knowing its value: a loop assigning it, or the code after
+# an if whose branches leave it different values. Stores nothing reads are
+# never made.
+#
+# Author: Wilson Giese
+#
+
+import operator
+
+import ast
+import optimize
+import visitor
+from errors import SpecializationError
+
+# Loop iterations unrolled(weighted by the commands they leave) and commands
+# evaluated, in all, before loops are left as loops and calls as calls
+MAX_STEPS = 20000
+# Deepest nesting of calls the Evaluator runs
+MAX_CALL_DEPTH = 100
+
+# Folding of each operator on known values; the same as the backends
+OPERATORS = {'+': operator.add,
+             '-': operator.sub,
+             '*': operator.mul,
+             '/': operator.floordiv,  # BINARY_DIVIDE floors on Python 2 ints
+             '\\': operator.mod,
+             '<': operator.lt,
+             '>': operator.gt,
+             '=': operator.eq}
+
+UNARY_OPERATORS = {'+': operator.pos,
+                   '-': operator.neg}
+
+BUILTINS = ['getint', 'putint', 'parmap']
+
+# Variable a residual block with nothing left to do assigns(see skip())
+SKIP_NAME = '_skip_'
+
+
+def specialize(tree, inputs):
+    """ The residual Program of tree, a Program whose first getint() calls
+        return inputs(a list of integers)
+    """
+    if type(tree) is not ast.Program:
+        raise SpecializationError('only programs read input')
+    specializer = Specializer(inputs)
+    command = make_sequence(specializer.command(tree.command))
+    if specializer.next < len(inputs):
+        raise SpecializationError('the program reads %d of the %d known inputs' %
+                                  (specializer.next, len(inputs)))
+    return ast.Program(command, tree.imports)
+
+
+def fold(oper, table, *values):
+    """ oper applied to known values, or None if it raises(the residual
+        program then raises at run time) or is not in table
+    """
+    if oper not in table:
+        return None
+    try:
+        return table[oper](*values)
+    except (ArithmeticError, TypeError):
+        return None
+
+
+def literal(value):
+    """ An expression with a known value """
+    if type(value) is bool:
+        # Comparisons give bools, and putint prints them as such
+        return ast.BinaryExpression(ast.IntegerExpression(0),
+                                    '<' if value else '>',
+                                    ast.IntegerExpression(1))
+    if value < 0:
+        return ast.UnaryExpression('-', ast.IntegerExpression(-value))
+    return ast.IntegerExpression(value)
+
+
+def residual(expression, value):
+    """ The residual expression of a (residual expression, value) pair """
+    if value is not None:
+        return literal(value)
+    return expression
+
+
+def skip():
+    """ A command doing nothing, for a block with nothing left to do """
+    return ast.LetCommand(ast.VarDeclaration(SKIP_NAME, ast.TypeDenoter('Integer')),
+                          ast.AssignCommand(ast.Vname(SKIP_NAME),
+                                            ast.IntegerExpression(0)))
+
+
+def make_sequence(commands):
+    if not commands:
+        return skip()
+    return optimize.make_sequence(commands)
+
+
+def make_declaration(declarations):
+    """ Nest a list of declarations, as the parser does """
+    node = declarations[0]
+    for declaration in declarations[1:]:
+        node = ast.SequentialDeclaration(node, declaration)
+    return node
+
+
+class Calls(visitor.Visitor):
+    """ Collects the functions the nodes visited call(or map with parmap),
+        by name, and those they declare, by name. Function bodies are
+        walked too.
+    """
+
+    def __init__(self):
+        visitor.Visitor.__init__(self)
+        self.called = set()
+        self.declared = {}
+
+    def visit_CallCommand(self, node):
+        self.called.add(node.identifier)
+        if node.identifier == 'parmap' and node.expr_list and \
+                type(node.expr_list[0]) is ast.VnameExpression:
+            self.called.add(node.expr_list[0].variable.identifier)
+        self.generic_visit(node)
+
+    def visit_FunctionDeclaration(self, node):
+        self.declared[node.name] = node
+        self.generic_visit(node)
+
+
+def calls(node):
+    finder = Calls()
+    finder.visit(node)
+    return finder
+
+
+class Unknown(Exception):
+    """ Raised by the Evaluator for a call it cannot run """
+    pass
+
+
+class Returned(Exception):
+    """ Carries a function's return value out of its body """
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Evaluator(visitor.Visitor):
+    """ Runs a call at compile time, for its value. Raises Unknown for what
+        only the residual program can do: output, values or functions it
+        does not know, input past the known inputs, errors, or running
+        past its steps.
+
+        functions maps each function name to its declaration(None if not
+        known). next is the index in inputs of the next getint() value.
+    """
+
+    def __init__(self, functions, inputs, next, steps):
+        visitor.Visitor.__init__(self)
+        self.functions = functions
+        self.inputs = inputs
+        self.next = next
+        self.steps = steps
+        self.scopes = []
+        self.depth = 0
+
+    def call(self, name, args):
+        declaration = self.functions.get(name)
+        if declaration is None or len(declaration.arg_list) != len(args) or \
+                self.depth >= MAX_CALL_DEPTH:
+            raise Unknown()
+        self.step()
+        self.depth += 1
+        outer, self.scopes = self.scopes, [dict([(arg[0].identifier, value)
+                                                 for arg, value in zip(declaration.arg_list, args)])]
+        try:
+            self.visit(declaration.command)
+        except Returned as returned:
+            value = returned.value
+        else:
+            raise Unknown()  # Fell off the end, returning None
+        finally:
+            self.scopes = outer
+            self.depth -= 1
+        return value
+
+    def step(self):
+        self.steps -= 1
+        if self.steps < 0:
+            raise Unknown()
+
+    def scope_of(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope
+        raise Unknown()
+
+    def generic_visit(self, node):
+        raise Unknown()
+
+    def visit_AssignCommand(self, node):
+        value = self.visit(node.expression)
+        self.scope_of(node.variable.identifier)[node.variable.identifier] = value
+
+    def visit_CallCommand(self, node):
+        if node.identifier == 'getint' and not node.expr_list:
+            if self.next >= len(self.inputs):
+                raise Unknown()
+            self.next += 1
+            return self.inputs[self.next - 1]
+        if node.identifier in BUILTINS:
+            raise Unknown()
+        return self.call(node.identifier, [self.visit(e) for e in node.expr_list])
+
+    def visit_IfCommand(self, node):
+        if self.visit(node.expression):
+            self.visit(node.command1)
+        else:
+            self.visit(node.command2)
+
+    def visit_WhileCommand(self, node):
+        while self.visit(node.expression):
+            self.step()
+            self.visit(node.command)
+
+    def visit_LetCommand(self, node):
+        self.scopes.append({})
+        self.visit(node.declaration)
+        self.visit(node.command)
+        self.scopes.pop()
+
+    def visit_ReturnCommand(self, node):
+        raise Returned(self.visit(node.expression))
+
+    def visit_IntegerExpression(self, node):
+        return node.value
+
+    def visit_VnameExpression(self, node):
+        value = self.scope_of(node.variable.identifier)[node.variable.identifier]
+        if value is None:  # Read before it was assigned
+            raise Unknown()
+        return value
+
+    def visit_UnaryExpression(self, node):
+        value = fold(node.operator, UNARY_OPERATORS, self.visit(node.expression))
+        if value is None:
+            raise Unknown()
+        return value
+
+    def visit_BinaryExpression(self, node):
+        value = fold(node.oper, OPERATORS, self.visit(node.expr1),
+                     self.visit(node.expr2))
+        if value is None:
+            raise Unknown()
+        return value
+
+    def visit_ConstDeclaration(self, node):
+        self.scopes[-1][node.identifier] = self.visit(node.expression)
+
+    def visit_VarDeclaration(self, node):
+        self.scopes[-1][node.identifier] = None
+
+    def visit_SequentialDeclaration(self, node):
+        self.visit(node.decl1)
+        self.visit(node.decl2)
+
+
+class Specializer(object):
+    """ Specializes a program to known inputs(see specialize()).
+
+        Each command_ method returns the list of commands left of a command,
+        each expression_ method a (residual expression, value) pair, one of
+        them None(see residual()), and each declaration_ method a list of
+        declarations. Declarations are all kept, so the residual program
+        has the same scopes.
+    """
+
+    def __init__(self, inputs):
+        self.inputs = list(inputs)
+        # Index in inputs of the next getint() value
+        self.next = 0
+        # Value of each variable in scope, None unless known; innermost last
+        self.scopes = [{}]
+        # Names in each scope whose known value is not stored yet
+        self.pending = [set()]
+        # Each function's declaration, by name, or None where it depends on
+        # control flow that is not known
+        self.functions = {}
+        self.steps = MAX_STEPS
+        self.commands = visitor.bind(self, 'command_', default='keep_command')
+        self.expressions = visitor.bind(self, 'expression_',
+                                        default='keep_expression')
+        self.declarations = visitor.bind(self, 'declaration_')
+
+    def command(self, node):
+        return self.commands[type(node)](node)
+
+    def expression(self, node):
+        return self.expressions[type(node)](node)
+
+    def declaration(self, node):
+        return self.declarations[type(node)](node)
+
+    # State, saved and restored around control flow that is not known
+    def save(self):
+        return ([dict(s) for s in self.scopes], [set(p) for p in self.pending],
+                dict(self.functions), self.next)
+
+    def restore(self, state):
+        scopes, pending, functions, self.next = state
+        self.scopes = [dict(s) for s in scopes]
+        self.pending = [set(p) for p in pending]
+        self.functions = dict(functions)
+
+    def store(self, scopes):
+        """ Store the known values scopes(a saved state's) do not know,
+            returning the assignments doing it
+        """
+        commands = []
+        for scope, pending, other in zip(self.scopes, self.pending, scopes):
+            for name in sorted(pending):
+                if not same(scope[name], other.get(name)):
+                    commands.append(ast.AssignCommand(ast.Vname(name),
+                                                      literal(scope[name])))
+                    pending.discard(name)
+        return commands
+
+    def merge(self, state):
+        """ Keep only what is the same in state and now, when either could
+            be the case after a branch. Returns the stores to add at the end
+            of state's branch, and of the current one.
+        """
+        scopes, pending, functions, next = state
+        if next != self.next:
+            raise SpecializationError('the branches of an if whose condition '
+                                      'is not known read different numbers '
+                                      'of the known inputs')
+        merged = [dict([(name, value if same(value, other.get(name)) else None)
+                        for name, value in scope.items()])
+                  for scope, other in zip(self.scopes, scopes)]
+        for name in set(self.functions) | set(functions):
+            if self.functions.get(name) is not functions.get(name):
+                self.functions[name] = None
+
+        stores2 = self.store(merged)
+        pending2 = self.pending
+        self.scopes, self.pending = [dict(s) for s in scopes], [set(p) for p in pending]
+        stores1 = self.store(merged)
+        self.pending = [p1 | p2 for p1, p2 in zip(self.pending, pending2)]
+        self.scopes = merged
+        return stores1, stores2
+
+    def index_of(self, name):
+        """ Index in scopes of the innermost scope declaring name """
+        for i in range(len(self.scopes) - 1, -1, -1):
+            if name in self.scopes[i]:
+                return i
+        return None
+
+    def forget(self, names):
+        """ Make the variables and functions called names unknown,
+            returning the assignments storing their known values
+        """
+        commands = []
+        for name in sorted(names):
+            i = self.index_of(name)
+            if i is not None:
+                if name in self.pending[i]:
+                    commands.append(ast.AssignCommand(ast.Vname(name),
+                                                      literal(self.scopes[i][name])))
+                    self.pending[i].discard(name)
+                self.scopes[i][name] = None
+            if name in self.functions:
+                self.functions[name] = None
+        return commands
+
+    def reads_input(self, node):
+        """ Could running node call getint()? """
+        found = calls(node)
+        work = list(found.called)
+        seen = set(work)
+        while work:
+            name = work.pop()
+            if name == 'getint':
+                return True
+            if name in BUILTINS:
+                continue
+            declaration = found.declared.get(name, self.functions.get(name))
+            if declaration is None:  # Linked, or not known here
+                return True
+            for callee in calls(declaration.command).called - seen:
+                seen.add(callee)
+                work.append(callee)
+        return False
+
+    # Commands
+    def keep_command(self, node):
+        return [visitor.copy(node)]
+
+    def command_SequentialCommand(self, node):
+        commands = []
+        for sequence, name in visitor.sequence_slots(node):
+            commands.extend(self.command(getattr(sequence, name)))
+        return commands
+
+    def command_AssignCommand(self, node):
+        name = node.variable.identifier
+        expression, value = self.expression(node.expression)
+        i = self.index_of(name)
+        if i is not None:
+            self.scopes[i][name] = value
+            if value is not None:  # Stored when something needs it
+                self.pending[i].add(name)
+                return []
+            self.pending[i].discard(name)
+        return [ast.AssignCommand(ast.Vname(name), residual(expression, value))]
+
+    def command_CallCommand(self, node):
+        expression, value = self.call(node)
+        if value is not None:  # Run now, leaving nothing to do
+            return []
+        return [expression]
+
+    def command_IfCommand(self, node):
+        expression, value = self.expression(node.expression)
+        if value is not None:
+            return self.command(node.command1 if value else node.command2)
+
+        before = self.save()
+        commands1 = self.command(node.command1)
+        after = self.save()
+        self.restore(before)
+        commands2 = self.command(node.command2)
+        stores1, stores2 = self.merge(after)
+        return [ast.IfCommand(expression, make_sequence(commands1 + stores1),
+                              make_sequence(commands2 + stores2))]
+
+    def command_WhileCommand(self, node):
+        commands = []
+        while self.steps > 0:
+            before = self.save()
+            expression, value = self.expression(node.expression)
+            if value is None:
+                self.restore(before)
+                break
+            if not value:
+                return commands
+            body = self.command(node.command)
+            self.steps -= 1 + len(body)
+            commands.extend(body)
+        return commands + self.residual_loop(node)
+
+    def residual_loop(self, node):
+        """ A loop left in the residual program, from what is known before
+            any of its iterations, after the stores it needs
+        """
+        if self.next < len(self.inputs) and self.reads_input(node):
+            raise SpecializationError('a loop which cannot be unrolled reads '
+                                      'input before all the known inputs are '
+                                      'read')
+        stores = self.forget(optimize.written_names(node, set()))
+        self.forget(calls(node).declared)
+        expression = residual(*self.expression(node.expression))
+        before = self.save()
+        commands = self.command(node.command)
+        commands += self.store(before[0])
+        self.restore(before)
+        return stores + [ast.WhileCommand(expression, make_sequence(commands))]
+
+    def command_LetCommand(self, node):
+        self.scopes.append({})
+        self.pending.append(set())
+        declarations = self.declaration(node.declaration)
+        commands = self.command(node.command)
+        self.scopes.pop()
+        self.pending.pop()
+        return [ast.LetCommand(make_declaration(declarations),
+                               make_sequence(commands))]
+
+    def command_ReturnCommand(self, node):
+        return [ast.ReturnCommand(residual(*self.expression(node.expression)))]
+
+    # Expressions
+    def keep_expression(self, node):
+        return visitor.copy(node), None
+
+    def expression_IntegerExpression(self, node):
+        return None, node.value
+
+    def expression_VnameExpression(self, node):
+        i = self.index_of(node.variable.identifier)
+        value = self.scopes[i][node.variable.identifier] if i is not None else None
+        if value is not None:
+            return None, value
+        return ast.VnameExpression(ast.Vname(node.variable.identifier)), None
+
+    def expression_UnaryExpression(self, node):
+        expression, value = self.expression(node.expression)
+        if value is not None:
+            folded = fold(node.operator, UNARY_OPERATORS, value)
+            if folded is not None:
+                return None, folded
+        return ast.UnaryExpression(node.operator, residual(expression, value)), None
+
+    def expression_BinaryExpression(self, node):
+        expr1, value1 = self.expression(node.expr1)
+        expr2, value2 = self.expression(node.expr2)
+        if value1 is not None and value2 is not None:
+            value = fold(node.oper, OPERATORS, value1, value2)
+            if value is not None:
+                return None, value
+        return ast.BinaryExpression(residual(expr1, value1), node.oper,
+                                    residual(expr2, value2)), None
+
+    def expression_CallCommand(self, node):
+        return self.call(node)
+
+    def call(self, node):
+        """ (residual, value) of a call: its value, if it can be run now """
+        name = node.identifier
+        if name == 'getint' and not node.expr_list and self.next < len(self.inputs):
+            self.next += 1
+            return None, self.inputs[self.next - 1]
+
+        args = [self.expression(e) for e in node.expr_list]
+        values = [value for expression, value in args]
+        if name not in BUILTINS and self.functions.get(name) is not None and \
+                None not in values:
+            evaluator = Evaluator(self.functions, self.inputs, self.next,
+                                  self.steps)
+            try:
+                value = evaluator.call(name, values)
+            except Unknown:
+                value = None
+            self.steps = evaluator.steps
+            if value is not None:
+                self.next = evaluator.next
+                return None, value
+
+        call = ast.CallCommand(name, [residual(*arg) for arg in args])
+        if self.next < len(self.inputs) and self.reads_input(call):
+            raise SpecializationError('%s reads input before all the known '
+                                      'inputs are read' % (name))
+        return call, None
+
+    # Declarations
+    def declaration_ConstDeclaration(self, node):
+        expression, value = self.expression(node.expression)
+        self.scopes[-1][node.identifier] = value
+        self.pending[-1].discard(node.identifier)
+        return [ast.ConstDeclaration(node.identifier, residual(expression, value))]
+
+    def declaration_VarDeclaration(self, node):
+        self.scopes[-1][node.identifier] = None
+        self.pending[-1].discard(node.identifier)
+        return [ast.VarDeclaration(node.identifier, node.type_denoter)]
+
+    def declaration_SequentialDeclaration(self, node):
+        return self.declaration(node.decl1) + self.declaration(node.decl2)
+
+    def declaration_FunctionDeclaration(self, node):
+        self.functions[node.name] = node
+        return [visitor.copy(node)]
+
+
+def same(value1, value2):
+    """ Are two known values the same(True is not 1 here)? """
+    return value1 is not None and type(value1) is type(value2) and value1 == value2
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+#
+# Trampoline runtime for deep recursion in Mini Triangle
+#
+# With deep recursion on(see codegen.CodeGen), a recursive function is
+# compiled to a generator: each call runs as a generator frame on a list
+# the trampoline keeps, rather than a Python frame on the C stack, so
+# recursion is bounded by memory instead of the recursion limit.
+#
+# A frame yields a tuple (callee, arguments...) to call another recursive
+# function, and is sent back its result. It returns by yielding its value,
+# which is never a tuple(values are integers, or None).
+#
+# frames is self contained(it uses no globals), so the backends can embed
+# it in the programs they generate. The .pyc files stay runnable without
+# this module.
+#
+# Author: Wilson Giese
+#
+
+
+def frames(function):
+    """ Return a plain function which calls the generator function
+        function, running it and everything it calls on the trampoline
+    """
+    def call(*args):
+        frame = function(*args)
+        send = frame.send
+        # Callers of the running frame, as their send methods
+        stack = []
+        push, pop = stack.append, stack.pop
+        value = None
+        while True:
+            request = send(value)
+            if type(request) is tuple:
+                push(send)
+                send = request[0](*request[1:]).send
+                value = None
+            elif stack:
+                send = pop()
+                value = request
+            else:
+                return request
+    call.__name__ = function.__name__
+    return call
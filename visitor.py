@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+# Visitors over Mini Triangle trees
+#
+# A Visitor handles each node with the method named after its class:
+# visit_WhileCommand for an ast.WhileCommand. A class with no method of its
+# own takes the one for its nearest base class(visit_Expression, say), and
+# failing that generic_visit. Which method that is gets worked out once per
+# visitor class, into a table from node class to method, so dispatching a
+# node is one dictionary lookup rather than a chain of type tests.
+#
+# The tables work for any class hierarchy: bind() and functions() build
+# them for other method prefixes(codegen.CodeGen has one for commands, one
+# for expressions, ...) or other classes, such as the IR instructions.
+#
+# A Transformer is a Visitor whose methods return a replacement for the
+# node visited. Its generic_visit replaces each child of a node(see
+# ast.AST.children) by the result of visiting it.
+#
+# Programs nest their SequentialCommands as deep as they are long, so both
+# walk a sequence with a loop rather than recursing once per command.
+#
+# Author: Wilson Giese
+#
+
+import ast
+import ir
+
+
+def node_classes(module, base):
+    """ The classes in a module deriving from base(base included) """
+    return tuple([c for c in vars(module).values()
+                  if isinstance(c, type) and issubclass(c, base)])
+
+
+AST_CLASSES = node_classes(ast, ast.AST)
+IR_CLASSES = node_classes(ir, ir.Instruction)
+
+# Method names by (visitor class, prefix, classes, default), see table()
+_tables = {}
+
+
+def table(cls, prefix, classes, default=None):
+    """ Map each of classes to the name of the method of cls handling it:
+        prefix followed by the name of the class, or of its nearest base
+        class with such a method. Classes with none map to default, or are
+        left out if it is None.
+    """
+    key = (cls, prefix, classes, default)
+    names = _tables.get(key)
+    if names is None:
+        names = {}
+        for node_class in classes:
+            for base in node_class.__mro__:
+                if hasattr(cls, prefix + base.__name__):
+                    names[node_class] = prefix + base.__name__
+                    break
+            else:
+                if default is not None:
+                    names[node_class] = default
+        _tables[key] = names
+    return names
+
+
+def bind(obj, prefix, classes=AST_CLASSES, default=None):
+    """ table() for obj's class, with obj's bound methods in place of names """
+    return dict([(c, getattr(obj, name))
+                 for c, name in table(type(obj), prefix, classes, default).items()])
+
+
+# Plain functions by the same key as _tables, see functions()
+_functions = {}
+
+
+def functions(cls, prefix, classes=AST_CLASSES, default=None):
+    """ table() with the functions of cls in place of names, to be called
+        with the visitor as their first argument. Unlike bind(), made once
+        per class rather than once per instance.
+    """
+    key = (cls, prefix, classes, default)
+    found = _functions.get(key)
+    if found is None:
+        found = {}
+        for c, name in table(cls, prefix, classes, default).items():
+            method = getattr(cls, name)
+            found[c] = getattr(method, '__func__', method)
+        _functions[key] = found
+    return found
+
+
+def sequence_slots(node):
+    """ (sequence, attribute) for each command a nested SequentialCommand
+        runs, in order: the command is getattr(sequence, attribute)
+    """
+    slots = []
+    work = [node]
+    while work:
+        item = work.pop()
+        if type(item) is tuple:
+            slots.append(item)
+            continue
+        # command1 goes on last, so it and everything in it come out first
+        for name in ('command2', 'command1'):
+            child = getattr(item, name)
+            if type(child) is ast.SequentialCommand:
+                work.append(child)
+            else:
+                work.append((item, name))
+    return slots
+
+
+class Visitor(object):
+    """ Walks a tree, calling visit_<class name>(node) for each node it
+        reaches. Subclasses define the methods for the nodes they handle,
+        and call visit() on the children they want walked.
+    """
+
+    def __init__(self):
+        self.dispatch = functions(type(self), 'visit_', AST_CLASSES,
+                                  'generic_visit')
+
+    def visit(self, node):
+        return self.dispatch[type(node)](self, node)
+
+    def visit_all(self, nodes):
+        for node in nodes:
+            self.visit(node)
+
+    def generic_visit(self, node):
+        """ Visit the children of a node """
+        for name in node.children:
+            child = getattr(node, name)
+            if type(child) is list:
+                self.visit_all(child)
+            else:
+                self.visit(child)
+
+    def visit_SequentialCommand(self, node):
+        for sequence, name in sequence_slots(node):
+            self.visit(getattr(sequence, name))
+
+
+class Transformer(Visitor):
+    """ A Visitor whose methods return the node to put in place of the one
+        visited(which may be that node, changed or not)
+    """
+
+    def visit_all(self, nodes):
+        return [self.visit(node) for node in nodes]
+
+    def generic_visit(self, node):
+        """ Replace the children of a node by what visiting them returns """
+        for name in node.children:
+            child = getattr(node, name)
+            if type(child) is list:
+                setattr(node, name, self.visit_all(child))
+            else:
+                setattr(node, name, self.visit(child))
+        return node
+
+    def visit_SequentialCommand(self, node):
+        for sequence, name in sequence_slots(node):
+            setattr(sequence, name, self.visit(getattr(sequence, name)))
+        return node
+
+
+class Copier(Transformer):
+    """ Copies a tree. Attributes other than children are shared with the
+        original. Marks the passes leave on nodes(a range loop's counter)
+        are dropped, as they refer to nodes of the original.
+    """
+
+    def generic_visit(self, node):
+        return Transformer.generic_visit(self, shallow_copy(node))
+
+    def visit_WhileCommand(self, node):
+        loop = self.generic_visit(node)
+        loop.__dict__.pop('counter', None)
+        return loop
+
+    def visit_SequentialCommand(self, node):
+        top = shallow_copy(node)
+        work = [top]
+        while work:
+            sequence = work.pop()
+            for name in ('command1', 'command2'):
+                child = getattr(sequence, name)
+                if type(child) is ast.SequentialCommand:
+                    child = shallow_copy(child)
+                    work.append(child)
+                else:
+                    child = self.visit(child)
+                setattr(sequence, name, child)
+        return top
+
+
+def shallow_copy(node):
+    type_ = type(node)
+    new = type_.__new__(type_)
+    new.__dict__ = node.__dict__.copy()
+    return new
+
+
+def copy(node):
+    """ A copy of a tree. Much quicker than copy.deepcopy. """
+    return _copier.visit(node)
+
+
+_copier = Copier()